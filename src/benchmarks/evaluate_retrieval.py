@@ -0,0 +1,311 @@
+import os
+import csv
+import sys
+import json
+import time
+import platform
+import argparse
+
+import numpy as np
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from src.document import EmbeddedDocument
+from src.embeddings import StubEmbeddingProvider, get_embedding_provider
+from src.benchmarks.run_benchmarks import get_commit
+from src.benchmarks.stand_ins import InMemoryVectorIndex, HierarchicalVectorIndex, InMemoryLexicalIndex
+from src.benchmarks.timing import summarize
+from src.rag_api_gateway.rerank import rerank
+from src.rag_api_gateway.retrieval import (
+    find_article_references,
+    find_source_references,
+    reciprocal_rank_fusion,
+    retrieve_documents
+)
+from src.rag_pipeline.configs import (
+    DataSourceConfig,
+    EMBEDDINGS_STORAGE_LAYOUT,
+    EVALUATION_RESULTS_PATH,
+    HIERARCHICAL_RETRIEVAL,
+    HYBRID_CANDIDATES,
+    RETRIEVAL_CANDIDATES,
+    RETRIEVAL_MODE
+)
+from src.rag_pipeline.registry import get_data_sources
+from src.rag_pipeline.upload_documents import load_text, segment_documents
+from src.rag_pipeline.upload_embeddings import chunk_documents, get_embeddings
+from src.utils.fake_openai import count_stub_tokens
+
+
+RECALL_AT = (1, 3, 6, 12)
+# 'topic' asks about the article by its name, 'reference' names the article number (the fast path)
+QUESTION_KINDS = ('topic', 'reference')
+
+
+class GoldenQuestion(NamedTuple):
+    question: str
+    source: str
+    article: int
+    kind: str
+
+
+class EvaluationBackend(NamedTuple):
+    name: str
+    # 'flat' or 'hierarchical'
+    vector: str
+    lexical: bool
+    article_fast_path: bool
+    rerank: bool
+
+
+# in-memory counterparts of the retrieval configurations, the last one is the default answer path
+BACKENDS = [
+    EvaluationBackend('flat', 'flat', lexical=False, article_fast_path=False, rerank=False),
+    EvaluationBackend('hierarchical', 'hierarchical', lexical=False, article_fast_path=False, rerank=False),
+    EvaluationBackend('hybrid', 'flat', lexical=True, article_fast_path=True, rerank=False),
+    EvaluationBackend('hybrid_hierarchical', 'hierarchical', lexical=True, article_fast_path=True, rerank=False),
+    EvaluationBackend('hybrid_rerank', 'flat', lexical=True, article_fast_path=True, rerank=True),
+    EvaluationBackend('hybrid_hierarchical_rerank', 'hierarchical', lexical=True, article_fast_path=True, rerank=True),
+]
+
+
+def build_golden_set(configs: List[DataSourceConfig], kinds: Tuple[str, ...] = QUESTION_KINDS) -> List[GoldenQuestion]:
+    # one question per article and kind, written from the table of contents in the schema csv
+    questions = []
+    for config in configs:
+        with open(config.schema, mode='r') as file:
+            for item in csv.DictReader(file):
+                article = int(item['article'])
+                if 'topic' in kinds:
+                    questions.append(GoldenQuestion(
+                        f'What does the {config.title} say about {item["article_name"].lower()}?',
+                        config.name, article, 'topic'
+                    ))
+                if 'reference' in kinds:
+                    questions.append(GoldenQuestion(
+                        f'What does Article {article} of the {config.title} require?', config.name, article, 'reference'
+                    ))
+
+    return questions
+
+
+def read_golden_set(path: str) -> List[GoldenQuestion]:
+    with open(path, mode='r') as file:
+        return [GoldenQuestion(**json.loads(line)) for line in file if line.strip()]
+
+
+def write_golden_set(path: str, questions: List[GoldenQuestion]) -> None:
+    with open(path, mode='w') as file:
+        for question in questions:
+            file.write(json.dumps(question._asdict()) + '\n')
+
+
+def get_ranked_articles(documents: List[EmbeddedDocument]) -> List[Tuple[Optional[str], int]]:
+    # several chunks of one article count once, at the rank of the best one
+    articles = []
+    for document in documents:
+        key = (document.source, document.article)
+        if key not in articles:
+            articles.append(key)
+
+    return articles
+
+
+def score_rankings(
+        questions: List[GoldenQuestion],
+        rankings: List[List[Tuple[Optional[str], int]]],
+        recall_at: Tuple[int, ...] = RECALL_AT
+) -> Dict[str, float]:
+    metrics = {f'recall@{k}': 0.0 for k in recall_at}
+    metrics['mrr'] = 0.0
+    for question, ranking in zip(questions, rankings):
+        expected = (question.source, question.article)
+        rank = ranking.index(expected) + 1 if expected in ranking else None
+        for k in recall_at:
+            metrics[f'recall@{k}'] += 1.0 if rank is not None and rank <= k else 0.0
+        metrics['mrr'] += 1.0 / rank if rank is not None else 0.0
+
+    return {key: value / len(questions) if questions else 0.0 for key, value in metrics.items()}
+
+
+class InMemoryRetrieval:
+    """
+    The answer path's candidate retrieval over one in-memory index of every source's chunks.
+
+    Unlike retrieve_documents, candidates are ranked across sources rather than per source.
+    """
+
+    def __init__(
+            self,
+            backend: EvaluationBackend,
+            chunks: List[EmbeddedDocument],
+            configs: List[DataSourceConfig]
+    ) -> None:
+        self.backend = backend
+        self.configs = configs
+        self.vector_index = HierarchicalVectorIndex() if backend.vector == 'hierarchical' else InMemoryVectorIndex()
+        self.vector_index.add(chunks)
+        self.lexical_index = InMemoryLexicalIndex()
+        if backend.lexical:
+            self.lexical_index.add(chunks)
+        self.source_order = {config.name: index for index, config in enumerate(configs)}
+        self.chunks = chunks
+
+    def get_article_documents(self, question: str) -> List[EmbeddedDocument]:
+        articles = find_article_references(question)
+        if not articles:
+            return []
+
+        sources = find_source_references(question, self.configs)
+        documents = [
+            chunk for chunk in self.chunks
+            if chunk.article in articles and (not sources or chunk.source in sources)
+        ]
+        return sorted(documents, key=lambda item: (self.source_order.get(item.source, 0), item.article, item.chunk or 0))
+
+    def search(self, question: str, embedding: np.ndarray, limit: int = RETRIEVAL_CANDIDATES) -> List[EmbeddedDocument]:
+        if self.backend.article_fast_path:
+            documents = self.get_article_documents(question)[:limit]
+            if documents:
+                return documents
+
+        vector_documents = self.vector_index.search(embedding, HYBRID_CANDIDATES)
+        if self.backend.lexical:
+            documents = reciprocal_rank_fusion(
+                [vector_documents, self.lexical_index.search(question, HYBRID_CANDIDATES)], limit=limit
+            )
+        else:
+            documents = vector_documents[:limit]
+
+        return rerank(question, documents, top_k=limit) if self.backend.rerank else documents
+
+
+def evaluate_backend(
+        name: str,
+        search: Callable[[str, np.ndarray], List[EmbeddedDocument]],
+        questions: List[GoldenQuestion],
+        embeddings: List[np.ndarray],
+        params: Optional[dict] = None
+) -> dict:
+    seconds = []
+    rankings = []
+    for question, embedding in zip(questions, embeddings):
+        start = time.perf_counter()
+        documents = search(question.question, embedding)
+        seconds.append(time.perf_counter() - start)
+        rankings.append(get_ranked_articles(documents))
+
+    # kinds are never averaged together, the fast path answers every 'reference' question by construction
+    metrics = {}
+    for kind in sorted({question.kind for question in questions}):
+        indexes = [index for index, question in enumerate(questions) if question.kind == kind]
+        metrics[kind] = score_rankings([questions[index] for index in indexes], [rankings[index] for index in indexes])
+
+    return {
+        'name': 'retrieval_quality',
+        'params': dict(params or {}, backend=name, questions=len(questions)),
+        'metrics': metrics,
+        'seconds': summarize(seconds),
+    }
+
+
+def load_chunks(configs: List[DataSourceConfig], provider: StubEmbeddingProvider) -> List[EmbeddedDocument]:
+    chunks = []
+    for config in configs:
+        # words as tokens keep the evaluation offline (the tiktoken encoding is downloaded on first use), only
+        # articles between the word and the token limit are chunked differently from the ingestion
+        documents = segment_documents(config, load_text(config))
+        source_chunks = get_embeddings(chunk_documents(documents, count_stub_tokens), provider)
+        for chunk in source_chunks:
+            chunk.source = config.name
+        chunks += source_chunks
+
+    return chunks
+
+
+def run_evaluation(
+        golden_path: Optional[str] = None,
+        backends: Optional[List[str]] = None,
+        postgres: bool = False,
+        output_path: Optional[str] = EVALUATION_RESULTS_PATH
+) -> dict:
+    configs = get_data_sources()
+    questions = read_golden_set(golden_path) if golden_path else build_golden_set(configs)
+
+    # deterministic offline vectors for both the chunks and the questions
+    provider = StubEmbeddingProvider()
+    chunks = load_chunks(configs, provider)
+    embeddings = [np.array(embedding) for embedding in provider.embed([item.question for item in questions]).embeddings]
+
+    results = []
+    for backend in BACKENDS:
+        if backends and backend.name not in backends:
+            continue
+
+        retrieval = InMemoryRetrieval(backend, chunks, configs)
+        results.append(evaluate_backend(
+            backend.name, retrieval.search, questions, embeddings, dict(backend._asdict(), rows=len(chunks))
+        ))
+
+    if postgres:
+        # the collections as ingested and the retrieval settings of this environment (storage layout, retrieval
+        # mode, hierarchical search), questions embedded by the configured provider
+        provider = get_embedding_provider()
+        embeddings = [np.array(embedding) for embedding in provider.embed([item.question for item in questions]).embeddings]
+        results.append(evaluate_backend(
+            'postgres',
+            lambda question, embedding: rerank(
+                question,
+                retrieve_documents(question, embedding, provider.model_name, RETRIEVAL_CANDIDATES),
+                top_k=RETRIEVAL_CANDIDATES
+            ),
+            questions,
+            embeddings,
+            {
+                'storage_layout': EMBEDDINGS_STORAGE_LAYOUT,
+                'retrieval_mode': RETRIEVAL_MODE,
+                'hierarchical': HIERARCHICAL_RETRIEVAL,
+                'embedding_model': provider.model_name,
+            }
+        ))
+
+    run = {
+        'commit': get_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'golden_set': golden_path or 'schema',
+        'results': results,
+    }
+
+    if output_path:
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, mode='a') as file:
+            file.write(json.dumps(run) + '\n')
+
+    return run
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Offline retrieval quality (recall@k, MRR) and latency per backend')
+    parser.add_argument('--golden', default=None, help='golden set jsonl, by default built from the schema csv files')
+    parser.add_argument('--write-golden', default=None, help='write the golden set built from the schema and exit')
+    parser.add_argument('--backends', nargs='*', default=None, choices=[backend.name for backend in BACKENDS])
+    parser.add_argument('--postgres', action='store_true', help='also evaluate retrieve_documents against DB_CONFIGS')
+    parser.add_argument('--output', default=EVALUATION_RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.write_golden:
+        write_golden_set(args.write_golden, build_golden_set(get_data_sources()))
+        return
+
+    run = run_evaluation(args.golden, args.backends, args.postgres, args.output)
+    json.dump(run, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
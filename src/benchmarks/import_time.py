@@ -0,0 +1,96 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+from typing import Dict, List, Optional
+
+from src.benchmarks.timing import summarize
+
+
+# what gateway workers and the ingestion CLIs import on a cold start
+ENTRY_MODULES = (
+    'src.rag_pipeline.configs',
+    'src.rag_api_gateway.get_answer',
+    'src.rag_api_gateway.server',
+    'src.rag_pipeline.upload_documents',
+    'src.rag_pipeline.upload_embeddings',
+)
+# "import time: self [us] | cumulative | imported package"
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def parse_import_time(output: str) -> List[dict]:
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append({
+                'module': module,
+                'self_seconds': int(self_us) / 1e6,
+                'cumulative_seconds': int(cumulative_us) / 1e6,
+                'depth': len(indent) // 2,
+            })
+
+    return imports
+
+
+def measure_import(module: str, top: int = 10) -> dict:
+    # a fresh interpreter per run, nothing is cached between measurements
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed: {completed.stderr.strip().splitlines()[-1:]}')
+
+    imports = parse_import_time(completed.stderr)
+    total = next(item for item in imports if item['module'] == module and item['depth'] == 0)
+    # heaviest top level packages pulled in by the module, the usual candidates for a lazy import
+    heaviest = sorted(
+        (item for item in imports if item['depth'] == 1),
+        key=lambda item: item['cumulative_seconds'],
+        reverse=True
+    )[:top]
+
+    return {
+        'seconds': total['cumulative_seconds'],
+        'modules': len(imports),
+        'heaviest': [{'module': item['module'], 'seconds': item['cumulative_seconds']} for item in heaviest],
+    }
+
+
+def bench_import_time(modules: List[str] = ENTRY_MODULES, repeat: int = 3) -> List[dict]:
+    results = []
+    for module in modules:
+        runs = [measure_import(module) for _ in range(repeat)]
+        results.append({
+            'name': 'import_time',
+            'params': {'module': module, 'modules': runs[-1]['modules'], 'heaviest': runs[-1]['heaviest']},
+            'seconds': summarize([run['seconds'] for run in runs]),
+        })
+
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Cold import time of the entry modules (python -X importtime)')
+    parser.add_argument('modules', nargs='*', default=list(ENTRY_MODULES))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results: Dict[str, dict] = {
+        result['params']['module']: result for result in bench_import_time(args.modules, args.repeat)
+    }
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import platform
+import tempfile
+import argparse
+import subprocess
+
+import numpy as np
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from openai import OpenAI
+
+from src.document import RawDocument, EmbeddedDocument
+from src.embeddings import OpenAIEmbeddingProvider, StubEmbeddingProvider
+from src.benchmarks.import_time import bench_import_time
+from src.benchmarks.stand_ins import InMemoryVectorIndex, HierarchicalVectorIndex
+from src.benchmarks.synthetic_corpus import generate_corpus, synthetic_embeddings
+from src.benchmarks.timing import measure, summarize
+from src.rag_pipeline.configs import DataSourceConfig, BENCHMARK_RESULTS_PATH, HYBRID_CANDIDATES, RETRIEVAL_LIMIT
+from src.rag_pipeline.registry import get_data_sources
+from src.rag_pipeline.price_embeddings import num_tokens_from_string
+from src.rag_pipeline.upload_documents import load_text, segment_documents
+from src.rag_pipeline.upload_embeddings import chunk_documents, get_embeddings
+from src.utils.fake_openai import FakeOpenAIServer
+
+
+BENCHMARK_COLLECTION = 'llm_legal_chatbot.benchmark_embeddings'
+EMBEDDING_BATCH_SIZES = (1, 64, 256)
+RETRIEVAL_LIMITS = (3, 12)
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_result(name: str, seconds: Dict[str, float], **params: Any) -> Dict[str, Any]:
+    return {'name': name, 'params': params, 'seconds': seconds}
+
+
+def bench_documents(
+        configs: List[DataSourceConfig],
+        repeat: int
+) -> Tuple[List[dict], Dict[str, List[RawDocument]]]:
+    results = []
+    documents = {}
+    for config in configs:
+        text = load_text(config)
+        results.append(build_result(
+            'pdf_extraction',
+            measure(lambda: load_text(config), repeat),
+            source=config.name,
+            characters=len(text),
+        ))
+
+        source_documents = segment_documents(config, text)
+        results.append(build_result(
+            'segmentation',
+            measure(lambda: segment_documents(config, text), repeat),
+            source=config.name,
+            articles=len(source_documents),
+        ))
+        documents[config.name] = source_documents
+
+    return results, documents
+
+
+def bench_chunking(
+        documents_by_source: Dict[str, List[RawDocument]],
+        repeat: int
+) -> Tuple[List[dict], Dict[str, List[EmbeddedDocument]]]:
+    documents = [document for source_documents in documents_by_source.values() for document in source_documents]
+    chunks = chunk_documents(documents)
+    contents = [document.contents for document in documents]
+
+    results = [
+        build_result(
+            'token_counting',
+            measure(lambda: [num_tokens_from_string(item) for item in contents], repeat),
+            documents=len(contents),
+            tokens=sum(chunk.tokens for chunk in chunks),
+        ),
+        build_result(
+            'chunking',
+            measure(lambda: chunk_documents(documents), repeat),
+            documents=len(documents),
+            chunks=len(chunks),
+        ),
+    ]
+
+    return results, {source: chunk_documents(source_documents) for source, source_documents in documents_by_source.items()}
+
+
+def bench_embeddings(chunks: List[EmbeddedDocument], repeat: int, latency: float) -> List[dict]:
+    results = []
+    with FakeOpenAIServer(latency=latency) as server:
+        client = OpenAI(api_key='benchmark', base_url=server.base_url)
+        for batch_size in EMBEDDING_BATCH_SIZES:
+            provider = OpenAIEmbeddingProvider(client=client, batch_size=batch_size)
+            seconds = measure(lambda: get_embeddings(chunks, provider), repeat, warmup=0)
+            results.append(build_result(
+                'embedding_throughput',
+                dict(seconds, chunks_per_second=len(chunks) / seconds['mean']),
+                batch_size=batch_size,
+                chunks=len(chunks),
+                server_latency=latency,
+            ))
+
+    return results
+
+
+def get_queries(chunks: List[EmbeddedDocument], count: int) -> List[str]:
+    step = max(len(chunks) // count, 1)
+    return [' '.join(chunk.contents.split()[:16]) for chunk in chunks[::step][:count]]
+
+
+def bench_in_memory_retrieval(chunks: List[EmbeddedDocument], queries: np.ndarray, repeat: int) -> List[dict]:
+    index = InMemoryVectorIndex()
+    results = [build_result('bulk_insert', measure(lambda: InMemoryVectorIndex().add(chunks), repeat),
+                            backend='in_memory', rows=len(chunks))]
+    index.add(chunks)
+
+    for limit in RETRIEVAL_LIMITS:
+        seconds = []
+        for query in queries:
+            seconds.append(measure(lambda: index.search(query, limit), repeat=1, warmup=0)['mean'])
+        results.append(build_result('top_k_retrieval', summarize(seconds), backend='in_memory',
+                                    rows=len(chunks), limit=limit))
+
+    return results
+
+
+def bench_hierarchical_retrieval(chunks: List[EmbeddedDocument], queries: np.ndarray, limit: int = 12) -> List[dict]:
+    # flat top-k against article-then-chunk: latency, vectors compared, distinct articles and overlap with flat
+    flat = InMemoryVectorIndex()
+    flat.add(chunks)
+    hierarchical = HierarchicalVectorIndex()
+    hierarchical.add(chunks)
+
+    results = []
+    for name, index in (('flat', flat), ('hierarchical', hierarchical)):
+        seconds, scanned, articles, overlap = [], [], [], []
+        for query in queries:
+            seconds.append(measure(lambda: index.search(query, limit), repeat=1, warmup=0)['mean'])
+            documents = index.search(query, limit)
+            expected = {id(document) for document in flat.search(query, limit)}
+
+            scanned.append(hierarchical.scanned if index is hierarchical else len(flat))
+            articles.append(len({(document.source, document.article) for document in documents}))
+            overlap.append(len([document for document in documents if id(document) in expected]) / limit)
+
+        results.append(build_result(
+            'hierarchical_retrieval',
+            summarize(seconds),
+            mode=name,
+            rows=len(chunks),
+            limit=limit,
+            vectors_scanned=sum(scanned) / len(scanned),
+            distinct_articles=sum(articles) / len(articles),
+            overlap_with_flat=sum(overlap) / len(overlap),
+        ))
+
+    return results
+
+
+def bench_postgres_retrieval(chunks: List[EmbeddedDocument], queries: np.ndarray, repeat: int) -> List[dict]:
+    from src.vector_storage import (
+        get_pool, get_conn, put_conn, create_collection, insert_embeddings, get_similar_documents
+    )
+
+    pool = get_pool()
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute(f"DROP TABLE IF EXISTS {BENCHMARK_COLLECTION}")
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+    create_collection(BENCHMARK_COLLECTION, len(chunks[0].embedding))
+
+    try:
+        results = [build_result(
+            'bulk_insert',
+            measure(lambda: insert_embeddings(BENCHMARK_COLLECTION, chunks), repeat, warmup=0),
+            backend='postgres',
+            rows=len(chunks)
+        )]
+
+        for limit in RETRIEVAL_LIMITS:
+            seconds = []
+            for query in queries:
+                seconds.append(measure(
+                    lambda: get_similar_documents(BENCHMARK_COLLECTION, query, chunks[0].embedding_model, limit),
+                    repeat=1,
+                    warmup=0
+                )['mean'])
+            results.append(build_result('top_k_retrieval', summarize(seconds), backend='postgres',
+                                        rows=len(chunks), limit=limit))
+
+        return results + bench_postgres_round_trips(chunks, queries)
+
+    finally:
+        conn = get_conn(pool)
+        try:
+            with conn:
+                cur = conn.cursor()
+                cur.execute(f"DROP TABLE IF EXISTS {BENCHMARK_COLLECTION}")
+                cur.close()
+                conn.commit()
+        finally:
+            put_conn(pool, conn)
+
+
+def bench_vector_encoding(queries: np.ndarray, repeat: int) -> List[dict]:
+    from pgvector import Vector
+    from src.vector_storage import encode_vector
+
+    # what goes over the wire for the query embedding, before (pgvector adapter) and after (compact float32)
+    results = []
+    for name, encode in (('pgvector_text', lambda query: Vector(query).to_text()), ('compact_text', encode_vector)):
+        results.append(build_result(
+            'vector_encoding',
+            measure(lambda: [encode(query) for query in queries], repeat),
+            encoding=name,
+            queries=len(queries),
+            bytes_per_query=sum(len(encode(query)) for query in queries) / len(queries),
+        ))
+
+    return results
+
+
+def bench_postgres_round_trips(chunks: List[EmbeddedDocument], queries: np.ndarray, sources: int = 2) -> List[dict]:
+    from src.vector_storage import CollectionSearch, get_similar_documents, get_lexical_documents, search_collections
+
+    # per-question overhead of the hybrid search over `sources` collections (the scratch table stands in
+    # for each of them): ad-hoc statements, one round-trip per query, against one prepared statement
+    model = chunks[0].embedding_model
+    text = ' '.join(chunks[0].contents.split()[:8])
+    collections = [CollectionSearch(BENCHMARK_COLLECTION, f'source_{index}') for index in range(sources)]
+
+    def ad_hoc(query: np.ndarray) -> None:
+        for collection in collections:
+            get_similar_documents(collection.table_name, query, model, HYBRID_CANDIDATES, collection.source)
+            get_lexical_documents(collection.table_name, text, model, HYBRID_CANDIDATES, collection.source)
+
+    def prepared(query: np.ndarray) -> None:
+        search_collections(collections, query, text, model, HYBRID_CANDIDATES, RETRIEVAL_LIMIT)
+
+    results = []
+    for name, search in (('ad_hoc', ad_hoc), ('prepared_single_round_trip', prepared)):
+        seconds = []
+        for query in queries:
+            seconds.append(measure(lambda: search(query), repeat=1, warmup=0)['mean'])
+        results.append(build_result('hybrid_search_overhead', summarize(seconds), backend='postgres',
+                                    mode=name, sources=sources, rows=len(chunks)))
+
+    return results
+
+
+def run_benchmarks(
+        repeat: int = 3,
+        postgres: bool = False,
+        queries: int = 50,
+        server_latency: float = 0.0,
+        scale: Optional[float] = None,
+        output_path: Optional[str] = BENCHMARK_RESULTS_PATH
+) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        if scale:
+            configs = [
+                generate_corpus(f'synthetic_{index + 1}', scale, synthetic_dir)
+                for index in range(len(get_data_sources()))
+            ]
+        else:
+            configs = get_data_sources()
+
+        results, documents = bench_documents(configs, repeat)
+
+    chunking_results, chunks_by_source = bench_chunking(documents, repeat)
+    chunks = [chunk for source_chunks in chunks_by_source.values() for chunk in source_chunks]
+    results += chunking_results
+    results += bench_embeddings(chunks, repeat, server_latency)
+
+    # retrieval is measured on deterministic vectors, no api involved
+    if scale:
+        embedded_chunks = [
+            chunk for source, source_chunks in chunks_by_source.items()
+            for chunk in synthetic_embeddings(source_chunks, source=source)
+        ]
+        step = max(len(embedded_chunks) // queries, 1)
+        query_vectors = np.array([chunk.embedding for chunk in embedded_chunks[::step][:queries]])
+    else:
+        embedded_chunks = get_embeddings(chunks, StubEmbeddingProvider())
+        query_vectors = np.array(StubEmbeddingProvider().embed(get_queries(chunks, queries)).embeddings)
+
+    results += bench_in_memory_retrieval(embedded_chunks, query_vectors, repeat)
+    results += bench_hierarchical_retrieval(embedded_chunks, query_vectors)
+    results += bench_vector_encoding(query_vectors, repeat)
+    results += bench_import_time(repeat=repeat)
+    if postgres:
+        results += bench_postgres_retrieval(embedded_chunks, query_vectors, repeat)
+
+    run = {
+        'commit': get_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'scale': scale,
+        'results': results,
+    }
+
+    if output_path:
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, mode='a') as file:
+            file.write(json.dumps(run) + '\n')
+
+    return run
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Offline ingestion and retrieval benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--postgres', action='store_true', help='also benchmark against DB_CONFIGS (pgvector)')
+    parser.add_argument('--server-latency', type=float, default=0.0, help='seconds added to each fake api call')
+    parser.add_argument('--scale', type=float, default=None, help='run on synthetic regulations of this relative size')
+    parser.add_argument('--output', default=BENCHMARK_RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    run = run_benchmarks(
+        repeat=args.repeat,
+        postgres=args.postgres,
+        queries=args.queries,
+        server_latency=args.server_latency,
+        scale=args.scale,
+        output_path=args.output
+    )
+    json.dump(run, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
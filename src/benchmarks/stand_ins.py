@@ -0,0 +1,181 @@
+import re
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+from src.document import EmbeddedDocument
+from src.rag_pipeline.configs import HIERARCHICAL_ARTICLES, HIERARCHICAL_CHUNKS_PER_ARTICLE
+
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+class InMemoryVectorIndex:
+    """
+    Brute force cosine index, the in-process stand-in for a pgvector collection.
+    """
+
+    def __init__(self) -> None:
+        self.documents: List[EmbeddedDocument] = []
+        self.matrix: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @staticmethod
+    def normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def add(self, documents: List[EmbeddedDocument]) -> None:
+        vectors = self.normalize(np.array([document.embedding for document in documents], dtype=np.float32))
+
+        self.documents += documents
+        self.matrix = vectors if self.matrix is None else np.vstack([self.matrix, vectors])
+
+    def search_many(
+            self,
+            embeddings: np.ndarray,
+            limit: int = 3,
+            candidates: Optional[np.ndarray] = None
+    ) -> List[List[EmbeddedDocument]]:
+        if self.matrix is None:
+            return [[] for _ in range(len(embeddings))]
+
+        matrix = self.matrix if candidates is None else self.matrix[candidates]
+        similarities = self.normalize(np.asarray(embeddings, dtype=np.float32)) @ matrix.T
+
+        limit = min(limit, matrix.shape[0])
+        results = []
+        for row in similarities:
+            top = np.argpartition(-row, limit - 1)[:limit]
+            top = top[np.argsort(-row[top])]
+            if candidates is not None:
+                top = candidates[top]
+            results.append([self.documents[index] for index in top])
+
+        return results
+
+    def search(
+            self,
+            embedding: np.ndarray,
+            limit: int = 3,
+            articles: Optional[List[int]] = None
+    ) -> List[EmbeddedDocument]:
+        candidates = None
+        if articles is not None:
+            candidates = np.array([
+                index for index, document in enumerate(self.documents) if document.article in articles
+            ], dtype=np.int64)
+            if len(candidates) == 0:
+                return []
+
+        return self.search_many(np.asarray(embedding)[np.newaxis, :], limit, candidates)[0]
+
+
+class HierarchicalVectorIndex(InMemoryVectorIndex):
+    """
+    Two-level stand-in: article centroids first, then only the chunks of the closest articles.
+    """
+
+    def __init__(
+            self,
+            articles: int = HIERARCHICAL_ARTICLES,
+            chunks_per_article: int = HIERARCHICAL_CHUNKS_PER_ARTICLE
+    ) -> None:
+        super().__init__()
+        self.articles = articles
+        self.chunks_per_article = chunks_per_article
+        self.article_keys: List[Tuple[Optional[str], int]] = []
+        self.article_chunks: List[np.ndarray] = []
+        self.centroids: Optional[np.ndarray] = None
+        # vectors compared by the last search, both levels
+        self.scanned = 0
+
+    def add(self, documents: List[EmbeddedDocument]) -> None:
+        super().add(documents)
+
+        chunks: Dict[Tuple[Optional[str], int], List[int]] = {}
+        for index, document in enumerate(self.documents):
+            chunks.setdefault((document.source, document.article), []).append(index)
+
+        self.article_keys = list(chunks)
+        self.article_chunks = [np.array(indexes, dtype=np.int64) for indexes in chunks.values()]
+        self.centroids = self.normalize(np.array([self.matrix[indexes].mean(axis=0) for indexes in self.article_chunks]))
+
+    def search(
+            self,
+            embedding: np.ndarray,
+            limit: int = 3,
+            articles: Optional[List[int]] = None
+    ) -> List[EmbeddedDocument]:
+        if self.centroids is None:
+            return []
+
+        query = self.normalize(np.asarray(embedding, dtype=np.float32))
+        article_similarities = self.centroids @ query
+        top_articles = np.argsort(-article_similarities)[:self.articles]
+
+        candidates = np.concatenate([self.article_chunks[index] for index in top_articles])
+        similarities = self.matrix[candidates] @ query
+        self.scanned = len(self.centroids) + len(candidates)
+
+        # best chunks first, at most chunks_per_article of each article
+        result: List[EmbeddedDocument] = []
+        per_article: Dict[Tuple[Optional[str], int], int] = {}
+        for index in candidates[np.argsort(-similarities)]:
+            document = self.documents[index]
+            key = (document.source, document.article)
+            if per_article.get(key, 0) < self.chunks_per_article:
+                per_article[key] = per_article.get(key, 0) + 1
+                result.append(document)
+                if len(result) == limit:
+                    break
+
+        return result
+
+
+class InMemoryLexicalIndex:
+    """
+    BM25 over lowercased words, the in-process stand-in for the full text search branch.
+
+    A document matching any word of the query is a candidate, as with the OR tsquery of get_ts_query.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.documents: List[EmbeddedDocument] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: List[int] = []
+
+    def add(self, documents: List[EmbeddedDocument]) -> None:
+        for document in documents:
+            index = len(self.documents)
+            words = WORD_PATTERN.findall(document.contents.lower())
+            self.documents.append(document)
+            self.lengths.append(len(words))
+            for word in words:
+                counts = self.postings.setdefault(word, {})
+                counts[index] = counts.get(index, 0) + 1
+
+    def search(self, query: str, limit: int = 3) -> List[EmbeddedDocument]:
+        if not self.documents:
+            return []
+
+        average_length = sum(self.lengths) / len(self.lengths)
+        scores: Dict[int, float] = {}
+        for word in set(WORD_PATTERN.findall(query.lower())):
+            counts = self.postings.get(word)
+            if not counts:
+                continue
+
+            idf = np.log(1 + (len(self.documents) - len(counts) + 0.5) / (len(counts) + 0.5))
+            for index, count in counts.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / average_length)
+                scores[index] = scores.get(index, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+
+        top = sorted(scores, key=lambda index: scores[index], reverse=True)[:limit]
+        return [self.documents[index] for index in top]
@@ -0,0 +1,247 @@
+import os
+import re
+import csv
+import sys
+import json
+import hashlib
+import argparse
+import textwrap
+
+import numpy as np
+
+from typing import IO, Dict, List, Optional
+
+from src.document import EmbeddedDocument
+from src.rag_pipeline.configs import DataSourceConfig
+from src.rag_pipeline.registry import get_data_sources
+
+
+SCHEMA_FIELDS = ['chapter', 'chapter_name', 'section', 'section_name', 'article', 'article_name', 'url']
+
+# roughly the size of one bundled regulation
+BASE_ARTICLES = 100
+ARTICLES_PER_CHAPTER = 12
+ARTICLES_PER_SECTION = 5
+# words per article, lognormal like the real regulations (a few very long definition articles)
+ARTICLE_WORDS_MEDIAN = 300
+ARTICLE_WORDS_SIGMA = 0.8
+ARTICLE_WORDS_RANGE = (20, 8000)
+WORD_PATTERN = re.compile(r'[a-z][a-z-]*')
+PDF_LINE_WIDTH = 100
+PDF_LINES_PER_PAGE = 70
+
+LEGAL_TERMS = [
+    'controller', 'processor', 'personal', 'data', 'processing', 'supervisory', 'authority', 'member', 'state',
+    'union', 'provider', 'deployer', 'system', 'risk', 'high-risk', 'conformity', 'assessment', 'notified',
+    'body', 'obligation', 'right', 'subject', 'consent', 'lawful', 'purpose', 'transparency', 'information',
+    'measure', 'technical', 'organisational', 'security', 'breach', 'notification', 'impact', 'protection',
+    'officer', 'certification', 'code', 'conduct', 'transfer', 'third', 'country', 'international',
+    'organisation', 'penalty', 'fine', 'infringement', 'market', 'surveillance', 'registration', 'database',
+    'documentation', 'record', 'human', 'oversight', 'accuracy', 'robustness', 'cybersecurity', 'general-purpose',
+    'model', 'systemic', 'sandbox', 'innovation', 'commission', 'board', 'committee', 'delegated', 'act',
+    'implementing', 'paragraph', 'pursuant', 'accordance', 'referred', 'laid', 'down', 'shall', 'may', 'where',
+    'unless', 'including', 'appropriate', 'necessary', 'relevant', 'competent', 'national', 'public', 'interest',
+]
+
+
+def get_vocabulary() -> List[str]:
+    # legal terms plus every word of the real article names, "Article" itself is left out so it only
+    # ever appears in headings
+    words = set(LEGAL_TERMS)
+    for data_source in get_data_sources():
+        with open(data_source.schema, mode='r') as file:
+            for item in csv.DictReader(file):
+                words.update(
+                    word.strip('(),.;:').lower() for word in item['article_name'].split()
+                    if word.strip('(),.;:')
+                )
+
+    return sorted(
+        word for word in words
+        if WORD_PATTERN.fullmatch(word) and word not in ('article', 'articles')
+    )
+
+
+def get_seed(*parts: object) -> int:
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def generate_table_of_contents(name: str, articles: int, rng: np.random.Generator, vocabulary: List[str]) -> List[dict]:
+    table_of_contents = []
+    for article in range(1, articles + 1):
+        chapter = (article - 1) // ARTICLES_PER_CHAPTER + 1
+        # every other chapter is split into sections, like the real regulations
+        section = ((article - 1) % ARTICLES_PER_CHAPTER) // ARTICLES_PER_SECTION + 1 if chapter % 2 == 0 else None
+
+        table_of_contents.append({
+            'chapter': chapter,
+            'chapter_name': ' '.join(rng.choice(vocabulary, 3)).capitalize(),
+            'section': section or '',
+            'section_name': ' '.join(rng.choice(vocabulary, 3)).capitalize() if section else '',
+            'article': article,
+            'article_name': ' '.join(rng.choice(vocabulary, int(rng.integers(1, 6)))).capitalize(),
+            'url': f'https://example.org/{name}/article/{article}/',
+        })
+
+    # chapter and section names are shared by all their articles
+    chapter_names: Dict[int, str] = {}
+    section_names: Dict[tuple, str] = {}
+    for item in table_of_contents:
+        item['chapter_name'] = chapter_names.setdefault(item['chapter'], item['chapter_name'])
+        if item['section']:
+            item['section_name'] = section_names.setdefault((item['chapter'], item['section']), item['section_name'])
+
+    return table_of_contents
+
+
+def generate_article_text(item: dict, key_word: str, rng: np.random.Generator, vocabulary: List[str]) -> str:
+    low, high = ARTICLE_WORDS_RANGE
+    total_words = int(np.clip(rng.lognormal(np.log(ARTICLE_WORDS_MEDIAN), ARTICLE_WORDS_SIGMA), low, high))
+
+    paragraphs = []
+    remaining = total_words
+    while remaining > 0:
+        size = min(remaining, int(rng.integers(20, 120)))
+        words = rng.choice(vocabulary, size)
+        paragraphs.append(f'{len(paragraphs) + 1}. ' + ' '.join(words).capitalize() + '.')
+        remaining -= size
+
+    return f'\n{key_word} {item["article"]}\n{item["article_name"]}\n' + '\n'.join(paragraphs) + '\n'
+
+
+def write_pdf(text_path: str, pdf_path: str) -> int:
+    import pymupdf
+
+    document = pymupdf.open()
+    with open(text_path, mode='r') as file:
+        lines: List[str] = []
+        for line in file:
+            lines += textwrap.wrap(line.rstrip('\n'), PDF_LINE_WIDTH) or ['']
+            while len(lines) >= PDF_LINES_PER_PAGE:
+                page = document.new_page()
+                page.insert_text((36, 36), '\n'.join(lines[:PDF_LINES_PER_PAGE]), fontsize=7)
+                lines = lines[PDF_LINES_PER_PAGE:]
+        if lines:
+            page = document.new_page()
+            page.insert_text((36, 36), '\n'.join(lines), fontsize=7)
+
+    page_count = document.page_count
+    document.save(pdf_path)
+    document.close()
+
+    return page_count
+
+
+def generate_corpus(
+        name: str,
+        scale: float,
+        output_dir: str,
+        seed: int = 0,
+        pdf: bool = False,
+        key_word: str = 'Article'
+) -> DataSourceConfig:
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(get_seed(seed, name))
+    vocabulary = get_vocabulary()
+
+    table_of_contents = generate_table_of_contents(name, max(int(BASE_ARTICLES * scale), 2), rng, vocabulary)
+
+    schema_path = os.path.join(output_dir, f'{name}.csv')
+    with open(schema_path, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=SCHEMA_FIELDS)
+        writer.writeheader()
+        writer.writerows(table_of_contents)
+
+    # articles are streamed to disk, the 1000x corpora do not need to fit in memory twice
+    text_path = os.path.join(output_dir, f'{name}.txt')
+    with open(text_path, mode='w') as file:
+        write_articles(file, table_of_contents, key_word, rng, vocabulary)
+
+    content_path = text_path
+    end_page = 0
+    if pdf:
+        content_path = os.path.join(output_dir, f'{name}.pdf')
+        end_page = write_pdf(text_path, content_path)
+
+    return DataSourceConfig(
+        name=name,
+        title=name.replace('_', ' ').title(),
+        table_name=f'llm_legal_chatbot.{name}_documents',
+        collection_name=f'llm_legal_chatbot.{name}_embeddings',
+        content=content_path,
+        schema=schema_path,
+        key_word=key_word,
+        start_page=0,
+        # page range only applies to pdf content
+        end_page=end_page,
+        updated_at='2024-01-01',
+    )
+
+
+def write_articles(
+        file: IO[str],
+        table_of_contents: List[dict],
+        key_word: str,
+        rng: np.random.Generator,
+        vocabulary: List[str]
+) -> None:
+    file.write('Synthetic regulation\n')
+    for item in table_of_contents:
+        file.write(generate_article_text(item, key_word, rng, vocabulary))
+
+
+def synthetic_embeddings(
+        documents: List[EmbeddedDocument],
+        dimensions: int = 1536,
+        seed: int = 0,
+        spread: float = 0.5,
+        source: Optional[str] = None
+) -> List[EmbeddedDocument]:
+    # deterministic vectors clustered per article: a shared article direction plus per chunk noise
+    result = []
+    for document in documents:
+        document_source = document.source or source
+        center = np.random.default_rng(get_seed(seed, document_source, document.article)).standard_normal(dimensions)
+        noise = np.random.default_rng(
+            get_seed(seed, document_source, document.article, document.chunk, document.contents[:64])
+        ).standard_normal(dimensions)
+
+        vector = center + spread * noise
+        vector /= np.linalg.norm(vector)
+
+        result.append(EmbeddedDocument(
+            chapter=document.chapter,
+            section=document.section,
+            article=document.article,
+            url=document.url,
+            contents=document.contents,
+            tokens=document.tokens,
+            chunk=document.chunk,
+            embedding=vector.tolist(),
+            embedding_model=f'synthetic-{dimensions}',
+            source=document_source,
+        ))
+
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Generate synthetic regulations for scale testing')
+    parser.add_argument('--scale', type=float, default=10, help='size relative to one bundled regulation')
+    parser.add_argument('--sources', type=int, default=2, help='number of regulations to generate')
+    parser.add_argument('--output', default='reports/synthetic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pdf', action='store_true', help='also render the text to pdf')
+    args = parser.parse_args(argv)
+
+    configs = [
+        generate_corpus(f'synthetic_{index + 1}', args.scale, args.output, args.seed, args.pdf)
+        for index in range(args.sources)
+    ]
+    json.dump([config._asdict() for config in configs], sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
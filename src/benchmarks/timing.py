@@ -0,0 +1,39 @@
+import math
+import time
+
+from typing import Any, Callable, Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    # nearest-rank percentile, q in [0, 100]
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    return {
+        'iterations': len(seconds),
+        'mean': sum(seconds) / len(seconds) if seconds else 0.0,
+        'min': min(seconds) if seconds else 0.0,
+        'max': max(seconds) if seconds else 0.0,
+        'p50': percentile(seconds, 50),
+        'p95': percentile(seconds, 95),
+        'p99': percentile(seconds, 99),
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+
+    return summarize(seconds)
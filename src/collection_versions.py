@@ -0,0 +1,337 @@
+import datetime
+import itertools
+
+from typing import Iterable, List, NamedTuple, Optional
+from pgvector.psycopg2 import register_vector
+
+from src.document import EmbeddedDocument
+from src.rag_pipeline.configs import (
+    COLLECTION_VERSIONS_TABLE,
+    COLLECTION_VERSIONS_RETAINED,
+    COLLECTION_VECTOR_INDEX,
+    COLLECTION_BUILD_TIMEOUT_HOURS,
+    EMBEDDINGS_DIMENSIONS
+)
+from src.vector_storage import (
+    get_pool,
+    get_conn,
+    put_conn,
+    get_index_name,
+    get_vector_dimensions,
+    get_centroids_table,
+    build_article_centroids,
+    create_collection_table,
+    create_collection_indexes,
+    ensure_collection_schema,
+    write_embeddings
+)
+
+
+# explicit column list, CREATE OR REPLACE VIEW only accepts a new table with the same columns in the same order
+VIEW_COLUMNS = 'id, chapter, section, article, url, contents, tokens, chunk, embedding, embedding_model'
+CENTROID_VIEW_COLUMNS = 'embedding_model, chapter, section, article, chunks, embedding'
+
+
+class CollectionVersion(NamedTuple):
+    collection_name: str
+    version: int
+    table_name: str
+    embedding_model: Optional[str]
+    rows: Optional[int]
+    # 'building', 'active', 'retired', 'failed' or 'dropped'
+    status: str
+    created_at: Optional[datetime.datetime] = None
+    activated_at: Optional[datetime.datetime] = None
+
+
+def get_version_table_name(collection_name: str, version: int) -> str:
+    return f'{collection_name}_v{version}'
+
+
+def ensure_versions_table(cur) -> None:
+    if '.' in COLLECTION_VERSIONS_TABLE:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {COLLECTION_VERSIONS_TABLE.split('.')[0]}")
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {COLLECTION_VERSIONS_TABLE} (
+        collection_name TEXT NOT NULL
+        , version INTEGER NOT NULL
+        , table_name TEXT NOT NULL
+        , embedding_model TEXT
+        , rows INTEGER
+        , status TEXT NOT NULL
+        , created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        , activated_at TIMESTAMPTZ
+        , PRIMARY KEY (collection_name, version)
+    )
+    """)
+
+
+def adopt_legacy_collection(cur, collection_name: str) -> None:
+    # a collection written before versioning is a plain table, it becomes version 0 behind the view
+    cur.execute(
+        """SELECT relkind FROM pg_class WHERE oid = to_regclass(%(collection)s)""",
+        {'collection': collection_name}
+    )
+    row = cur.fetchone()
+    if row is None or row[0] != 'r':
+        return
+
+    # the table keeps its rows as version 0, bring it to the current schema (columns, model tags, indexes) first
+    ensure_collection_schema(cur, collection_name)
+    table_name = get_version_table_name(collection_name, 0)
+    cur.execute(f"""ALTER TABLE {collection_name} RENAME TO {table_name.split('.')[-1]}""")
+    cur.execute(f"""CREATE VIEW {collection_name} AS SELECT {VIEW_COLUMNS} FROM {table_name}""")
+    build_article_centroids(cur, table_name)
+    # centroids a migration built for the plain table are replaced by the view over the version's own
+    cur.execute(f"""DROP TABLE IF EXISTS {get_centroids_table(collection_name)}""")
+    cur.execute(
+        f"""CREATE OR REPLACE VIEW {get_centroids_table(collection_name)} AS """
+        f"""SELECT {CENTROID_VIEW_COLUMNS} FROM {get_centroids_table(table_name)}"""
+    )
+    cur.execute(
+        f"""
+        INSERT INTO {COLLECTION_VERSIONS_TABLE} (collection_name, version, table_name, rows, status, activated_at)
+        SELECT %(collection)s, 0, %(table)s, count(*), 'active', now() FROM {table_name}
+        """,
+        {'collection': collection_name, 'table': table_name}
+    )
+
+
+def create_vector_index(cur, table_name: str, rows: int, index_type: str = COLLECTION_VECTOR_INDEX) -> None:
+    # operator class matches the cosine distance (<=>) used by get_similar_documents
+    if index_type == 'hnsw':
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS {get_index_name(table_name, 'embedding_idx')} """
+            f"""ON {table_name} USING hnsw (embedding vector_cosine_ops)"""
+        )
+    elif index_type == 'ivfflat':
+        # pgvector guideline: rows / 1000 lists up to a million rows
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS {get_index_name(table_name, 'embedding_idx')} """
+            f"""ON {table_name} USING ivfflat (embedding vector_cosine_ops) WITH (lists = {max(rows // 1000, 1)})"""
+        )
+    elif index_type != 'none':
+        raise ValueError(f'Unknown vector index {index_type}, expected hnsw, ivfflat or none')
+
+
+def fetch_versions(cur, collection_name: str) -> List[CollectionVersion]:
+    cur.execute(
+        f"""
+        SELECT {', '.join(CollectionVersion._fields)}
+        FROM {COLLECTION_VERSIONS_TABLE}
+        WHERE collection_name = %(collection)s
+        ORDER BY version DESC
+        """,
+        {'collection': collection_name}
+    )
+    return [CollectionVersion(*row) for row in cur.fetchall()]
+
+
+# TODO: extend SqlEngine class
+def list_collection_versions(collection_name: str) -> List[CollectionVersion]:
+    pool = get_pool()
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            ensure_versions_table(cur)
+            versions = fetch_versions(cur, collection_name)
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+    return versions
+
+
+# TODO: extend SqlEngine class
+def build_collection_version(
+        collection_name: str,
+        documents: Iterable[EmbeddedDocument],
+        dimensions: Optional[int] = None,
+        retain: int = COLLECTION_VERSIONS_RETAINED
+) -> CollectionVersion:
+    pool = get_pool()
+
+    # every version is a new table, sized for the model that embedded it (e.g. 384 for a local model)
+    documents = iter(documents)
+    first = next(documents, None)
+    if first is not None:
+        documents = itertools.chain([first], documents)
+        if dimensions is None and first.embedding is not None:
+            dimensions = len(first.embedding)
+    dimensions = dimensions or EMBEDDINGS_DIMENSIONS
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            register_vector(conn)
+            cur = conn.cursor()
+
+            ensure_versions_table(cur)
+            # serializes version numbering of concurrent builds of the same collection
+            cur.execute("""SELECT pg_advisory_xact_lock(hashtext(%(collection)s))""", {'collection': collection_name})
+            adopt_legacy_collection(cur, collection_name)
+            cur.execute(
+                f"""SELECT COALESCE(MAX(version), 0) + 1 FROM {COLLECTION_VERSIONS_TABLE} WHERE collection_name = %(collection)s""",
+                {'collection': collection_name}
+            )
+            version = cur.fetchone()[0]
+            table_name = get_version_table_name(collection_name, version)
+            cur.execute(
+                f"""
+                INSERT INTO {COLLECTION_VERSIONS_TABLE} (collection_name, version, table_name, status)
+                VALUES (%(collection)s, %(version)s, %(table)s, 'building')
+                """,
+                {'collection': collection_name, 'version': version, 'table': table_name}
+            )
+            conn.commit()
+
+            try:
+                # the new version is loaded and indexed off to the side, readers stay on the active one
+                create_collection_table(cur, table_name, dimensions)
+                write_embeddings(cur, table_name, documents)
+                cur.execute(f"""SELECT count(*), MIN(embedding_model) FROM {table_name}""")
+                rows, embedding_model = cur.fetchone()
+                create_collection_indexes(cur, table_name)
+                create_vector_index(cur, table_name, rows)
+                build_article_centroids(cur, table_name)
+                cur.execute(
+                    f"""
+                    UPDATE {COLLECTION_VERSIONS_TABLE}
+                    SET rows = %(rows)s, embedding_model = %(embedding_model)s
+                    WHERE collection_name = %(collection)s AND version = %(version)s
+                    """,
+                    {'rows': rows, 'embedding_model': embedding_model, 'collection': collection_name, 'version': version}
+                )
+                conn.commit()
+                cur.execute(f"""ANALYZE {table_name}""")
+                conn.commit()
+
+            except Exception:
+                conn.rollback()
+                cur.execute(f"""DROP TABLE IF EXISTS {get_centroids_table(table_name)}""")
+                cur.execute(f"""DROP TABLE IF EXISTS {table_name}""")
+                cur.execute(
+                    f"""UPDATE {COLLECTION_VERSIONS_TABLE} SET status = 'failed' WHERE collection_name = %(collection)s AND version = %(version)s""",
+                    {'collection': collection_name, 'version': version}
+                )
+                conn.commit()
+                raise
+
+            cur.close()
+    finally:
+        put_conn(pool, conn)
+
+    activate_collection_version(collection_name, version)
+    garbage_collect_versions(collection_name, retain)
+
+    return CollectionVersion(collection_name, version, table_name, embedding_model, rows, 'active')
+
+
+# TODO: extend SqlEngine class
+def activate_collection_version(collection_name: str, version: int) -> None:
+    pool = get_pool()
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+
+            cur.execute(
+                f"""SELECT table_name, status FROM {COLLECTION_VERSIONS_TABLE} WHERE collection_name = %(collection)s AND version = %(version)s""",
+                {'collection': collection_name, 'version': version}
+            )
+            row = cur.fetchone()
+            if row is None or row[1] in ('failed', 'dropped'):
+                cur.close()
+                conn.rollback()
+                raise ValueError(f'Version {version} of {collection_name} cannot be activated')
+
+            # the flip is a single catalog update, queries planned after the commit read the new table
+            # a view column cannot change type, a version of another vector size replaces the views instead
+            if get_vector_dimensions(cur, collection_name) not in (None, get_vector_dimensions(cur, row[0])):
+                cur.execute(f"""DROP VIEW IF EXISTS {get_centroids_table(collection_name)}""")
+                cur.execute(f"""DROP VIEW {collection_name}""")
+            cur.execute(f"""CREATE OR REPLACE VIEW {collection_name} AS SELECT {VIEW_COLUMNS} FROM {row[0]}""")
+            # the article centroids flip together with the chunks they summarize
+            cur.execute(
+                f"""CREATE OR REPLACE VIEW {get_centroids_table(collection_name)} AS """
+                f"""SELECT {CENTROID_VIEW_COLUMNS} FROM {get_centroids_table(row[0])}"""
+            )
+            cur.execute(
+                f"""UPDATE {COLLECTION_VERSIONS_TABLE} SET status = 'retired' WHERE collection_name = %(collection)s AND status = 'active'""",
+                {'collection': collection_name}
+            )
+            cur.execute(
+                f"""
+                UPDATE {COLLECTION_VERSIONS_TABLE}
+                SET status = 'active', activated_at = now()
+                WHERE collection_name = %(collection)s AND version = %(version)s
+                """,
+                {'collection': collection_name, 'version': version}
+            )
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+
+def rollback_collection_version(collection_name: str, version: Optional[int] = None) -> CollectionVersion:
+    # without a version, go back to the most recent retired one older than the active one
+    versions = list_collection_versions(collection_name)
+    active = next((item for item in versions if item.status == 'active'), None)
+
+    if version is None:
+        candidates = [
+            item for item in versions
+            if item.status == 'retired' and (active is None or item.version < active.version)
+        ]
+    else:
+        candidates = [item for item in versions if item.version == version and item.status == 'retired']
+
+    if not candidates:
+        raise ValueError(f'No retained version of {collection_name} to roll back to')
+
+    activate_collection_version(collection_name, candidates[0].version)
+    return candidates[0]._replace(status='active')
+
+
+# TODO: extend SqlEngine class
+def garbage_collect_versions(
+        collection_name: str,
+        retain: int = COLLECTION_VERSIONS_RETAINED,
+        build_timeout_hours: float = COLLECTION_BUILD_TIMEOUT_HOURS
+) -> List[CollectionVersion]:
+    pool = get_pool()
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+
+            versions = fetch_versions(cur, collection_name)
+            # the active version always counts towards the retained ones, failed builds are never kept,
+            # nor builds left 'building' by a process that died before it could mark them failed
+            retired = [item for item in versions if item.status == 'retired']
+            stale_before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=build_timeout_hours)
+            abandoned = [
+                item for item in versions
+                if item.status == 'building' and item.created_at is not None and item.created_at < stale_before
+            ]
+            expired = retired[max(retain - 1, 0):] + [item for item in versions if item.status == 'failed'] + abandoned
+            for item in expired:
+                cur.execute(f"""DROP TABLE IF EXISTS {get_centroids_table(item.table_name)}""")
+                cur.execute(f"""DROP TABLE IF EXISTS {item.table_name}""")
+                cur.execute(
+                    f"""UPDATE {COLLECTION_VERSIONS_TABLE} SET status = 'dropped' WHERE collection_name = %(collection)s AND version = %(version)s""",
+                    {'collection': collection_name, 'version': item.version}
+                )
+
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+    return expired
@@ -16,8 +16,15 @@ class RawDocument(BaseModel):
 
 
 class EmbeddedDocument(BaseModel):
+    chapter: Optional[int] = None
+    section: Optional[int] = None
     article: int
     url: str
     contents: str
     tokens: int
+    # position of the chunk within its article
+    chunk: Optional[int] = None
     embedding: Optional[List[float]] = None
+    embedding_model: Optional[str] = None
+    # data source name, set on retrieval
+    source: Optional[str] = None
@@ -13,6 +13,9 @@ from src.utils.sql import SqlEngine
 
 
 class DocumentsStorage(Protocol):
+    def create_table(self, table_name: str) -> None:
+        ...
+
     def list_documents(self, table_name: str) -> Iterable[RawDocument]:
         ...
 
@@ -26,6 +29,27 @@ class RemoteDocumentsStorage(DocumentsStorage):
     def __init__(self, sql: SqlEngine) -> None:
         self.sql = sql
 
+    def create_table(self, table_name: str) -> None:
+        schema_name = table_name.split('.')[0] if '.' in table_name else None
+        q = f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            chapter INTEGER NOT NULL
+            , chapter_name TEXT
+            , section INTEGER
+            , section_name TEXT
+            , article INTEGER PRIMARY KEY
+            , article_name TEXT
+            , url TEXT
+            , contents TEXT
+            , updated_time TIMESTAMP
+        )
+        """
+
+        with self.sql.begin_transaction() as tx:
+            if schema_name:
+                tx.execute_statement(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
+            tx.execute_statement(q)
+
     def list_documents(self, table_name: str) -> Iterable[RawDocument]:
         q = f"""
         SELECT 
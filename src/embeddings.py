@@ -0,0 +1,170 @@
+import time
+
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+from typing_extensions import Protocol
+
+from src.rag_pipeline.configs import (
+    EMBEDDINGS_MODEL,
+    EMBEDDINGS_PROVIDER,
+    EMBEDDINGS_REQUEST_BATCH_SIZE,
+    EMBEDDINGS_MAX_RETRIES,
+    LOCAL_EMBEDDINGS_MODEL,
+    LOCAL_EMBEDDINGS_BACKEND,
+    LOCAL_EMBEDDINGS_THREADS,
+    LOCAL_EMBEDDINGS_BATCH_SIZE
+)
+from src.utils.iteration import batch_by
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+
+def get_retryable_errors() -> tuple:
+    # the openai package takes most of a second to import, only providers that call it pay for it
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    return APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+
+class EmbeddingResult(NamedTuple):
+    embeddings: List[List[float]]
+    # tokens billed by the provider, 0 for local inference
+    tokens: int
+    api_calls: int = 0
+    retries: int = 0
+
+
+class EmbeddingProvider(Protocol):
+    # every collection row is tagged with the model it was embedded with
+    model_name: str
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        ...
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    client: 'OpenAI'
+
+    def __init__(
+            self,
+            model_name: str = EMBEDDINGS_MODEL,
+            client: Optional['OpenAI'] = None,
+            batch_size: int = EMBEDDINGS_REQUEST_BATCH_SIZE,
+            max_retries: int = EMBEDDINGS_MAX_RETRIES,
+    ) -> None:
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI()
+
+        self.model_name = model_name
+        self.client = client
+        # retries are done here rather than inside the client so that they can be counted
+        self.embeddings_client = self.client.with_options(max_retries=0)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+
+    def create_embeddings(self, texts: List[str]) -> tuple:
+        retryable_errors = get_retryable_errors()
+        retries = 0
+        while True:
+            try:
+                response = self.embeddings_client.embeddings.create(input=texts, model=self.model_name)
+                return response, retries
+            except retryable_errors:
+                if retries >= self.max_retries:
+                    raise
+                time.sleep(min(2 ** retries, 30))
+                retries += 1
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        embeddings = []
+        tokens = 0
+        api_calls = 0
+        retries = 0
+        for texts_batch in batch_by(texts, self.batch_size):
+            response, batch_retries = self.create_embeddings([text.replace("\n", " ") for text in texts_batch])
+
+            embeddings += [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            tokens += response.usage.total_tokens
+            api_calls += 1 + batch_retries
+            retries += batch_retries
+
+        return EmbeddingResult(embeddings=embeddings, tokens=tokens, api_calls=api_calls, retries=retries)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    def __init__(
+            self,
+            model_name: str = LOCAL_EMBEDDINGS_MODEL,
+            backend: str = LOCAL_EMBEDDINGS_BACKEND,
+            threads: int = LOCAL_EMBEDDINGS_THREADS,
+            batch_size: int = LOCAL_EMBEDDINGS_BATCH_SIZE,
+    ) -> None:
+        self.model_name = model_name
+        self.backend = backend
+        self.threads = threads
+        self.batch_size = batch_size
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            try:
+                import torch
+                from sentence_transformers import SentenceTransformer
+            except ImportError as err:
+                raise ImportError(
+                    'Local embeddings require sentence-transformers: pip install sentence-transformers'
+                ) from err
+
+            torch.set_num_threads(self.threads)
+
+            model_kwargs = {'device': 'cpu'}
+            if self.backend != 'torch':
+                model_kwargs['backend'] = self.backend
+            self._model = SentenceTransformer(self.model_name, **model_kwargs)
+
+        return self._model
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+
+        return EmbeddingResult(embeddings=embeddings.tolist(), tokens=0)
+
+
+class StubEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, model_name: str = 'stub') -> None:
+        self.model_name = model_name
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        from src.utils.fake_openai import stub_embedding, count_stub_tokens
+
+        return EmbeddingResult(
+            embeddings=[stub_embedding(text) for text in texts],
+            tokens=sum(count_stub_tokens(text) for text in texts),
+        )
+
+
+EMBEDDING_PROVIDERS = {
+    'openai': OpenAIEmbeddingProvider,
+    'local': LocalEmbeddingProvider,
+    'stub': StubEmbeddingProvider,
+}
+
+_providers: Dict[str, EmbeddingProvider] = {}
+
+
+def get_embedding_provider(name: str = EMBEDDINGS_PROVIDER) -> EmbeddingProvider:
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f'Unknown embeddings provider {name}, expected one of {list(EMBEDDING_PROVIDERS)}')
+
+    if name not in _providers:
+        _providers[name] = EMBEDDING_PROVIDERS[name]()
+
+    return _providers[name]
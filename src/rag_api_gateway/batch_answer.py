@@ -0,0 +1,239 @@
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+import traceback
+import contextvars
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from src.document import EmbeddedDocument
+from src.embeddings import get_embedding_provider
+from src.rag_api_gateway.get_answer import (
+    build_messages,
+    get_completion_from_messages,
+    get_query_embedding_arrays,
+    get_question_key,
+    rerank_and_build_context
+)
+from src.rag_api_gateway.retrieval import get_document_key, retrieve_documents_batch
+from src.rag_pipeline.configs import (
+    BATCH_RETRIEVAL_CONNECTIONS,
+    BATCH_SEARCH_QUESTIONS,
+    BATCH_COMPLETION_WORKERS,
+    BATCH_COMPLETIONS_PER_MINUTE,
+    RETRIEVAL_CANDIDATES
+)
+from src.utils.iteration import batch_by
+from src.utils.rate_limit import RateLimiter
+from src.utils.tracing import tracer
+from src.vector_storage import RetrievalFilter
+
+
+class BatchAnswer(NamedTuple):
+    # position of the question in the input
+    index: int
+    question: str
+    answer: Optional[str]
+    error: Optional[str]
+    # answered once for an identical earlier question of the batch
+    coalesced: bool
+    # seconds: embed and retrieve are the shared batch calls, queue, rerank, rate_limit and completion are
+    # this question's own, total is from the start of the batch
+    timings: Dict[str, float]
+
+
+class BatchAnswerer:
+    """
+    Many questions through the answer path at once.
+
+    Identical questions are answered once, all questions are embedded in one provider call and searched
+    search_size at a time in a single statement, chunks shared by several questions are kept once.
+    Completions run on `workers` threads, at most per_minute started per minute.
+    At most retrieval_connections searches run at once across all the batches of this answerer.
+    Answers are yielded as they finish, not in input order.
+    """
+
+    def __init__(
+            self,
+            search_size: int = BATCH_SEARCH_QUESTIONS,
+            workers: int = BATCH_COMPLETION_WORKERS,
+            per_minute: int = BATCH_COMPLETIONS_PER_MINUTE,
+            retrieval_connections: int = BATCH_RETRIEVAL_CONNECTIONS
+    ) -> None:
+        self.search_size = search_size
+        self.workers = workers
+        self.limiter = RateLimiter(per_minute)
+        self.retrieval_slots = threading.BoundedSemaphore(retrieval_connections)
+        # totals over every batch, batches of concurrent requests update them from their own threads
+        self.stats = {'questions': 0, 'unique_questions': 0, 'retrieved_chunks': 0, 'distinct_chunks': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, **increments: int) -> None:
+        with self.stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def answer(self, questions: List[str], filters: Optional[RetrievalFilter] = None) -> Iterator[BatchAnswer]:
+        start = time.perf_counter()
+
+        # input positions of every distinct question
+        positions: Dict[Tuple, List[int]] = {}
+        for index, question in enumerate(questions):
+            positions.setdefault(get_question_key(question, filters), []).append(index)
+        unique = [questions[indexes[0]] for indexes in positions.values()]
+        unique_positions = list(positions.values())
+
+        self.count(questions=len(questions), unique_questions=len(unique))
+
+        embed_start = time.perf_counter()
+        embedding_arrays = get_query_embedding_arrays(unique) if unique else []
+        embed_seconds = time.perf_counter() - embed_start
+
+        # one object per chunk across the whole batch, questions retrieving the same chunk share it
+        shared: Dict[tuple, EmbeddedDocument] = {}
+        futures: Dict[Future, int] = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch_answer')
+        try:
+            for indexes in batch_by(range(len(unique)), self.search_size):
+                retrieve_start = time.perf_counter()
+                try:
+                    # the batch's own share of the connection pool, the answer path keeps the rest
+                    with self.retrieval_slots, tracer.span('retrieve', questions=len(indexes)):
+                        candidates = retrieve_documents_batch(
+                            queries=[unique[index] for index in indexes],
+                            embedding_arrays=[embedding_arrays[index] for index in indexes],
+                            embedding_model=get_embedding_provider().model_name,
+                            limit=RETRIEVAL_CANDIDATES,
+                            filters=filters
+                        )
+                except Exception as err:
+                    print(f'Error: {err}')
+                    print(traceback.format_exc())
+                    for index in indexes:
+                        yield from self.build_answers(
+                            questions, unique_positions[index], None, repr(err), {'embed': embed_seconds}, start
+                        )
+                    continue
+
+                timings = {'embed': embed_seconds, 'retrieve': time.perf_counter() - retrieve_start}
+                for index, documents in zip(indexes, candidates):
+                    self.count(retrieved_chunks=len(documents))
+                    documents = [shared.setdefault(get_document_key(document), document) for document in documents]
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        self.answer_question, unique[index], documents, dict(timings, submitted=time.perf_counter())
+                    )
+                    futures[future] = index
+
+                # answers finished meanwhile go out before the next slice is searched
+                yield from self.collect(questions, unique_positions, futures, start, block=False)
+
+            self.count(distinct_chunks=len(shared))
+            yield from self.collect(questions, unique_positions, futures, start, block=True)
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def answer_question(
+            self,
+            question: str,
+            documents: List[EmbeddedDocument],
+            timings: Dict[str, float]
+    ) -> Tuple[Optional[str], Optional[str], Dict[str, float]]:
+        timings['queue'] = time.perf_counter() - timings.pop('submitted')
+        try:
+            with tracer.span('answer', batch=True):
+                step_start = time.perf_counter()
+                context = rerank_and_build_context(question, documents)
+                timings['rerank'] = time.perf_counter() - step_start
+
+                timings['rate_limit'] = self.limiter.acquire()
+
+                step_start = time.perf_counter()
+                answer = get_completion_from_messages(build_messages(question, context))
+                timings['completion'] = time.perf_counter() - step_start
+
+            return answer, None, timings
+
+        except Exception as err:
+            print(f'Error: {err}')
+            print(traceback.format_exc())
+            return None, repr(err), timings
+
+    def collect(
+            self,
+            questions: List[str],
+            unique_positions: List[List[int]],
+            futures: Dict[Future, int],
+            start: float,
+            block: bool
+    ) -> Iterator[BatchAnswer]:
+        while futures:
+            done: Set[Future] = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)[0]
+            if not done:
+                return
+
+            for future in done:
+                index = futures.pop(future)
+                answer, error, timings = future.result()
+                yield from self.build_answers(questions, unique_positions[index], answer, error, timings, start)
+
+    def build_answers(
+            self,
+            questions: List[str],
+            positions: List[int],
+            answer: Optional[str],
+            error: Optional[str],
+            timings: Dict[str, float],
+            start: float
+    ) -> Iterator[BatchAnswer]:
+        if error is not None:
+            self.count(errors=len(positions))
+
+        timings = dict(timings, total=time.perf_counter() - start)
+        for number, index in enumerate(positions):
+            yield BatchAnswer(
+                index=index,
+                question=questions[index],
+                answer=answer,
+                error=error,
+                coalesced=number > 0,
+                timings=timings,
+            )
+
+
+def read_questions(path: str) -> List[str]:
+    # a csv with a "question" column, or plain text with one question per line
+    with open(path, mode='r', newline='') as file:
+        if path.endswith('.csv'):
+            return [row['question'] for row in csv.DictReader(file) if row['question'].strip()]
+
+        return [line.strip() for line in file if line.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Answer a file of questions, one json line per answer as it finishes')
+    parser.add_argument('questions', help='.csv with a question column or .txt with one question per line')
+    parser.add_argument('--sources', nargs='*', default=None)
+    parser.add_argument('--search-size', type=int, default=BATCH_SEARCH_QUESTIONS)
+    parser.add_argument('--workers', type=int, default=BATCH_COMPLETION_WORKERS)
+    parser.add_argument('--per-minute', type=int, default=BATCH_COMPLETIONS_PER_MINUTE)
+    args = parser.parse_args(argv)
+
+    answerer = BatchAnswerer(args.search_size, args.workers, args.per_minute)
+    filters = RetrievalFilter(sources=args.sources) if args.sources else None
+
+    start = time.perf_counter()
+    for answer in answerer.answer(read_questions(args.questions), filters):
+        sys.stdout.write(json.dumps(answer._asdict()) + '\n')
+        sys.stdout.flush()
+
+    print(json.dumps(dict(answerer.stats, seconds=time.perf_counter() - start)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
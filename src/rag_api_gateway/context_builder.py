@@ -0,0 +1,121 @@
+from typing import Dict, List, NamedTuple, Optional
+
+from src.document import EmbeddedDocument
+from src.rag_pipeline.configs import PROMPT_CONTEXT_TOKEN_BUDGET
+from src.rag_pipeline.registry import get_data_source_titles, get_data_sources
+from src.utils.iteration import group_by
+
+
+class ContextPassage(NamedTuple):
+    source: Optional[str]
+    article: int
+    chunks: List[Optional[int]]
+    url: str
+    contents: str
+    tokens: int
+    # best (lowest) retrieval rank among the merged chunks
+    rank: int
+
+    @property
+    def citation(self) -> str:
+        title = get_data_source_titles().get(self.source, self.source or '')
+        return f'{title} Art. {self.article}'.strip()
+
+
+class Context(NamedTuple):
+    passages: List[ContextPassage]
+    tokens: int
+
+
+def deduplicate_documents(documents: List[EmbeddedDocument]) -> List[EmbeddedDocument]:
+    # the same chunk can come back from several collections queries or retrieval paths, keep its best rank
+    result: List[EmbeddedDocument] = []
+    for document in documents:
+        is_duplicate = any(
+            kept.source == document.source and kept.article == document.article and (
+                (kept.chunk is not None and kept.chunk == document.chunk)
+                or document.contents in kept.contents
+            )
+            for kept in result
+        )
+        if not is_duplicate:
+            result.append(document)
+
+    return result
+
+
+def merge_adjacent_chunks(documents: List[EmbeddedDocument]) -> List[ContextPassage]:
+    ranks = {id(document): rank for rank, document in enumerate(documents)}
+
+    passages = []
+    for _, article_documents in group_by(documents, lambda item: (item.source, item.article)).items():
+        article_documents = sorted(
+            article_documents,
+            key=lambda item: (item.chunk is None, item.chunk or 0, ranks[id(item)])
+        )
+
+        run: List[EmbeddedDocument] = []
+        for document in article_documents:
+            if run and (document.chunk is None or run[-1].chunk is None or document.chunk != run[-1].chunk + 1):
+                passages.append(build_passage(run, ranks))
+                run = []
+            run.append(document)
+
+        if run:
+            passages.append(build_passage(run, ranks))
+
+    return sorted(passages, key=lambda passage: passage.rank)
+
+
+def build_passage(documents: List[EmbeddedDocument], ranks: Dict[int, int]) -> ContextPassage:
+    return ContextPassage(
+        source=documents[0].source,
+        article=documents[0].article,
+        chunks=[document.chunk for document in documents],
+        url=documents[0].url,
+        contents=' '.join(document.contents for document in documents),
+        tokens=sum(document.tokens for document in documents),
+        rank=min(ranks[id(document)] for document in documents),
+    )
+
+
+def build_context(
+        documents: List[EmbeddedDocument],
+        token_budget: int = PROMPT_CONTEXT_TOKEN_BUDGET
+) -> Context:
+    # documents are expected in ranking order, best first
+    passages = merge_adjacent_chunks(deduplicate_documents(documents))
+
+    # greedy packing: passages that do not fit are skipped so smaller, lower ranked ones can still fill the budget
+    packed = []
+    total_tokens = 0
+    for passage in passages:
+        if total_tokens + passage.tokens > token_budget:
+            continue
+
+        packed.append(passage)
+        total_tokens += passage.tokens
+
+    return Context(passages=packed, tokens=total_tokens)
+
+
+def sort_passages(passages: List[ContextPassage]) -> List[ContextPassage]:
+    # canonical order: registry order of the regulations, then article and chunk number, independent of the ranking
+    source_order = {data_source.name: index for index, data_source in enumerate(get_data_sources())}
+    return sorted(
+        passages,
+        key=lambda passage: (
+            source_order.get(passage.source, len(source_order)),
+            passage.source or '',
+            passage.article,
+            passage.chunks[0] if passage.chunks and passage.chunks[0] is not None else -1,
+        )
+    )
+
+
+def format_context(context: Context) -> str:
+    # the same set of articles always renders to the same text, so prompts sharing them share a cacheable prefix
+    return '\n\n'.join(
+        f'[{passage.citation}]({passage.url})\n{passage.contents}'
+        for passage in sort_passages(context.passages)
+    )
@@ -1,72 +1,143 @@
+import re
+
 import numpy as np
 
-from openai import OpenAI
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from src.document import EmbeddedDocument
+from src.embeddings import get_embedding_provider
+from src.rag_api_gateway.retrieval import retrieve_documents
+from src.rag_api_gateway.rerank import rerank
+from src.rag_api_gateway.context_builder import Context, build_context, format_context
+from src.rag_pipeline.configs import RETRIEVAL_CANDIDATES
+from src.rag_pipeline.registry import get_data_sources
+from src.utils.tracing import tracer
+from src.vector_storage import RetrievalFilter
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+_client: Optional['OpenAI'] = None
 
-from src.vector_storage import get_similar_gdpr_documents, get_similar_ai_act_documents
-from src.rag_pipeline.configs import EMBEDDINGS_MODEL
 
-client = OpenAI()
+def get_client() -> 'OpenAI':
+    # built on the first completion, importing this module does not touch the openai package
+    global _client
+
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI()
+
+    return _client
 
 
 def get_completion_from_messages(messages, model="gpt-4o-mini", temperature=0, max_tokens=1000):
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-    )
+    with tracer.span('completion', model=model) as span:
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        if response.usage is not None:
+            span.set_attribute('prompt_tokens', response.usage.prompt_tokens)
+            span.set_attribute('completion_tokens', response.usage.completion_tokens)
+            # prompt tokens served from the provider's prefix cache, billed at a discount
+            details = getattr(response.usage, 'prompt_tokens_details', None)
+            span.set_attribute('cached_tokens', getattr(details, 'cached_tokens', None) or 0)
 
     return response.choices[0].message.content
 
 
+def get_question_key(question: str, filters: Optional[RetrievalFilter]) -> Tuple:
+    # questions differing only in case or spacing share one answer
+    normalized = WHITESPACE_PATTERN.sub(' ', question).strip().lower()
+    return normalized, tuple(tuple(value) if value else None for value in (filters or RetrievalFilter()))
+
+
 def get_query_embedding_array(query: str) -> np.array:
-    response = client.embeddings.create(
-        input=[query.replace("\n", " ")],
-        model=EMBEDDINGS_MODEL
-    )
+    return get_query_embedding_arrays([query])[0]
 
-    return np.array(response.data[0].embedding)
 
+def get_query_embedding_arrays(queries: List[str]) -> List[np.array]:
+    # one provider call for all the queries, it splits them into request sized batches itself
+    with tracer.span('embed_query', queries=len(queries)) as span:
+        result = get_embedding_provider().embed(queries)
+        span.set_attribute('tokens', result.tokens)
+
+    return [np.array(embedding) for embedding in result.embeddings]
 
-def process_input_with_retrieval(user_input: str):
-    delimiter = "```"
 
+def process_input_with_retrieval(user_input: str, filters: Optional[RetrievalFilter] = None):
+    with tracer.span('answer'):
+        return _process_input_with_retrieval(user_input, filters)
+
+
+def _process_input_with_retrieval(user_input: str, filters: Optional[RetrievalFilter] = None):
     # Step 1: Get documents related to the user input from database
-    related_docs = (
-        get_similar_gdpr_documents(
-            embedding_array=get_query_embedding_array(user_input)
-        ) +
-        get_similar_ai_act_documents(
-            embedding_array=get_query_embedding_array(user_input)
+    # over-fetch cheap candidates, rerank them and keep only the best ones for the prompt
+    embedding_array = get_query_embedding_array(user_input)
+    with tracer.span('retrieve') as span:
+        candidate_docs = retrieve_documents(
+            query=user_input,
+            embedding_array=embedding_array,
+            embedding_model=get_embedding_provider().model_name,
+            limit=RETRIEVAL_CANDIDATES,
+            filters=filters
         )
-    )
+        span.set_attribute('rows', len(candidate_docs))
+
+    context = rerank_and_build_context(user_input, candidate_docs)
 
     # Step 2: Get completion from OpenAI API
-    # Set system message to help set appropriate tone and context for model
-    system_message = f"""
-    You are a friendly chatbot. \
-    You can answer questions about The European Data Protection Regulation (GDPR) and EU Artificial Intelligence Act (AI Act). \
-    You respond in a concise, technically credible tone. \
-    """
+    return get_completion_from_messages(build_messages(user_input, context))
+
+
+def rerank_and_build_context(user_input: str, candidate_docs: List[EmbeddedDocument]) -> Context:
+    with tracer.span('rerank', candidates=len(candidate_docs)):
+        related_docs = rerank(user_input, candidate_docs)
+
+    with tracer.span('build_context') as span:
+        context = build_context(related_docs)
+        span.set_attribute('passages', len(context.passages))
+        span.set_attribute('tokens', context.tokens)
+
+    return context
+
+
+def get_system_message() -> str:
+    # no per request content and no stray whitespace: every prompt starts with the same tokens
+    source_titles = ' and '.join(data_source.title for data_source in get_data_sources())
+    return (
+        f"You are a friendly chatbot. "
+        f"You can answer questions about {source_titles}. "
+        f"You respond in a concise, technically credible tone."
+    )
+
+
+def build_messages(user_input: str, context: Context) -> List[dict]:
+    delimiter = "```"
+    source_titles = ' and '.join(data_source.title for data_source in get_data_sources())
 
     # Prepare messages to pass to model
-    # Delimiter is used to help the model understand the where the user_input starts and ends
+    # Most stable first for the provider's prefix cache: system message, retrieved articles in canonical order,
+    # the question last. Delimiter is used to help the model understand the where the user_input starts and ends
     messages = [
         {
             "role": "system",
-            "content": system_message
-        },
-        {
-            "role": "user",
-            "content": f"{delimiter}{user_input}{delimiter}"
+            "content": get_system_message()
         },
         {
             "role": "assistant",
             "content":
-                f"Relevant GDPR and AI Act articles: "
-                f"\n {related_docs[0][0]} \n {related_docs[1][0]} \n {related_docs[2][0]}"
-                f"\n {related_docs[3][0]} \n {related_docs[4][0]} \n {related_docs[5][0]}"
+                f"Relevant {source_titles} articles: \n{format_context(context)}"
+        },
+        {
+            "role": "user",
+            "content": f"{delimiter}{user_input}{delimiter}"
         }
     ]
 
-    return get_completion_from_messages(messages)
+    return messages
@@ -0,0 +1,146 @@
+import re
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional
+from typing_extensions import Protocol
+
+from src.document import EmbeddedDocument
+from src.rag_pipeline.configs import (
+    RERANKER,
+    RERANK_TOP_K,
+    RERANK_TIME_BUDGET,
+    RERANK_WORKERS,
+    CROSS_ENCODER_MODEL,
+    LOCAL_EMBEDDINGS_THREADS
+)
+
+logger = logging.getLogger('rerank')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+class Reranker(Protocol):
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        ...
+
+
+class LexicalOverlapReranker(Reranker):
+    min_word_length = 3
+
+    def get_words(self, text: str) -> set:
+        return {
+            word for word in WORD_PATTERN.findall(text.lower())
+            if len(word) >= self.min_word_length or word.isdigit()
+        }
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        query_words = self.get_words(query)
+        if not query_words:
+            return [0.0 for _ in texts]
+
+        return [
+            len(query_words & self.get_words(text)) / len(query_words)
+            for text in texts
+        ]
+
+
+class CrossEncoderReranker(Reranker):
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL, threads: int = LOCAL_EMBEDDINGS_THREADS) -> None:
+        self.model_name = model_name
+        self.threads = threads
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            try:
+                import torch
+                from sentence_transformers import CrossEncoder
+            except ImportError as err:
+                raise ImportError(
+                    'Cross-encoder reranking requires sentence-transformers: pip install sentence-transformers'
+                ) from err
+
+            torch.set_num_threads(self.threads)
+            self._model = CrossEncoder(self.model_name, device='cpu')
+
+        return self._model
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        # all candidates in a single forward pass
+        scores = self.model.predict(
+            [(query, text) for text in texts],
+            batch_size=max(len(texts), 1),
+            show_progress_bar=False,
+        )
+
+        return [float(score) for score in scores]
+
+
+RERANKERS = {
+    'lexical': LexicalOverlapReranker,
+    'cross_encoder': CrossEncoderReranker,
+}
+
+_rerankers: Dict[str, Reranker] = {}
+_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix='rerank')
+# a scoring call that ran over its budget keeps its slot until it actually finishes, when every slot is taken
+# new calls fall back right away instead of queueing behind them
+_slots = threading.BoundedSemaphore(RERANK_WORKERS)
+
+
+def get_reranker(name: str = RERANKER) -> Reranker:
+    if name not in RERANKERS:
+        raise ValueError(f'Unknown reranker {name}, expected one of {list(RERANKERS)}')
+
+    if name not in _rerankers:
+        _rerankers[name] = RERANKERS[name]()
+
+    return _rerankers[name]
+
+
+def rerank(
+        query: str,
+        documents: List[EmbeddedDocument],
+        reranker: Optional[Reranker] = None,
+        top_k: int = RERANK_TOP_K,
+        time_budget: float = RERANK_TIME_BUDGET
+) -> List[EmbeddedDocument]:
+    if len(documents) <= 1:
+        return documents[:top_k]
+
+    reranker = reranker or get_reranker()
+    texts = [document.contents for document in documents]
+
+    scores = None
+    # the slot taken here is the one handed back, whenever the forward pass ends
+    slots = _slots
+    if slots.acquire(blocking=False):
+        try:
+            future = _executor.submit(reranker.score, query, texts)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            scores = future.result(timeout=time_budget)
+        except TimeoutError:
+            # only drops it if it has not started, a running forward pass cannot be interrupted
+            future.cancel()
+            logger.warning(
+                'Reranker %s exceeded %.3fs budget for %s candidates', type(reranker).__name__, time_budget, len(texts)
+            )
+    else:
+        logger.warning('Reranker %s busy, skipped for %s candidates', type(reranker).__name__, len(texts))
+
+    if scores is None:
+        # over budget or busy, fall back to the cheap scorer instead of delaying the answer
+        if isinstance(reranker, LexicalOverlapReranker):
+            return documents[:top_k]
+        scores = get_reranker('lexical').score(query, texts)
+
+    # stable sort keeps retrieval order between equal scores
+    order = sorted(range(len(documents)), key=lambda index: scores[index], reverse=True)
+    return [documents[index] for index in order[:top_k]]
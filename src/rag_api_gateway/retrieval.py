@@ -0,0 +1,345 @@
+import re
+import time
+import contextvars
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from src.document import EmbeddedDocument
+from src.vector_storage import (
+    CollectionSearch,
+    RetrievalFilter,
+    search_collections,
+    search_collections_batch,
+    get_similar_documents,
+    get_hierarchical_documents,
+    get_lexical_documents,
+    get_article_documents,
+    has_article_centroids
+)
+from src.rag_pipeline.configs import (
+    DataSourceConfig,
+    EMBEDDINGS_STORAGE_LAYOUT,
+    PARTITIONED_EMBEDDINGS_TABLE,
+    RETRIEVAL_LIMIT,
+    RETRIEVAL_MODE,
+    RETRIEVAL_WORKERS,
+    HYBRID_CANDIDATES,
+    HIERARCHICAL_RETRIEVAL,
+    HIERARCHICAL_RECHECK_SECONDS,
+    RRF_K
+)
+from src.rag_pipeline.registry import get_data_sources
+
+
+# one search per collection, run side by side instead of one after the other
+executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix='retrieval')
+
+
+# (collection, source) -> (has article centroids, checked at)
+centroid_checks: Dict[Tuple[str, Optional[str]], Tuple[bool, float]] = {}
+
+
+def use_hierarchical_search(table_name: str, source: Optional[str] = None) -> bool:
+    # a collection without centroids (written before them, not migrated yet) is searched flat, it is looked at
+    # again after a while so a migration or a new ingestion is picked up without a restart
+    if not HIERARCHICAL_RETRIEVAL:
+        return False
+
+    key = (table_name, source)
+    checked = centroid_checks.get(key)
+    if checked is None or (not checked[0] and time.monotonic() - checked[1] > HIERARCHICAL_RECHECK_SECONDS):
+        checked = (has_article_centroids(table_name, source), time.monotonic())
+        centroid_checks[key] = checked
+
+    return checked[0]
+
+
+# "Article 35", "Art. 35", "art 35(1)", "Articles 12 and 13" (first number only)
+ARTICLE_REFERENCE_PATTERN = re.compile(r'\b(?:articles?|art\.?)\s*(\d+)', re.IGNORECASE)
+
+
+def find_article_references(query: str) -> List[int]:
+    articles = []
+    for match in ARTICLE_REFERENCE_PATTERN.finditer(query):
+        article = int(match.group(1))
+        if article not in articles:
+            articles.append(article)
+
+    return articles
+
+
+def find_source_references(query: str, configs: List[DataSourceConfig]) -> List[str]:
+    normalized_query = query.lower().replace('_', ' ')
+    return [
+        config.name for config in configs
+        if config.name.replace('_', ' ') in normalized_query
+    ]
+
+
+def get_document_key(document: EmbeddedDocument) -> Tuple[Optional[str], int, str]:
+    return document.source, document.article, document.contents
+
+
+def reciprocal_rank_fusion(
+        rankings: List[List[EmbeddedDocument]],
+        k: int = RRF_K,
+        limit: Optional[int] = None
+) -> List[EmbeddedDocument]:
+    scores: Dict[tuple, float] = {}
+    documents: Dict[tuple, EmbeddedDocument] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = get_document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, document)
+
+    fused = sorted(documents, key=lambda key: scores[key], reverse=True)
+    return [documents[key] for key in fused[:limit]]
+
+
+def hybrid_search(
+        config: DataSourceConfig,
+        query: str,
+        embedding_array: np.array,
+        embedding_model: str,
+        limit: int = RETRIEVAL_LIMIT,
+        articles: Optional[List[int]] = None,
+        filters: Optional[RetrievalFilter] = None
+) -> List[EmbeddedDocument]:
+    # fast path: the question names the article, skip the similarity scans
+    if articles:
+        article_documents = get_article_documents(
+            config.collection_name, articles, embedding_model, limit, config.name, filters
+        )
+        if article_documents:
+            return article_documents
+
+    hierarchical = use_hierarchical_search(config.collection_name)
+    vector_search = get_hierarchical_documents if hierarchical else get_similar_documents
+    vector_documents = vector_search(
+        config.collection_name, embedding_array, embedding_model, HYBRID_CANDIDATES, config.name, filters
+    )
+    lexical_documents = get_lexical_documents(
+        config.collection_name, query, embedding_model, HYBRID_CANDIDATES, config.name, filters
+    )
+
+    return reciprocal_rank_fusion([vector_documents, lexical_documents], limit=limit)
+
+
+def partitioned_search(
+        sources: List[str],
+        query: str,
+        embedding_array: np.array,
+        embedding_model: str,
+        limit: int = RETRIEVAL_LIMIT,
+        articles: Optional[List[int]] = None,
+        article_sources: Optional[List[str]] = None,
+        filters: Optional[RetrievalFilter] = None
+) -> List[EmbeddedDocument]:
+    # same results as one hybrid_search per source, but each step is a single query over the partitioned
+    # collection: limits apply per source (LATERAL over the sources) and each source is fused on its own
+    filters = filters or RetrievalFilter()
+
+    article_documents = []
+    if articles:
+        article_documents = get_article_documents(
+            PARTITIONED_EMBEDDINGS_TABLE, articles, embedding_model, limit, None,
+            filters._replace(sources=article_sources or sources), partitioned=True
+        )
+
+    # sources answered by the fast path skip the similarity scans
+    answered_sources = {document.source for document in article_documents}
+    remaining_sources = [source for source in sources if source not in answered_sources]
+    if not remaining_sources:
+        return article_documents
+
+    remaining_filters = filters._replace(sources=remaining_sources)
+    # one query for all the sources, flat unless every one of them has its centroids
+    hierarchical = all(use_hierarchical_search(PARTITIONED_EMBEDDINGS_TABLE, source) for source in remaining_sources)
+    vector_search = get_hierarchical_documents if hierarchical else get_similar_documents
+    vector_future = executor.submit(
+        contextvars.copy_context().run,
+        vector_search,
+        PARTITIONED_EMBEDDINGS_TABLE, embedding_array, embedding_model, HYBRID_CANDIDATES,
+        None, remaining_filters, partitioned=True
+    )
+    lexical_documents = get_lexical_documents(
+        PARTITIONED_EMBEDDINGS_TABLE, query, embedding_model, HYBRID_CANDIDATES,
+        None, remaining_filters, partitioned=True
+    )
+    vector_documents = vector_future.result()
+
+    related_documents = article_documents
+    for source in remaining_sources:
+        related_documents += reciprocal_rank_fusion(
+            [
+                [document for document in vector_documents if document.source == source],
+                [document for document in lexical_documents if document.source == source]
+            ],
+            limit=limit
+        )
+
+    return related_documents
+
+
+def batched_search(
+        configs: List[DataSourceConfig],
+        query: str,
+        embedding_array: np.array,
+        embedding_model: str,
+        limit: int = RETRIEVAL_LIMIT,
+        articles: Optional[List[int]] = None,
+        article_sources: Optional[List[str]] = None,
+        filters: Optional[RetrievalFilter] = None
+) -> List[EmbeddedDocument]:
+    # same results as one hybrid_search per collection, the fast path runs alongside the similarity
+    # searches instead of before them so everything fits in one round-trip
+    results = search_collections(
+        collections=[
+            CollectionSearch(
+                table_name=config.collection_name,
+                source=config.name,
+                article_fast_path=not article_sources or config.name in article_sources,
+                hierarchical=use_hierarchical_search(config.collection_name)
+            ) for config in configs
+        ],
+        embedding_array=embedding_array,
+        text=query,
+        embedding_model=embedding_model,
+        candidates=HYBRID_CANDIDATES,
+        article_limit=limit,
+        articles=articles,
+        filters=filters,
+    )
+
+    return fuse_collection_results(configs, results, limit)
+
+
+def fuse_collection_results(
+        configs: List[DataSourceConfig],
+        results: Dict[Tuple[str, str], List[EmbeddedDocument]],
+        limit: int
+) -> List[EmbeddedDocument]:
+    related_documents = []
+    for config in configs:
+        article_documents = results[(config.name, 'article')]
+        if article_documents:
+            related_documents += article_documents
+        else:
+            related_documents += reciprocal_rank_fusion(
+                [results[(config.name, 'vector')], results[(config.name, 'lexical')]], limit=limit
+            )
+
+    return related_documents
+
+
+def get_search_configs(filters: Optional[RetrievalFilter] = None) -> List[DataSourceConfig]:
+    return [
+        config for config in get_data_sources()
+        if filters is None or not filters.sources or config.name in filters.sources
+    ]
+
+
+def retrieve_documents_batch(
+        queries: List[str],
+        embedding_arrays: List[np.array],
+        embedding_model: str,
+        limit: int = RETRIEVAL_LIMIT,
+        filters: Optional[RetrievalFilter] = None
+) -> List[List[EmbeddedDocument]]:
+    # same results as retrieve_documents per query, in query order
+    if EMBEDDINGS_STORAGE_LAYOUT == 'partitioned' or RETRIEVAL_MODE != 'batched':
+        # no batched statement for these, each call already fans out over the collections
+        return [
+            retrieve_documents(query, embedding_array, embedding_model, limit, filters)
+            for query, embedding_array in zip(queries, embedding_arrays)
+        ]
+
+    configs = get_search_configs(filters)
+    articles = [find_article_references(query) for query in queries]
+    results = search_collections_batch(
+        collections=[
+            CollectionSearch(
+                table_name=config.collection_name,
+                source=config.name,
+                hierarchical=use_hierarchical_search(config.collection_name)
+            ) for config in configs
+        ],
+        embedding_arrays=embedding_arrays,
+        texts=queries,
+        embedding_model=embedding_model,
+        candidates=HYBRID_CANDIDATES,
+        article_limit=limit,
+        articles=articles,
+        # "Article 35 GDPR" only takes the fast path for the named regulation
+        article_sources=[
+            find_source_references(query, configs) if query_articles else []
+            for query, query_articles in zip(queries, articles)
+        ],
+        filters=filters,
+    )
+
+    return [fuse_collection_results(configs, query_results, limit) for query_results in results]
+
+
+def retrieve_documents(
+        query: str,
+        embedding_array: np.array,
+        embedding_model: str,
+        limit: int = RETRIEVAL_LIMIT,
+        filters: Optional[RetrievalFilter] = None
+) -> List[EmbeddedDocument]:
+    configs = get_search_configs(filters)
+
+    articles = find_article_references(query)
+    # "Article 35 GDPR" only takes the fast path for the named regulation
+    referenced_sources = find_source_references(query, configs) if articles else []
+
+    if EMBEDDINGS_STORAGE_LAYOUT == 'partitioned':
+        return partitioned_search(
+            sources=[config.name for config in configs],
+            query=query,
+            embedding_array=embedding_array,
+            embedding_model=embedding_model,
+            limit=limit,
+            articles=articles,
+            article_sources=referenced_sources,
+            filters=filters,
+        )
+
+    if RETRIEVAL_MODE == 'batched':
+        return batched_search(
+            configs=configs,
+            query=query,
+            embedding_array=embedding_array,
+            embedding_model=embedding_model,
+            limit=limit,
+            articles=articles,
+            article_sources=referenced_sources,
+            filters=filters,
+        )
+
+    # each task runs in a copy of the caller context so its spans stay under the current trace
+    futures = [
+        executor.submit(
+            contextvars.copy_context().run,
+            hybrid_search,
+            config=config,
+            query=query,
+            embedding_array=embedding_array,
+            embedding_model=embedding_model,
+            limit=limit,
+            articles=articles if not referenced_sources or config.name in referenced_sources else None,
+            filters=filters,
+        ) for config in configs
+    ]
+
+    # results keep the registry order of the collections
+    related_documents = []
+    for future in futures:
+        related_documents += future.result()
+
+    return related_documents
@@ -0,0 +1,443 @@
+import json
+import time
+import asyncio
+import argparse
+import threading
+import traceback
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.embeddings import get_embedding_provider
+from src.rag_api_gateway.batch_answer import BatchAnswerer
+from src.rag_api_gateway.get_answer import process_input_with_retrieval, get_query_embedding_array, get_question_key
+from src.rag_api_gateway.retrieval import retrieve_documents
+from src.rag_api_gateway.rerank import get_reranker
+from src.rag_pipeline.configs import (
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_MAX_BATCHES,
+    SERVER_MAX_CONCURRENCY,
+    SERVER_QUEUE_TIMEOUT,
+    SERVER_REQUEST_TIMEOUT
+)
+from src.rag_pipeline.registry import get_data_sources
+from src.utils.tracing import tracer
+from src.vector_storage import RetrievalFilter, get_pool, get_conn, put_conn
+
+
+MAX_BODY_BYTES = 64 * 1024
+MAX_BATCH_BODY_BYTES = 4 * 1024 * 1024
+MAX_BATCH_QUESTIONS = 2000
+
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def parse_filters(payload: Any) -> Optional[RetrievalFilter]:
+    if payload is None:
+        return None
+
+    if not isinstance(payload, dict) or set(payload) - set(RetrievalFilter._fields):
+        raise BadRequest(f'filters must be an object with keys {list(RetrievalFilter._fields)}')
+
+    for key, value in payload.items():
+        if value is None:
+            continue
+        # sources are names, chapters, sections and articles are numbers
+        kind = str if key == 'sources' else int
+        if not isinstance(value, list) or not all(
+                isinstance(item, kind) and not isinstance(item, bool) for item in value
+        ):
+            raise BadRequest(f'filters.{key} must be a list of {"strings" if kind is str else "integers"}')
+
+    return RetrievalFilter(**payload)
+
+
+class AnswerService:
+    """
+    Bounded, coalescing front of process_input_with_retrieval.
+
+    At most max_concurrency answers run at a time, the rest wait up to queue_timeout for a slot.
+    Identical questions arriving while one is queued or running share its result.
+    """
+
+    def __init__(
+            self,
+            answer: Callable[[str, Optional[RetrievalFilter]], str] = process_input_with_retrieval,
+            max_concurrency: int = SERVER_MAX_CONCURRENCY,
+            queue_timeout: float = SERVER_QUEUE_TIMEOUT,
+            request_timeout: float = SERVER_REQUEST_TIMEOUT
+    ) -> None:
+        self.answer_fn = answer
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='answer')
+        # created on first use, they must belong to the server's event loop
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight: Dict[Tuple, asyncio.Future] = {}
+        self.running = 0
+        self.queued = 0
+        self.stats = {'requests': 0, 'coalesced': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+
+    async def answer(self, question: str, filters: Optional[RetrievalFilter] = None) -> Tuple[str, bool]:
+        self.stats['requests'] += 1
+        key = get_question_key(question, filters)
+
+        coalesced = key in self.in_flight
+        if coalesced:
+            self.stats['coalesced'] += 1
+            future = self.in_flight[key]
+        else:
+            future = asyncio.ensure_future(self.run(question, filters))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+
+        try:
+            # shielded, a waiter giving up must not cancel the answer shared with the others
+            return await asyncio.wait_for(asyncio.shield(future), self.request_timeout), coalesced
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            raise
+
+    async def run(self, question: str, filters: Optional[RetrievalFilter]) -> str:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats['rejected'] += 1
+            raise QueueTimeout(f'No free slot within {self.queue_timeout}s')
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, contextvars.copy_context().run, self.answer_fn, question, filters
+            )
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    def get_state(self) -> Dict[str, Any]:
+        return dict(
+            self.stats,
+            running=self.running,
+            queued=self.queued,
+            in_flight=len(self.in_flight),
+            max_concurrency=self.max_concurrency,
+        )
+
+
+class Readiness:
+    def __init__(self) -> None:
+        self.warm = False
+        self.warm_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def warm_up(self) -> None:
+        # loads the registry, the embedding and reranking models and touches every collection index once,
+        # so the first real question does not pay for it
+        start = time.perf_counter()
+        try:
+            get_data_sources()
+            # loads the cross-encoder weights here, a first load inside rerank would always run over its budget
+            get_reranker().score('warm up', ['warm up'])
+            embedding_array = get_query_embedding_array('warm up')
+            retrieve_documents('warm up', embedding_array, get_embedding_provider().model_name, limit=1)
+            self.warm = True
+            self.error = None
+        except Exception as err:
+            self.error = repr(err)
+            print(f'Error: {err}')
+            print(traceback.format_exc())
+        finally:
+            self.warm_seconds = time.perf_counter() - start
+
+    @staticmethod
+    def check_pool() -> Optional[str]:
+        try:
+            pool = get_pool()
+            conn = get_conn(pool)
+            try:
+                with conn:
+                    cur = conn.cursor()
+                    cur.execute('SELECT 1')
+                    cur.fetchone()
+                    cur.close()
+            finally:
+                put_conn(pool, conn)
+            return None
+        except Exception as err:
+            return repr(err)
+
+
+class GatewayApp:
+    """
+    ASGI application around the answer path.
+
+    POST /answer {"question": "...", "filters": {"sources": ["gdpr"]}}
+    POST /answer/batch {"questions": ["...", ...], "filters": ...}, streams one json line per answer as it finishes
+    GET /healthz (process is up), GET /readyz (database reachable and indexes warm), GET /metrics
+    """
+
+    def __init__(
+            self,
+            service: Optional[AnswerService] = None,
+            readiness: Optional[Readiness] = None,
+            batch: Optional[BatchAnswerer] = None,
+            max_batches: int = SERVER_MAX_BATCHES
+    ) -> None:
+        self.service = service or AnswerService()
+        self.readiness = readiness or Readiness()
+        # batches bring their own completion workers and rate limit and search within their own share of the
+        # connection pool (BATCH_RETRIEVAL_CONNECTIONS), they do not take the answer slots
+        self.batch = batch or BatchAnswerer()
+        self.max_batches = max_batches
+        self.running_batches = 0
+        self.warm_up_task: Optional[asyncio.Future] = None
+
+    async def __call__(self, scope: dict, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # warm up in the background, /readyz reports 503 until it is done, off the answer slots
+                loop = asyncio.get_running_loop()
+                self.warm_up_task = loop.run_in_executor(None, self.readiness.warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.service.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope: dict, receive: Receive, send: Send) -> None:
+        method, path = scope['method'], scope['path']
+
+        if method == 'GET' and path == '/healthz':
+            await send_json(send, 200, {'status': 'ok'})
+
+        elif method == 'GET' and path == '/readyz':
+            pool_error = await asyncio.get_running_loop().run_in_executor(None, self.readiness.check_pool)
+            ready = self.readiness.warm and pool_error is None
+            await send_json(send, 200 if ready else 503, {
+                'status': 'ready' if ready else 'not_ready',
+                'warm': self.readiness.warm,
+                'warm_seconds': self.readiness.warm_seconds,
+                'warm_error': self.readiness.error,
+                'pool_error': pool_error,
+                'server': self.service.get_state(),
+            })
+
+        elif method == 'GET' and path == '/metrics':
+            lines = [f'rag_server_{key} {value}' for key, value in sorted(self.service.get_state().items())]
+            await send_text(send, 200, tracer.export_prometheus() + '\n'.join(lines) + '\n')
+
+        elif method == 'POST' and path == '/answer':
+            await self.answer(receive, send)
+
+        elif method == 'POST' and path == '/answer/batch':
+            await self.answer_batch(receive, send)
+
+        else:
+            await send_json(send, 404, {'error': f'Unknown route {method} {path}'})
+
+    async def answer(self, receive: Receive, send: Send) -> None:
+        start = time.perf_counter()
+        try:
+            payload = json.loads(await read_body(receive))
+            if not isinstance(payload, dict):
+                raise BadRequest('body must be a json object')
+
+            question = payload.get('question')
+            if not isinstance(question, str) or not question.strip():
+                raise BadRequest('question must be a non-empty string')
+
+            answer, coalesced = await self.service.answer(question, parse_filters(payload.get('filters')))
+            await send_json(send, 200, {
+                'answer': answer,
+                'coalesced': coalesced,
+                'seconds': time.perf_counter() - start,
+            })
+
+        except (BadRequest, ValueError) as err:
+            await send_json(send, 400, {'error': str(err)})
+
+        except QueueTimeout as err:
+            await send_json(send, 503, {'error': str(err)}, [(b'retry-after', b'1')])
+
+        except asyncio.TimeoutError:
+            await send_json(send, 504, {'error': f'No answer within {self.service.request_timeout}s'})
+
+        except Exception as err:
+            print(f'Error: {err}')
+            print(traceback.format_exc())
+            await send_json(send, 500, {'error': 'Internal error'})
+
+    async def answer_batch(self, receive: Receive, send: Send) -> None:
+        try:
+            payload = json.loads(await read_body(receive, MAX_BATCH_BODY_BYTES))
+            if not isinstance(payload, dict):
+                raise BadRequest('body must be a json object')
+
+            questions = payload.get('questions')
+            if not isinstance(questions, list) or not questions or len(questions) > MAX_BATCH_QUESTIONS:
+                raise BadRequest(f'questions must be a list of 1 to {MAX_BATCH_QUESTIONS} strings')
+            if not all(isinstance(question, str) and question.strip() for question in questions):
+                raise BadRequest('every question must be a non-empty string')
+
+            filters = parse_filters(payload.get('filters'))
+
+        except (BadRequest, ValueError) as err:
+            await send_json(send, 400, {'error': str(err)})
+            return
+
+        if self.running_batches >= self.max_batches:
+            await send_json(
+                send, 503, {'error': f'{self.max_batches} batches already running'}, [(b'retry-after', b'5')]
+            )
+            return
+
+        self.running_batches += 1
+        try:
+            await self.stream_batch(questions, filters, receive, send)
+        finally:
+            self.running_batches -= 1
+
+    async def stream_batch(
+            self,
+            questions: List[str],
+            filters: Optional[RetrievalFilter],
+            receive: Receive,
+            send: Send
+    ) -> None:
+        # the batch runs in a worker thread and hands its answers over one by one, it stops at the next answer
+        # once the client is gone
+        loop = asyncio.get_running_loop()
+        answers: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce() -> None:
+            batch_answers = self.batch.answer(questions, filters)
+            try:
+                for answer in batch_answers:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(answers.put_nowait, answer._asdict())
+            except Exception as err:
+                print(f'Error: {err}')
+                print(traceback.format_exc())
+                loop.call_soon_threadsafe(answers.put_nowait, {'error': 'Internal error'})
+            finally:
+                # cancels the completions not started yet
+                batch_answers.close()
+                loop.call_soon_threadsafe(answers.put_nowait, None)
+
+        async def watch_disconnect() -> None:
+            # the body is read, the next message only comes when the client disconnects
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            stop.set()
+
+        producer = loop.run_in_executor(None, contextvars.copy_context().run, produce)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            # no content-length, the answers go out chunked as they arrive
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'application/x-ndjson')],
+            })
+            while True:
+                answer = await answers.get()
+                if answer is None:
+                    break
+                if stop.is_set():
+                    continue
+                await send({
+                    'type': 'http.response.body',
+                    'body': json.dumps(answer).encode('utf-8') + b'\n',
+                    'more_body': True
+                })
+
+            await send({'type': 'http.response.body', 'body': b''})
+
+        except OSError:
+            # the connection is gone (e.g. uvicorn's ClientDisconnected), the rest of the batch is not wanted
+            stop.set()
+
+        finally:
+            watcher.cancel()
+            await producer
+
+
+async def read_body(receive: Receive, limit: int = MAX_BODY_BYTES) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > limit:
+            raise BadRequest('body too large')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_text(
+        send: Send,
+        status: int,
+        text: str,
+        headers: Optional[List[Tuple[bytes, bytes]]] = None,
+        content_type: bytes = b'text/plain; charset=utf-8'
+) -> None:
+    body = text.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())] + (headers or []),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send: Send, status: int, payload: dict, headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+    await send_text(send, status, json.dumps(payload), headers, b'application/json')
+
+
+app = GatewayApp()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='HTTP gateway for the legal chatbot')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args(argv)
+
+    # a single process: concurrency limits and coalescing are per process
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == '__main__':
+    main()
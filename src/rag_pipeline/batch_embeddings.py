@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from typing import IO, TYPE_CHECKING, Dict, Iterator, List, Optional
+
+from src.rag_pipeline.configs import (
+    EMBEDDINGS_MODEL,
+    EMBEDDINGS_BATCH_MAX_REQUESTS,
+    EMBEDDINGS_BATCH_COMPLETION_WINDOW,
+    EMBEDDINGS_BATCH_POLL_INTERVAL,
+    EMBEDDINGS_BATCH_STATE_PATH
+)
+from src.rag_pipeline.run_report import RunReport
+from src.utils.iteration import batch_by
+from src.document import EmbeddedDocument
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from openai.types import Batch
+
+
+BATCH_ENDPOINT = '/v1/embeddings'
+BATCH_FAILED_STATUSES = ('failed', 'expired', 'cancelling', 'cancelled')
+
+
+def get_custom_id(index: int) -> str:
+    return f'chunk-{index}'
+
+
+def write_batch_file(file: IO[str], documents: Dict[str, EmbeddedDocument]) -> None:
+    for custom_id, document in documents.items():
+        request = {
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {
+                'model': EMBEDDINGS_MODEL,
+                'input': document.contents.replace("\n", " "),
+            },
+        }
+        file.write(json.dumps(request) + '\n')
+
+
+def submit_batch(client: 'OpenAI', documents: Dict[str, EmbeddedDocument]) -> str:
+    with tempfile.NamedTemporaryFile(mode='w+', suffix='.jsonl', encoding='utf-8') as file:
+        write_batch_file(file, documents)
+        file.flush()
+        file.seek(0)
+
+        with open(file.name, mode='rb') as batch_input:
+            batch_file = client.files.create(file=batch_input, purpose='batch')
+
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=EMBEDDINGS_BATCH_COMPLETION_WINDOW,
+    )
+
+    return batch.id
+
+
+def wait_for_batch(client: 'OpenAI', batch_id: str, poll_interval: float = EMBEDDINGS_BATCH_POLL_INTERVAL) -> 'Batch':
+    while True:
+        batch = client.batches.retrieve(batch_id)
+
+        if batch.status == 'completed':
+            return batch
+
+        if batch.status in BATCH_FAILED_STATUSES:
+            raise RuntimeError(f'Embeddings batch {batch_id} finished with status {batch.status}: {batch.errors}')
+
+        time.sleep(poll_interval)
+
+
+def iter_batch_results(client: 'OpenAI', batch: 'Batch') -> Iterator[tuple]:
+    if batch.request_counts and batch.request_counts.failed:
+        raise RuntimeError(
+            f'Embeddings batch {batch.id} has {batch.request_counts.failed} failed requests, '
+            f'see error file {batch.error_file_id}'
+        )
+
+    content = client.files.content(batch.output_file_id)
+    for line in content.iter_lines():
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            raise RuntimeError(f'Embeddings request {result.get("custom_id")} failed: {result.get("error") or response}')
+
+        yield result['custom_id'], response['body']['data'][0]['embedding'], response['body']['usage']['total_tokens']
+
+
+def get_batch_state_path(source: str) -> str:
+    return os.path.join(EMBEDDINGS_BATCH_STATE_PATH, f'{source}.json')
+
+
+def get_batch_fingerprint(documents: Dict[str, EmbeddedDocument]) -> str:
+    # the submitted batches only answer for the exact same chunks
+    digest = hashlib.md5(EMBEDDINGS_MODEL.encode('utf-8'))
+    for custom_id, document in documents.items():
+        digest.update(f'{custom_id}\0{document.contents}\0'.encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def read_batch_state(path: Optional[str], fingerprint: str) -> Optional[List[str]]:
+    if path is None or not os.path.exists(path):
+        return None
+
+    with open(path, mode='r') as file:
+        state = json.load(file)
+
+    return state['batch_ids'] if state.get('fingerprint') == fingerprint else None
+
+
+def write_batch_state(path: Optional[str], fingerprint: str, batch_ids: List[str]) -> None:
+    if path is None:
+        return
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, mode='w') as file:
+        json.dump({'fingerprint': fingerprint, 'batch_ids': batch_ids}, file)
+
+
+def clear_batch_state(path: Optional[str]) -> None:
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+def get_embeddings_via_batch(
+        client: 'OpenAI',
+        documents: List[EmbeddedDocument],
+        poll_interval: float = EMBEDDINGS_BATCH_POLL_INTERVAL,
+        report: Optional[RunReport] = None,
+        state_path: Optional[str] = None
+) -> List[EmbeddedDocument]:
+    # every batch is waited for and the results come back as a list, callers open their write transaction only
+    # afterwards; the batch ids stay at state_path until the results are stored, a rerun after a crash collects
+    # the same batches instead of paying for new ones
+    # batch api does not preserve request order, results are matched back by custom_id
+    documents_by_id = {
+        get_custom_id(index): document
+        for index, document in enumerate(documents)
+    }
+
+    fingerprint = get_batch_fingerprint(documents_by_id)
+    batch_ids = read_batch_state(state_path, fingerprint)
+    if batch_ids is None:
+        batch_ids = [
+            submit_batch(client, dict(requests))
+            for requests in batch_by(documents_by_id.items(), EMBEDDINGS_BATCH_MAX_REQUESTS)
+        ]
+        write_batch_state(state_path, fingerprint, batch_ids)
+        if report is not None:
+            report.record_api_usage(0, api_calls=len(batch_ids))
+
+    embedded_documents = []
+    for batch_id in batch_ids:
+        try:
+            batch = wait_for_batch(client, batch_id, poll_interval)
+            results = list(iter_batch_results(client, batch))
+        except RuntimeError:
+            # failed or expired, the next run submits new batches
+            clear_batch_state(state_path)
+            raise
+
+        # one call per downloaded results file, the result lines only add their tokens
+        if report is not None:
+            report.record_api_usage(sum(tokens for _, _, tokens in results), api_calls=1)
+
+        for custom_id, embedding, _ in results:
+            document = documents_by_id.pop(custom_id)
+            embedded_documents.append(EmbeddedDocument(
+                chapter=document.chapter,
+                section=document.section,
+                article=document.article,
+                url=document.url,
+                contents=document.contents,
+                tokens=document.tokens,
+                chunk=document.chunk,
+                embedding=embedding,
+                embedding_model=EMBEDDINGS_MODEL
+            ))
+
+    if documents_by_id:
+        clear_batch_state(state_path)
+        raise RuntimeError(f'Embeddings batch returned no result for {len(documents_by_id)} chunks')
+
+    return embedded_documents
@@ -1,10 +1,27 @@
 import os
 
-from dotenv import find_dotenv, load_dotenv
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 from datetime import datetime
 
-load_dotenv(find_dotenv('.dev'))
+
+def find_env_file(name: str = '.dev') -> Optional[str]:
+    # same lookup as dotenv.find_dotenv: from this directory up to the root
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+# python-dotenv is only imported when there is a file to load, deployed workers get their environment directly
+ENV_FILE = find_env_file()
+if ENV_FILE:
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 
 DB_CONFIGS = {
     'database': os.getenv('DB_NAME'),
@@ -19,34 +36,14 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 LANGCHAIN_API_KEY = os.getenv('LANGCHAIN_API_KEY')
 HUGGING_FACE_API_KEY = os.getenv('HUGGING_FACE_API_KEY')
 
-DATA_SOURCES = [
-    {
-        'name': 'gdpr',
-        'table_name': 'llm_legal_chatbot.gdpr_documents',
-        'collection_name': 'llm_legal_chatbot.gdpr_embeddings',
-        'content': 'src/rag_data/content/gdpr.pdf',
-        'schema': 'src/rag_data/schema/gdpr.csv',
-        'key_word': 'Article',
-        'start_page': 31,
-        'end_page': 88,
-        'updated_at': '2016-05-04'
-    },
-    {
-        'name': 'ai_act',
-        'table_name': 'llm_legal_chatbot.ai_act_documents',
-        'collection_name': 'llm_legal_chatbot.ai_act_embeddings',
-        'content': 'src/rag_data/content/ai_act.pdf',
-        'schema': 'src/rag_data/schema/ai_act.csv',
-        'key_word': 'Article',
-        'start_page': 43,
-        'end_page': 123,
-        'updated_at': '2024-07-12'
-    },
-]
+# data source registry, a json file (list of DataSourceConfig fields) or a table with the same columns
+DATA_SOURCES_PATH = os.getenv('DATA_SOURCES_PATH', 'src/rag_data/sources.json')
+DATA_SOURCES_TABLE = os.getenv('DATA_SOURCES_TABLE')
 
 
 class DataSourceConfig(NamedTuple):
     name: str
+    title: str
     table_name: str
     collection_name: str
     content: str
@@ -79,4 +76,110 @@ TEXT_EMBEDDING_PRICE_CONFIGS = [
 
 EMBEDDINGS_CHUNKS_SIZE = 512
 EMBEDDINGS_MODEL = 'text-embedding-ada-002'
+EMBEDDINGS_DIMENSIONS = int(os.getenv('EMBEDDINGS_DIMENSIONS', '1536'))
+
+# 'per_source': one collection table per data source (DataSourceConfig.collection_name)
+# 'partitioned': one table list-partitioned by data source, re-ingestion swaps a single partition
+EMBEDDINGS_STORAGE_LAYOUT = os.getenv('EMBEDDINGS_STORAGE_LAYOUT', 'per_source')
+PARTITIONED_EMBEDDINGS_TABLE = os.getenv('PARTITIONED_EMBEDDINGS_TABLE', 'llm_legal_chatbot.embeddings')
+
+# per_source collections are views over versioned tables, a re-ingest builds a new version and flips the view
+COLLECTION_VERSIONS_TABLE = os.getenv('COLLECTION_VERSIONS_TABLE', 'llm_legal_chatbot.collection_versions')
+# versions kept per collection including the active one, older ones are dropped
+COLLECTION_VERSIONS_RETAINED = int(os.getenv('COLLECTION_VERSIONS_RETAINED', '2'))
+# a version still 'building' after this long was left by a crashed ingestion and is garbage collected
+COLLECTION_BUILD_TIMEOUT_HOURS = float(os.getenv('COLLECTION_BUILD_TIMEOUT_HOURS', '24'))
+# 'hnsw', 'ivfflat' or 'none', built on a version before it goes live
+COLLECTION_VECTOR_INDEX = os.getenv('COLLECTION_VECTOR_INDEX', 'hnsw')
+# an hnsw scan hands back ef_search rows and the chapter, section and article filters are applied after it, filtered
+# searches raise ef_search and keep scanning until the limit is met ('relaxed_order' or 'strict_order', pgvector 0.8+,
+# 'off' for older versions)
+HNSW_FILTERED_EF_SEARCH = int(os.getenv('HNSW_FILTERED_EF_SEARCH', '200'))
+HNSW_ITERATIVE_SCAN = os.getenv('HNSW_ITERATIVE_SCAN', 'relaxed_order')
+
+# 'openai', 'local' (sentence-transformers, CPU only) or 'stub' (deterministic, offline)
+EMBEDDINGS_PROVIDER = os.getenv('EMBEDDINGS_PROVIDER', 'openai')
+EMBEDDINGS_REQUEST_BATCH_SIZE = 256
+EMBEDDINGS_MAX_RETRIES = 5
+
+LOCAL_EMBEDDINGS_MODEL = os.getenv('LOCAL_EMBEDDINGS_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+# 'torch' or 'onnx'
+LOCAL_EMBEDDINGS_BACKEND = os.getenv('LOCAL_EMBEDDINGS_BACKEND', 'torch')
+LOCAL_EMBEDDINGS_THREADS = int(os.getenv('LOCAL_EMBEDDINGS_THREADS', '4'))
+LOCAL_EMBEDDINGS_BATCH_SIZE = 64
+
+# https://platform.openai.com/docs/guides/batch
+EMBEDDINGS_BATCH_MAX_REQUESTS = 50000
+EMBEDDINGS_BATCH_COMPLETION_WINDOW = '24h'
+EMBEDDINGS_BATCH_POLL_INTERVAL = 30
+# ids of the batches submitted for a source, one json file per source until its results are stored
+EMBEDDINGS_BATCH_STATE_PATH = os.getenv('EMBEDDINGS_BATCH_STATE_PATH', 'reports/embedding_batches')
+
+# one json line per ingestion run
+INGESTION_REPORTS_PATH = os.getenv('INGESTION_REPORTS_PATH', 'reports/ingestion_runs.jsonl')
+# one json line per benchmark run
+BENCHMARK_RESULTS_PATH = os.getenv('BENCHMARK_RESULTS_PATH', 'reports/benchmarks.jsonl')
+# one json line per retrieval evaluation run
+EVALUATION_RESULTS_PATH = os.getenv('EVALUATION_RESULTS_PATH', 'reports/evaluations.jsonl')
+
+# 'batched': every collection searched by one prepared statement in a single round-trip
+# 'concurrent': one connection and one set of queries per collection, run side by side
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'batched')
+
+# data sources ingested / searched concurrently
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '4'))
+RETRIEVAL_WORKERS = int(os.getenv('RETRIEVAL_WORKERS', '8'))
+# batch searches running at once across all batches, each batched statement holds one connection
+BATCH_RETRIEVAL_CONNECTIONS = int(os.getenv('BATCH_RETRIEVAL_CONNECTIONS', '2'))
+# room for a full retrieval fan-out next to the readiness probe, warm-up and the batch searches
+DB_POOL_MAX_CONNECTIONS = int(os.getenv(
+    'DB_POOL_MAX_CONNECTIONS', str(RETRIEVAL_WORKERS + 2 + BATCH_RETRIEVAL_CONNECTIONS)
+))
+# seconds a caller waits for a free connection once all of them are out
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+# batch answering: questions searched per statement, completions in flight and started per minute
+BATCH_SEARCH_QUESTIONS = int(os.getenv('BATCH_SEARCH_QUESTIONS', '32'))
+BATCH_COMPLETION_WORKERS = int(os.getenv('BATCH_COMPLETION_WORKERS', '8'))
+BATCH_COMPLETIONS_PER_MINUTE = int(os.getenv('BATCH_COMPLETIONS_PER_MINUTE', '500'))
+
+# retrieval
+RETRIEVAL_LIMIT = 3
+# candidates per data source handed to the reranker, only the best RERANK_TOP_K reach the prompt
+RETRIEVAL_CANDIDATES = 12
+HYBRID_CANDIDATES = 20
+# two-level vector search: the closest article centroids first, then only the chunks of those articles
+# off until the centroids of existing collections are built (python -m src.rag_pipeline.migrate_collections),
+# collections without them are searched flat either way
+HIERARCHICAL_RETRIEVAL = os.getenv('HIERARCHICAL_RETRIEVAL', 'false').lower() in ('1', 'true', 'yes')
+# seconds before a collection found without centroids is looked at again
+HIERARCHICAL_RECHECK_SECONDS = 60
+HIERARCHICAL_ARTICLES = 8
+# keeps one long article (e.g. the definitions) from filling all the candidates
+HIERARCHICAL_CHUNKS_PER_ARTICLE = 3
+# https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
+RRF_K = 60
+FULL_TEXT_LANGUAGE = 'english'
+
+# 'lexical' or 'cross_encoder' (sentence-transformers, CPU only)
+RERANKER = os.getenv('RERANKER', 'lexical')
+CROSS_ENCODER_MODEL = os.getenv('CROSS_ENCODER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_TOP_K = 6
+# seconds
+RERANK_TIME_BUDGET = float(os.getenv('RERANK_TIME_BUDGET', '0.25'))
+# scoring calls running at once, past that answers fall back to the lexical scorer
+RERANK_WORKERS = int(os.getenv('RERANK_WORKERS', '4'))
+
+# prompt context, measured with the stored chunk token counts
+PROMPT_CONTEXT_TOKEN_BUDGET = 3000
 
+# http gateway, answers run in worker threads, at most SERVER_MAX_CONCURRENCY at a time
+SERVER_HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_MAX_CONCURRENCY = int(os.getenv('SERVER_MAX_CONCURRENCY', '8'))
+# seconds a request may wait for a free slot before it is rejected with 503
+SERVER_QUEUE_TIMEOUT = float(os.getenv('SERVER_QUEUE_TIMEOUT', '5'))
+# seconds a request may wait for its answer before it is answered with 504
+SERVER_REQUEST_TIMEOUT = float(os.getenv('SERVER_REQUEST_TIMEOUT', '60'))
+# batches answered at once, more are rejected with 503
+SERVER_MAX_BATCHES = int(os.getenv('SERVER_MAX_BATCHES', '2'))
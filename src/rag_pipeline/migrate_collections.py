@@ -0,0 +1,130 @@
+import argparse
+import traceback
+
+from typing import List, Optional
+
+from src.collection_versions import CENTROID_VIEW_COLUMNS, ensure_versions_table, fetch_versions
+from src.rag_pipeline.configs import EMBEDDINGS_DIMENSIONS, EMBEDDINGS_STORAGE_LAYOUT, PARTITIONED_EMBEDDINGS_TABLE
+from src.rag_pipeline.registry import get_data_sources
+from src.vector_storage import (
+    get_pool,
+    get_conn,
+    put_conn,
+    build_article_centroids,
+    create_partitioned_centroids_table,
+    ensure_collection_schema,
+    get_centroids_table,
+    get_vector_dimensions,
+    insert_source_centroids
+)
+
+
+def get_relkind(cur, name: str) -> Optional[str]:
+    cur.execute("""SELECT relkind FROM pg_class WHERE oid = to_regclass(%(name)s)""", {'name': name})
+    row = cur.fetchone()
+    return row[0] if row is not None else None
+
+
+def backfill_version_centroids(cur, collection_name: str) -> bool:
+    # versions built before the hierarchical search have no centroid table, nor the collection a centroid view
+    backfilled = False
+    for version in fetch_versions(cur, collection_name):
+        if version.status not in ('active', 'retired'):
+            continue
+
+        if get_relkind(cur, get_centroids_table(version.table_name)) is None:
+            build_article_centroids(cur, version.table_name)
+            backfilled = True
+        if version.status == 'active' and get_relkind(cur, get_centroids_table(collection_name)) is None:
+            cur.execute(
+                f"""CREATE VIEW {get_centroids_table(collection_name)} AS """
+                f"""SELECT {CENTROID_VIEW_COLUMNS} FROM {get_centroids_table(version.table_name)}"""
+            )
+            backfilled = True
+
+    return backfilled
+
+
+# TODO: extend SqlEngine class
+def migrate_collection(collection_name: str) -> bool:
+    # brings a collection written by an older version up to the current schema: columns and model tags of a
+    # plain table, the article centroids of the hierarchical search for both plain tables and versioned views
+    pool = get_pool()
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            relkind = get_relkind(cur, collection_name)
+            migrated = relkind in ('r', 'v')
+            if relkind == 'r':
+                ensure_collection_schema(cur, collection_name)
+                build_article_centroids(cur, collection_name)
+            elif relkind == 'v':
+                ensure_versions_table(cur)
+                migrated = backfill_version_centroids(cur, collection_name)
+            cur.close()
+    finally:
+        put_conn(pool, conn)
+
+    return migrated
+
+
+# TODO: extend SqlEngine class
+def migrate_partitioned_collection(sources: List[str]) -> List[str]:
+    # sources ingested before the centroid table existed have no centroids, they are built from the partitions
+    pool = get_pool()
+    conn = get_conn(pool)
+    backfilled = []
+    try:
+        with conn:
+            cur = conn.cursor()
+            if get_relkind(cur, PARTITIONED_EMBEDDINGS_TABLE) is not None:
+                dimensions = get_vector_dimensions(cur, PARTITIONED_EMBEDDINGS_TABLE) or EMBEDDINGS_DIMENSIONS
+                create_partitioned_centroids_table(cur, PARTITIONED_EMBEDDINGS_TABLE, dimensions)
+
+                centroids_table = get_centroids_table(PARTITIONED_EMBEDDINGS_TABLE)
+                for source in sources:
+                    cur.execute(
+                        f"""SELECT 1 FROM {centroids_table} WHERE source = %(source)s LIMIT 1""", {'source': source}
+                    )
+                    if cur.fetchone() is None:
+                        insert_source_centroids(cur, PARTITIONED_EMBEDDINGS_TABLE, source)
+                        backfilled.append(source)
+            cur.close()
+    finally:
+        put_conn(pool, conn)
+
+    return backfilled
+
+
+def migrate_collections(names: Optional[List[str]] = None) -> None:
+    try:
+        configs = get_data_sources(names)
+        if EMBEDDINGS_STORAGE_LAYOUT == 'partitioned':
+            backfilled = migrate_partitioned_collection([config.name for config in configs])
+            print(f'{PARTITIONED_EMBEDDINGS_TABLE}: centroids built for {backfilled or "no source"}')
+            return
+
+        for config in configs:
+            migrated = migrate_collection(config.collection_name)
+            print(f'{config.collection_name}: {"migrated" if migrated else "skipped"}')
+
+    except Exception as err:
+        trace = traceback.format_exc()
+        print(f'Error: {err}')
+        print(trace)
+        raise
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Upgrade existing collections in place (columns, model tags, article centroids)'
+    )
+    parser.add_argument('sources', nargs='*', default=None)
+    args = parser.parse_args(argv)
+
+    migrate_collections(args.sources)
+
+
+if __name__ == '__main__':
+    main()
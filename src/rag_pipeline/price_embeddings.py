@@ -1,15 +1,13 @@
 import traceback
-import tiktoken
 
 from typing import List
 
-from src.vector_storage import RemoteDocumentsStorage
+from src.document_storage import RemoteDocumentsStorage
 from src.rag_pipeline.configs import (
     DB_CONFIGS,
-    DATA_SOURCES,
-    DataSourceConfig,
     TEXT_EMBEDDING_PRICE_CONFIGS
 )
+from src.rag_pipeline.registry import get_data_sources
 from src.utils.sql import PostgresDataSource, SqlEngine
 from src.document import RawDocument
 
@@ -18,6 +16,8 @@ def num_tokens_from_string(string: str, encoding_name="cl100k_base") -> int:
     if not string:
         return 0
     # return the number of tokens in a text string
+    import tiktoken
+
     encoding = tiktoken.get_encoding(encoding_name)
     num_tokens = len(encoding.encode(string))
     return num_tokens
@@ -59,8 +59,7 @@ def fetch_and_price_embeddings() -> List[dict]:
         storage = RemoteDocumentsStorage(sql)
 
         result = []
-        for data_source in DATA_SOURCES:
-            data_source_config = DataSourceConfig(**data_source)
+        for data_source_config in get_data_sources():
             documents = list(storage.list_documents(data_source_config.table_name))
 
             result += [
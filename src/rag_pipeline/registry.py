@@ -0,0 +1,96 @@
+import re
+import json
+
+from typing import Dict, List, Optional
+
+from src.rag_pipeline.configs import (
+    DB_CONFIGS,
+    DATA_SOURCES_PATH,
+    DATA_SOURCES_TABLE,
+    PARTITIONED_EMBEDDINGS_TABLE,
+    DataSourceConfig
+)
+from src.utils.sql import PostgresDataSource, SqlEngine
+
+
+# names go unquoted into partition, staging table and index names and into file names
+DATA_SOURCE_NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]*$')
+# the longest identifier built on a name is a staging index, {table}_{name}_{uuid8}_embedding_idx, and postgres
+# truncates identifiers past 63 bytes
+MAX_DATA_SOURCE_NAME_LENGTH = 63 - len(f"{PARTITIONED_EMBEDDINGS_TABLE.split('.')[-1]}__{'0' * 8}_embedding_idx")
+
+_data_sources: Optional[List[DataSourceConfig]] = None
+
+
+def load_data_sources_from_file(path: str) -> List[DataSourceConfig]:
+    with open(path, mode='r') as file:
+        return [DataSourceConfig(**data_source) for data_source in json.load(file)]
+
+
+def load_data_sources_from_table(sql: SqlEngine, table_name: str) -> List[DataSourceConfig]:
+    q = f"""
+    SELECT
+        {', '.join(DataSourceConfig._fields)}
+    FROM
+        {table_name}
+    ORDER BY
+        name
+    """
+
+    with sql.begin_transaction() as tx:
+        return [DataSourceConfig(**row) for row in tx.execute_query(q)]
+
+
+def load_data_sources() -> List[DataSourceConfig]:
+    if DATA_SOURCES_TABLE:
+        sql = SqlEngine(PostgresDataSource.from_credentials(**DB_CONFIGS))
+        try:
+            data_sources = load_data_sources_from_table(sql, DATA_SOURCES_TABLE)
+        finally:
+            sql.data_source.close()
+    else:
+        data_sources = load_data_sources_from_file(DATA_SOURCES_PATH)
+
+    names = [data_source.name for data_source in data_sources]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f'Duplicate data source names: {sorted(duplicates)}')
+
+    invalid = [
+        name for name in names
+        if not DATA_SOURCE_NAME_PATTERN.match(name) or len(name) > MAX_DATA_SOURCE_NAME_LENGTH
+    ]
+    if invalid:
+        raise ValueError(
+            f'Invalid data source names: {invalid}, expected lowercase letters, digits and underscores starting '
+            f'with a letter, at most {MAX_DATA_SOURCE_NAME_LENGTH} characters'
+        )
+
+    return data_sources
+
+
+def get_data_sources(names: Optional[List[str]] = None) -> List[DataSourceConfig]:
+    global _data_sources
+
+    if _data_sources is None:
+        _data_sources = load_data_sources()
+
+    if not names:
+        return list(_data_sources)
+
+    unknown = set(names) - {data_source.name for data_source in _data_sources}
+    if unknown:
+        raise ValueError(f'Unknown data sources: {sorted(unknown)}')
+
+    return [data_source for data_source in _data_sources if data_source.name in names]
+
+
+def get_data_source_titles() -> Dict[str, str]:
+    return {data_source.name: data_source.title for data_source in get_data_sources()}
+
+
+def reload_data_sources() -> List[DataSourceConfig]:
+    global _data_sources
+
+    _data_sources = None
+    return get_data_sources()
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from src.rag_pipeline.configs import TEXT_EMBEDDING_PRICE_CONFIGS, INGESTION_REPORTS_PATH
+
+
+CHUNK_TOKEN_BUCKETS = (32, 64, 128, 256, 384, 512, 768, 1024)
+CHUNKS_PER_ARTICLE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def build_histogram(values: Sequence[int], buckets: Sequence[int]) -> Dict[str, int]:
+    histogram = {f'<={bound}': 0 for bound in buckets}
+    histogram[f'>{buckets[-1]}'] = 0
+    for value in values:
+        for bound in buckets:
+            if value <= bound:
+                histogram[f'<={bound}'] += 1
+                break
+        else:
+            histogram[f'>{buckets[-1]}'] += 1
+
+    return histogram
+
+
+def get_actual_cost(model: Optional[str], tokens: int, batch_api: bool) -> float:
+    for price_config in TEXT_EMBEDDING_PRICE_CONFIGS:
+        if price_config.get('model') == model:
+            pricing = price_config.get('batch_pricing') if batch_api else price_config.get('pricing')
+            return tokens / 1000000 * pricing
+
+    # local and stub models are not billed
+    return 0.0
+
+
+class RunReport:
+    def __init__(self, pipeline: str, embedding_model: Optional[str] = None, batch_api: bool = False) -> None:
+        self.run_id = uuid.uuid4().hex
+        self.pipeline = pipeline
+        self.embedding_model = embedding_model
+        self.batch_api = batch_api
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+        self.status = 'running'
+        self.error: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self.chunk_tokens: List[int] = []
+        self.chunks_per_article: List[int] = []
+        self.api_calls = 0
+        self.retries = 0
+        self.usage_tokens = 0
+        # sources are ingested concurrently and share one report
+        self.lock = threading.RLock()
+
+    def get_source(self, source: str) -> Dict[str, Any]:
+        return self.sources.setdefault(source, {'documents': 0, 'chunks': 0, 'tokens': 0, 'stages': {}})
+
+    @contextmanager
+    def stage(self, name: str, source: Optional[str] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+                if source is not None:
+                    source_stages = self.get_source(source)['stages']
+                    source_stages[name] = source_stages.get(name, 0.0) + elapsed
+
+    def record_documents(self, source: str, count: int) -> None:
+        with self.lock:
+            self.get_source(source)['documents'] += count
+
+    def record_chunks(self, source: str, chunks: List[Any]) -> None:
+        per_article: Dict[int, int] = {}
+        for chunk in chunks:
+            per_article[chunk.article] = per_article.get(chunk.article, 0) + 1
+
+        with self.lock:
+            source_report = self.get_source(source)
+            source_report['chunks'] += len(chunks)
+            source_report['tokens'] += sum(chunk.tokens for chunk in chunks)
+
+            self.chunk_tokens += [chunk.tokens for chunk in chunks]
+            self.chunks_per_article += list(per_article.values())
+
+    def record_api_usage(self, tokens: int, api_calls: int = 1, retries: int = 0) -> None:
+        with self.lock:
+            self.usage_tokens += tokens
+            self.api_calls += api_calls
+            self.retries += retries
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.finished_at = datetime.now(timezone.utc)
+        self.status = 'failed' if error is not None else 'succeeded'
+        self.error = repr(error) if error is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        embedding_seconds = self.stages.get('embedding', 0.0)
+        finished_at = self.finished_at or datetime.now(timezone.utc)
+
+        return {
+            'run_id': self.run_id,
+            'pipeline': self.pipeline,
+            'status': self.status,
+            'error': self.error,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': finished_at.isoformat(),
+            'duration_seconds': (finished_at - self.started_at).total_seconds(),
+            'embedding_model': self.embedding_model,
+            'batch_api': self.batch_api,
+            'stages_seconds': self.stages,
+            'sources': self.sources,
+            'chunks': len(self.chunk_tokens),
+            'chunk_tokens': sum(self.chunk_tokens),
+            'chunk_tokens_histogram': build_histogram(self.chunk_tokens, CHUNK_TOKEN_BUCKETS),
+            'chunks_per_article_histogram': build_histogram(self.chunks_per_article, CHUNKS_PER_ARTICLE_BUCKETS),
+            'api_calls': self.api_calls,
+            'retries': self.retries,
+            'usage_tokens': self.usage_tokens,
+            'embedding_chunks_per_second': len(self.chunk_tokens) / embedding_seconds if embedding_seconds else None,
+            'embedding_tokens_per_second': self.usage_tokens / embedding_seconds if embedding_seconds else None,
+            'cost': get_actual_cost(self.embedding_model, self.usage_tokens, self.batch_api),
+        }
+
+
+def save_run_report(report: RunReport, path: str = INGESTION_REPORTS_PATH) -> None:
+    # one json line per run, runs are compared by reading the whole file back
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, mode='a') as file:
+        file.write(json.dumps(report.to_dict()) + '\n')
+
+
+def load_run_reports(path: str = INGESTION_REPORTS_PATH) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+
+    with open(path, mode='r') as file:
+        return [json.loads(line) for line in file if line.strip()]
@@ -2,17 +2,18 @@ import csv
 import copy
 import traceback
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-from langchain_community.document_loaders import PyMuPDFLoader
-
-from src.vector_storage import RemoteDocumentsStorage
+from src.document_storage import RemoteDocumentsStorage
 
 from src.rag_pipeline.configs import (
     DB_CONFIGS,
-    DATA_SOURCES,
-    DataSourceConfig
+    DataSourceConfig,
+    INGESTION_WORKERS
 )
+from src.rag_pipeline.registry import get_data_sources
+from src.rag_pipeline.run_report import RunReport, save_run_report
 from src.utils.sql import PostgresDataSource, SqlEngine
 from src.document import RawDocument
 
@@ -46,13 +47,36 @@ def build_cut_words(fixed_part: str, variable_part: int) -> List[str]:
     ]
 
 
-def load_documents(config: DataSourceConfig) -> List[RawDocument]:
+def load_documents(config: DataSourceConfig, report: Optional[RunReport] = None) -> List[RawDocument]:
+    report = report or RunReport(pipeline='load_documents')
+
     # load pdf
-    pdf_loader = PyMuPDFLoader(config.content)
-    pages = pdf_loader.load()[config.start_page:config.end_page]
-    pages_content = [page.page_content for page in pages]
-    restored_document = '\n '.join(pages_content)
+    with report.stage('pdf_parse', config.name):
+        restored_document = load_text(config)
+
+    with report.stage('segmentation', config.name):
+        return segment_documents(config, restored_document)
+
+
+def load_text(config: DataSourceConfig) -> str:
+    # plain text sources (e.g. synthetic corpora) skip pdf parsing and page ranges
+    if config.content.endswith('.txt'):
+        with open(config.content, mode='r') as file:
+            return file.read()
+
+    return load_pdf_text(config)
+
+
+def load_pdf_text(config: DataSourceConfig) -> str:
+    # pymupdf directly, the text is the same as langchain's PyMuPDFLoader without importing langchain
+    import pymupdf
 
+    with pymupdf.open(config.content) as document:
+        pages_content = [page.get_text() for page in document][config.start_page:config.end_page]
+    return '\n '.join(pages_content)
+
+
+def segment_documents(config: DataSourceConfig, restored_document: str) -> List[RawDocument]:
     # load pdf document structure (chapter, section, article)
     with open(config.schema, mode='r') as file:
         table_of_contents = list(csv.DictReader(file))
@@ -110,23 +134,49 @@ def load_documents(config: DataSourceConfig) -> List[RawDocument]:
     ]
 
 
-def read_and_write_pdfs() -> None:
+def read_and_write_source(storage: RemoteDocumentsStorage, config: DataSourceConfig, report: RunReport) -> None:
+    documents = load_documents(config, report)
+    report.record_documents(config.name, len(documents))
+
+    with report.stage('db_write', config.name):
+        storage.create_table(config.table_name)
+        storage.upsert_documents(
+            table_name=config.table_name,
+            documents=documents
+        )
+
+
+def read_and_write_pdfs(names: Optional[List[str]] = None) -> RunReport:
+    report = RunReport(pipeline='upload_documents')
+
     try:
         data_source = PostgresDataSource.from_credentials(**DB_CONFIGS)
         sql = SqlEngine(data_source)
         storage = RemoteDocumentsStorage(sql)
 
-        for data_source in DATA_SOURCES:
-            data_source_config = DataSourceConfig(**data_source)
-            documents = load_documents(data_source_config)
+        # sources are independent, each one is parsed and written by its own worker
+        with ThreadPoolExecutor(max_workers=INGESTION_WORKERS) as executor:
+            futures = [
+                executor.submit(read_and_write_source, storage, config, report)
+                for config in get_data_sources(names)
+            ]
+            for future in futures:
+                future.result()
 
-            storage.upsert_documents(
-                table_name=data_source_config.table_name,
-                documents=documents
-            )
+        report.finish()
+        return report
 
     except Exception as err:
+        report.finish(err)
         trace = traceback.format_exc()
         print(f'Error: {err}')
         print(trace)
         raise
+
+    finally:
+        # a report that cannot be written must not replace the error the run ended with
+        try:
+            save_run_report(report)
+        except Exception as err:
+            print(f'Error: run report not saved: {err}')
+            print(traceback.format_exc())
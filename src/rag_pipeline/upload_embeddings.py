@@ -1,56 +1,73 @@
 import traceback
 
-from typing import List
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional
 
 from src.document_storage import RemoteDocumentsStorage
-from src.vector_storage import insert_embeddings
+from src.embeddings import EmbeddingProvider, get_embedding_provider
+from src.vector_storage import create_partitioned_collection, replace_partition
+from src.collection_versions import build_collection_version
+from src.rag_pipeline.batch_embeddings import clear_batch_state, get_batch_state_path, get_embeddings_via_batch
 from src.rag_pipeline.configs import (
     DB_CONFIGS,
-    DATA_SOURCES,
     DataSourceConfig,
     EMBEDDINGS_CHUNKS_SIZE,
-    EMBEDDINGS_MODEL
+    EMBEDDINGS_PROVIDER,
+    EMBEDDINGS_STORAGE_LAYOUT,
+    INGESTION_WORKERS,
+    PARTITIONED_EMBEDDINGS_TABLE
 )
 from src.rag_pipeline.price_embeddings import num_tokens_from_string
+from src.rag_pipeline.registry import get_data_sources
+from src.rag_pipeline.run_report import RunReport, save_run_report
 from src.utils.sql import PostgresDataSource, SqlEngine
 from src.document import RawDocument, EmbeddedDocument
 
 
-client = OpenAI()
-
-
-def get_embeddings(documents: List[EmbeddedDocument]) -> List[EmbeddedDocument]:
-    embeddings_result = []
-    for document in documents:
-        response = client.embeddings.create(
-            input=[document.contents.replace("\n", " ")],
-            model=EMBEDDINGS_MODEL
-        )
-
-        embeddings_result.append(EmbeddedDocument(
-           article=document.article,
-           url=document.url,
-           contents=document.contents,
-           tokens=document.tokens,
-           embedding=response.data[0].embedding
-        ))
-
-    return embeddings_result
-
-
-def chunk_documents(documents: List[RawDocument]) -> List[EmbeddedDocument]:
+def get_embeddings(
+        documents: List[EmbeddedDocument],
+        provider: Optional[EmbeddingProvider] = None,
+        report: Optional[RunReport] = None
+) -> List[EmbeddedDocument]:
+    provider = provider or get_embedding_provider()
+
+    result = provider.embed([document.contents for document in documents])
+    if report is not None:
+        report.record_api_usage(result.tokens, result.api_calls, result.retries)
+
+    return [
+        EmbeddedDocument(
+            chapter=document.chapter,
+            section=document.section,
+            article=document.article,
+            url=document.url,
+            contents=document.contents,
+            tokens=document.tokens,
+            chunk=document.chunk,
+            embedding=embedding,
+            embedding_model=provider.model_name
+        ) for document, embedding in zip(documents, result.embeddings)
+    ]
+
+
+def chunk_documents(
+        documents: List[RawDocument],
+        count_tokens: Callable[[str], int] = num_tokens_from_string
+) -> List[EmbeddedDocument]:
     chunk_result = []
     for document in documents:
-        token_count = num_tokens_from_string(document.contents)
+        token_count = count_tokens(document.contents)
 
         if token_count <= EMBEDDINGS_CHUNKS_SIZE:
             chunk_result.append(
                 EmbeddedDocument(
+                    chapter=document.chapter,
+                    section=document.section,
                     article=document.article,
                     url=document.url,
                     contents=document.contents,
-                    tokens=token_count
+                    tokens=token_count,
+                    chunk=0
                 )
             )
 
@@ -69,22 +86,27 @@ def chunk_documents(documents: List[RawDocument]) -> List[EmbeddedDocument]:
                 chunk_count += 1
 
             chunked_content = []
+            chunk_index = 0
             for i in range(chunk_count):
                 if end > total_words:
                     end = total_words
                 chunked_content = words[start:end]
                 chunked_content_string = ' '.join(chunked_content)
-                chunked_content_token_count = num_tokens_from_string(chunked_content_string)
+                chunked_content_token_count = count_tokens(chunked_content_string)
 
                 if chunked_content_token_count > 0:
                     chunk_result.append(
                         EmbeddedDocument(
+                            chapter=document.chapter,
+                            section=document.section,
                             article=document.article,
                             url=document.url,
                             contents=chunked_content_string,
-                            tokens=chunked_content_token_count
+                            tokens=chunked_content_token_count,
+                            chunk=chunk_index
                         )
                     )
+                    chunk_index += 1
 
                 start += size
                 end += size
@@ -92,26 +114,94 @@ def chunk_documents(documents: List[RawDocument]) -> List[EmbeddedDocument]:
     return chunk_result
 
 
-def chunk_and_create_embeddings() -> None:
+def chunk_and_embed_source(
+        storage: RemoteDocumentsStorage,
+        config: DataSourceConfig,
+        report: RunReport,
+        use_batch_api: bool = False
+) -> None:
+    name = config.name
+
+    with report.stage('db_read', name):
+        documents = list(storage.list_documents(config.table_name))
+    report.record_documents(name, len(documents))
+
+    with report.stage('chunking', name):
+        chunked_documents = chunk_documents(documents)
+    report.record_chunks(name, chunked_documents)
+
+    if use_batch_api:
+        # asynchronous, half-priced endpoint, all results are in hand before a write transaction is opened
+        state_path = get_batch_state_path(name)
+        with report.stage('embedding', name):
+            embedded_documents = get_embeddings_via_batch(
+                get_embedding_provider('openai').client,
+                chunked_documents,
+                report=report,
+                state_path=state_path
+            )
+
+        with report.stage('db_write', name):
+            write_collection(config, embedded_documents)
+        clear_batch_state(state_path)
+    else:
+        with report.stage('embedding', name):
+            embedded_documents = get_embeddings(chunked_documents, report=report)
+
+        with report.stage('db_write', name):
+            write_collection(config, embedded_documents)
+
+
+def write_collection(config: DataSourceConfig, documents: Iterable[EmbeddedDocument]) -> None:
+    if EMBEDDINGS_STORAGE_LAYOUT == 'partitioned':
+        # the new rows are loaded aside and swapped in, the old partition serves queries until then
+        replace_partition(PARTITIONED_EMBEDDINGS_TABLE, config.name, documents)
+    else:
+        # built as a new version next to the live one, the collection view flips once it is indexed
+        build_collection_version(config.collection_name, documents)
+
+
+def chunk_and_create_embeddings(use_batch_api: bool = False, names: Optional[List[str]] = None) -> RunReport:
+    report = RunReport(
+        pipeline='upload_embeddings',
+        embedding_model=get_embedding_provider().model_name,
+        batch_api=use_batch_api
+    )
+
     try:
+        if use_batch_api and EMBEDDINGS_PROVIDER != 'openai':
+            raise ValueError(f'Batch API requires the openai embeddings provider, got {EMBEDDINGS_PROVIDER}')
+
         data_source = PostgresDataSource.from_credentials(**DB_CONFIGS)
         sql = SqlEngine(data_source)
         storage = RemoteDocumentsStorage(sql)
 
-        for data_source in DATA_SOURCES:
-            data_source_config = DataSourceConfig(**data_source)
-            documents = list(storage.list_documents(data_source_config.table_name))
+        if EMBEDDINGS_STORAGE_LAYOUT == 'partitioned':
+            create_partitioned_collection(PARTITIONED_EMBEDDINGS_TABLE)
 
-            chunked_documents = chunk_documents(documents)
-            embedded_documents = get_embeddings(chunked_documents)
+        # sources are independent, each one is chunked, embedded and written by its own worker
+        with ThreadPoolExecutor(max_workers=INGESTION_WORKERS) as executor:
+            futures = [
+                executor.submit(chunk_and_embed_source, storage, config, report, use_batch_api)
+                for config in get_data_sources(names)
+            ]
+            for future in futures:
+                future.result()
 
-            insert_embeddings(
-                table_name=data_source_config.collection_name,
-                documents=embedded_documents,
-            )
+        report.finish()
+        return report
 
     except Exception as err:
+        report.finish(err)
         trace = traceback.format_exc()
         print(f'Error: {err}')
         print(trace)
         raise
+
+    finally:
+        # a report that cannot be written must not replace the error the run ended with
+        try:
+            save_run_report(report)
+        except Exception as err:
+            print(f'Error: run report not saved: {err}')
+            print(traceback.format_exc())
@@ -0,0 +1,291 @@
+import json
+import time
+import base64
+import uuid
+import hashlib
+import threading
+
+import numpy as np
+
+from functools import lru_cache
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+STUB_EMBEDDING_DIMENSIONS = 1536
+
+
+@lru_cache(maxsize=65536)
+def stub_vector(text: str, dimensions: int = STUB_EMBEDDING_DIMENSIONS) -> np.ndarray:
+    # deterministic hashed bag-of-words vector, texts sharing words end up close to each other
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in text.lower().split():
+        digest = hashlib.md5(word.strip('.,;:()[]"\'').encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        sign = 1.0 if digest[4] % 2 == 0 else -1.0
+        vector[index] += sign
+
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+
+    vector /= norm
+    vector.setflags(write=False)
+    return vector
+
+
+def stub_embedding(text: str, dimensions: int = STUB_EMBEDDING_DIMENSIONS) -> List[float]:
+    return stub_vector(text, dimensions).tolist()
+
+
+def encode_stub_embedding(text: str, dimensions: int, encoding_format: Optional[str]) -> Any:
+    # the python client asks for base64 encoded float32 by default
+    if encoding_format == 'base64':
+        return base64.b64encode(stub_vector(text, dimensions).tobytes()).decode('ascii')
+
+    return stub_embedding(text, dimensions)
+
+
+def count_stub_tokens(text: str) -> int:
+    return len(text.split())
+
+
+class FakeOpenAIState:
+    files: Dict[str, dict]
+    batches: Dict[str, dict]
+    requests: List[str]
+
+    def __init__(self, batch_polls_until_complete: int = 1, latency: float = 0.0) -> None:
+        self.files = {}
+        self.batches = {}
+        self.requests = []
+        self.batch_polls_until_complete = batch_polls_until_complete
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def create_embeddings(self, body: dict) -> dict:
+        inputs = body.get('input')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        dimensions = body.get('dimensions') or STUB_EMBEDDING_DIMENSIONS
+        encoding_format = body.get('encoding_format')
+
+        return {
+            'object': 'list',
+            'model': body.get('model'),
+            'data': [
+                {
+                    'object': 'embedding',
+                    'index': index,
+                    'embedding': encode_stub_embedding(text, dimensions, encoding_format),
+                } for index, text in enumerate(inputs)
+            ],
+            'usage': {
+                'prompt_tokens': sum(count_stub_tokens(text) for text in inputs),
+                'total_tokens': sum(count_stub_tokens(text) for text in inputs),
+            },
+        }
+
+    def create_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        file_object = {
+            'id': f'file-{uuid.uuid4().hex}',
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed',
+        }
+        with self.lock:
+            self.files[file_object['id']] = dict(file_object, content=content)
+
+        return file_object
+
+    def create_batch(self, body: dict) -> dict:
+        batch = {
+            'id': f'batch_{uuid.uuid4().hex}',
+            'object': 'batch',
+            'endpoint': body.get('endpoint'),
+            'input_file_id': body.get('input_file_id'),
+            'completion_window': body.get('completion_window'),
+            'status': 'validating',
+            'created_at': int(time.time()),
+            'output_file_id': None,
+            'error_file_id': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            'polls': 0,
+        }
+        with self.lock:
+            self.batches[batch['id']] = batch
+
+        return self.public_batch(batch)
+
+    def retrieve_batch(self, batch_id: str) -> Optional[dict]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+
+            batch['polls'] += 1
+            if batch['status'] != 'completed':
+                if batch['polls'] >= self.batch_polls_until_complete:
+                    self.run_batch(batch)
+                else:
+                    batch['status'] = 'in_progress'
+
+            return self.public_batch(batch)
+
+    def run_batch(self, batch: dict) -> None:
+        input_file = self.files[batch['input_file_id']]
+
+        output_lines = []
+        for line in input_file['content'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output_lines.append(json.dumps({
+                'id': f'batch_req_{uuid.uuid4().hex}',
+                'custom_id': request['custom_id'],
+                'response': {
+                    'status_code': 200,
+                    'request_id': uuid.uuid4().hex,
+                    'body': self.create_embeddings(request['body']),
+                },
+                'error': None,
+            }))
+
+        output_file = {
+            'id': f'file-{uuid.uuid4().hex}',
+            'object': 'file',
+            'bytes': 0,
+            'created_at': int(time.time()),
+            'filename': 'batch_output.jsonl',
+            'purpose': 'batch_output',
+            'status': 'processed',
+            'content': '\n'.join(output_lines).encode('utf-8'),
+        }
+        self.files[output_file['id']] = output_file
+
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+        batch['output_file_id'] = output_file['id']
+        batch['request_counts'] = {'total': len(output_lines), 'completed': len(output_lines), 'failed': 0}
+
+    @staticmethod
+    def public_batch(batch: dict) -> dict:
+        return {key: value for key, value in batch.items() if key != 'polls'}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: 'FakeOpenAIHttpServer'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self) -> None:
+        self.send_json({'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}}, 404)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self) -> None:
+        state = self.server.state
+        state.requests.append(f'POST {self.path}')
+        if state.latency:
+            time.sleep(state.latency)
+
+        if self.path == '/v1/embeddings':
+            self.send_json(state.create_embeddings(json.loads(self.read_body())))
+
+        elif self.path == '/v1/files':
+            message = BytesParser(policy=HTTP).parsebytes(
+                f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode('utf-8') + self.read_body()
+            )
+            fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+            self.send_json(state.create_file(
+                filename=fields['file'].get_filename(),
+                purpose=fields['purpose'].get_content().strip(),
+                content=fields['file'].get_payload(decode=True),
+            ))
+
+        elif self.path == '/v1/batches':
+            self.send_json(state.create_batch(json.loads(self.read_body())))
+
+        else:
+            self.send_not_found()
+
+    def do_GET(self) -> None:
+        state = self.server.state
+        state.requests.append(f'GET {self.path}')
+
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 3 and parts[1] == 'batches':
+            batch = state.retrieve_batch(parts[2])
+            if batch is None:
+                self.send_not_found()
+            else:
+                self.send_json(batch)
+
+        elif len(parts) == 4 and parts[1] == 'files' and parts[3] == 'content' and parts[2] in state.files:
+            body = state.files[parts[2]]['content']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        else:
+            self.send_not_found()
+
+
+class FakeOpenAIHttpServer(ThreadingHTTPServer):
+    state: FakeOpenAIState
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI embeddings, files and batches endpoints.
+
+    with FakeOpenAIServer() as server:
+        client = OpenAI(api_key='fake', base_url=server.base_url)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, **state_kwargs: Any) -> None:
+        self.httpd = FakeOpenAIHttpServer((host, port), FakeOpenAIHandler)
+        self.httpd.state = FakeOpenAIState(**state_kwargs)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def state(self) -> FakeOpenAIState:
+        return self.httpd.state
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'FakeOpenAIServer':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'FakeOpenAIServer':
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
@@ -0,0 +1,28 @@
+import time
+import threading
+
+
+class RateLimiter:
+    """
+    At most per_minute acquisitions per minute, spaced evenly instead of in bursts.
+
+    Thread safe, a caller over the rate sleeps until its slot.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def acquire(self) -> float:
+        # returns the seconds spent waiting
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
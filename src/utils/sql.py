@@ -7,6 +7,7 @@ from types import TracebackType
 from psycopg2.pool import ThreadedConnectionPool
 from contextlib import contextmanager
 from .iteration import iterable
+from .tracing import tracer
 
 ColumnDescription = Tuple[str, Any, Any, Any, Any, Any, Any]
 
@@ -180,7 +181,10 @@ class DbTransaction:
         cursor = self.connection.cursor()
         try:
             self.live_cursors.append(cursor)
-            cursor.execute(sql, kwargs)
+            with tracer.span('db.execute', method='query') as span:
+                cursor.execute(sql, kwargs)
+                # client side cursors already hold the whole result set
+                span.set_attribute('rows', cursor.rowcount)
             if cursor.description is not None:
                 col_names = [i[0] for i in cursor.description]
             else:
@@ -202,8 +206,10 @@ class DbTransaction:
         cursor = self.connection.cursor()
         try:
             self.live_cursors.append(cursor)
-            cursor.execute(sql, kwargs)
-            row = cursor.fetchone()
+            with tracer.span('db.execute', method='scalar') as span:
+                cursor.execute(sql, kwargs)
+                row = cursor.fetchone()
+                span.set_attribute('rows', 0 if row is None else 1)
             if row is None:
                 return None
             return row[0]
@@ -215,7 +221,9 @@ class DbTransaction:
         cursor = self.connection.cursor()
         try:
             self.live_cursors.append(cursor)
-            cursor.execute(sql, kwargs)
+            with tracer.span('db.execute', method='statement') as span:
+                cursor.execute(sql, kwargs)
+                span.set_attribute('rows', cursor.rowcount)
             return cursor.rowcount
         finally:
             cursor.close()
@@ -225,7 +233,8 @@ class DbTransaction:
         cursor = self.connection.cursor()
         try:
             self.live_cursors.append(cursor)
-            cursor.execute_many(sql, parameters)
+            with tracer.span('db.execute', method='batch'):
+                cursor.execute_many(sql, parameters)
         finally:
             cursor.close()
             self.live_cursors.remove(cursor)
@@ -265,8 +274,10 @@ class PostgresDataSource(DataSource):
 
     @contextmanager
     def get_connection(self) -> Iterator[DbConnection]:
+        connection = None
         try:
-            connection = self.pool.getconn()
+            with tracer.span('db.pool_wait'):
+                connection = self.pool.getconn()
             yield PostgresConnection(connection)
         finally:
             if connection:
@@ -0,0 +1,166 @@
+import os
+import time
+import uuid
+import threading
+
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+# prometheus default buckets, seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> 'NoopSpan':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'start', 'end', 'error', 'token')
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.error = None
+        self.end = None
+
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter_ns()) - self.start
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> 'Span':
+        self.token = _current_span.set(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.end = time.perf_counter_ns()
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer.finish(self)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+class Tracer:
+    """
+    In-process spans and metrics for the answer path and the database layer.
+
+    Disabled tracers hand out a shared no-op span, so instrumented code only pays for one attribute lookup.
+    Metrics are exported in the Prometheus text format, finished spans as OpenTelemetry-style dicts.
+    """
+
+    def __init__(self, enabled: bool = False, max_spans: int = 10000) -> None:
+        self.enabled = enabled
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+        self.durations: Dict[str, List[int]] = {}
+        self.duration_sums: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.attribute_totals: Dict[Tuple[str, str], float] = {}
+        # wall clock offset to turn perf_counter_ns into unix nanoseconds on export
+        self.epoch_offset = time.time_ns() - time.perf_counter_ns()
+
+    def span(self, name: str, **attributes: Any):
+        if not self.enabled:
+            return NOOP_SPAN
+
+        return Span(self, name, attributes)
+
+    def finish(self, span: Span) -> None:
+        seconds = span.duration / 1e9
+        with self.lock:
+            self.spans.append(span)
+
+            buckets = self.durations.setdefault(span.name, [0] * len(DURATION_BUCKETS))
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            self.duration_sums[span.name] = self.duration_sums.get(span.name, 0.0) + seconds
+            self.counts[span.name] = self.counts.get(span.name, 0) + 1
+            if span.error:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+
+            # numeric attributes (tokens, rows, ...) are accumulated as counters
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.attribute_totals[(span.name, key)] = self.attribute_totals.get((span.name, key), 0) + value
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans.clear()
+            self.durations.clear()
+            self.duration_sums.clear()
+            self.counts.clear()
+            self.errors.clear()
+            self.attribute_totals.clear()
+
+    def export_prometheus(self, prefix: str = 'rag') -> str:
+        with self.lock:
+            lines = [
+                f'# HELP {prefix}_span_duration_seconds Duration of instrumented stages.',
+                f'# TYPE {prefix}_span_duration_seconds histogram',
+            ]
+            for name, buckets in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f'{prefix}_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {self.counts[name]}')
+                lines.append(f'{prefix}_span_duration_seconds_sum{{span="{name}"}} {self.duration_sums[name]}')
+                lines.append(f'{prefix}_span_duration_seconds_count{{span="{name}"}} {self.counts[name]}')
+
+            lines += [
+                f'# HELP {prefix}_span_errors_total Instrumented stages that raised.',
+                f'# TYPE {prefix}_span_errors_total counter',
+            ]
+            for name, count in sorted(self.errors.items()):
+                lines.append(f'{prefix}_span_errors_total{{span="{name}"}} {count}')
+
+            lines += [
+                f'# HELP {prefix}_span_attribute_total Sum of numeric span attributes (tokens, rows, ...).',
+                f'# TYPE {prefix}_span_attribute_total counter',
+            ]
+            for (name, key), total in sorted(self.attribute_totals.items()):
+                lines.append(f'{prefix}_span_attribute_total{{span="{name}",attribute="{key}"}} {total}')
+
+        return '\n'.join(lines) + '\n'
+
+    def export_spans(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [
+                {
+                    'trace_id': span.trace_id,
+                    'span_id': span.span_id,
+                    'parent_span_id': span.parent_id,
+                    'name': span.name,
+                    'start_time_unix_nano': span.start + self.epoch_offset,
+                    'end_time_unix_nano': span.end + self.epoch_offset,
+                    'status': 'ERROR' if span.error else 'OK',
+                    'attributes': dict(span.attributes),
+                } for span in self.spans
+            ]
+
+
+tracer = Tracer(enabled=os.getenv('TRACING_ENABLED', '').lower() in ('1', 'true', 'yes'))
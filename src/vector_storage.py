@@ -1,17 +1,39 @@
+import uuid
+import hashlib
+import threading
 import psycopg2
+import psycopg2.extensions
 
 import numpy as np
 
-from typing import Iterable, List, Optional
-from psycopg2.pool import SimpleConnectionPool
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from psycopg2.extras import execute_values
 from pgvector.psycopg2 import register_vector
 
 from src.document import EmbeddedDocument
-from src.rag_pipeline.configs import DB_CONFIGS
+from src.rag_pipeline.configs import (
+    DB_CONFIGS,
+    DB_POOL_MAX_CONNECTIONS,
+    DB_POOL_TIMEOUT,
+    EMBEDDINGS_DIMENSIONS,
+    EMBEDDINGS_MODEL,
+    FULL_TEXT_LANGUAGE,
+    HIERARCHICAL_ARTICLES,
+    HIERARCHICAL_CHUNKS_PER_ARTICLE,
+    HNSW_FILTERED_EF_SEARCH,
+    HNSW_ITERATIVE_SCAN
+)
+from src.utils.iteration import batch_by
+from src.utils.sql import QueryBuilder
+from src.utils.tracing import tracer
+
+
+EMBEDDINGS_INSERT_BATCH_SIZE = 1000
 
 
 _pool = None
+_pool_lock = threading.Lock()
 
 
 def db():
@@ -23,10 +45,40 @@ def db():
     return _pool
 
 
+class PreparedConnection(psycopg2.extensions.connection):
+    # server-side prepared statements live as long as the session, remember which ones this one has
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class WaitingConnectionPool(ThreadedConnectionPool):
+    # ThreadedConnectionPool raises as soon as maxconn connections are out, callers here wait for one instead
+    def __init__(self, minconn: int, maxconn: int, *args: Any, timeout: float = DB_POOL_TIMEOUT, **kwargs: Any) -> None:
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self.available = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key: Any = None) -> Any:
+        if not self.available.acquire(timeout=self.timeout):
+            raise PoolError(f'No free connection within {self.timeout}s')
+        try:
+            return super().getconn(key)
+        except Exception:
+            self.available.release()
+            raise
+
+    def putconn(self, conn: Any = None, key: Any = None, close: bool = False) -> None:
+        super().putconn(conn, key, close)
+        self.available.release()
+
+
 def create_pool():
-    return psycopg2.pool.SimpleConnectionPool(
+    # shared by concurrent retrieval fan-out and ingestion workers
+    return WaitingConnectionPool(
         minconn=1,
-        maxconn=2,
+        maxconn=DB_POOL_MAX_CONNECTIONS,
+        connection_factory=PreparedConnection,
         **DB_CONFIGS
     )
 
@@ -34,80 +86,882 @@ def create_pool():
 def get_pool():
     global _pool
 
+    # the first requests of a server arrive together, only one of them creates the pool
     if _pool is None:
-        db()
+        with _pool_lock:
+            if _pool is None:
+                db()
 
     return _pool
 
 
 def get_conn(pool):
-    return pool.getconn()
+    with tracer.span('db.pool_wait'):
+        return pool.getconn()
 
 
 def put_conn(pool, conn):
     pool.putconn(conn)
 
 
+def encode_vector(embedding: Sequence[float]) -> str:
+    # pgvector stores float32, 9 significant digits round-trip it exactly and take about half the
+    # bytes of the float64 repr the default adapter sends
+    values = np.asarray(embedding, dtype=np.float32).tolist()
+    return '[' + ','.join(['%.9g' % value for value in values]) + ']'
+
+
+def get_statement_name(sql: str) -> str:
+    return 'q_' + hashlib.md5(sql.encode('utf-8')).hexdigest()[:16]
+
+
+def execute_prepared(conn: PreparedConnection, cur, sql: str, parameter_types: List[str], parameters: List[Any]) -> None:
+    # parsed once per session, later calls only send EXECUTE with the parameters
+    name = get_statement_name(sql + repr(parameter_types))
+
+    try:
+        if name not in conn.prepared_statements:
+            cur.execute(f"PREPARE {name} ({', '.join(parameter_types)}) AS {sql}")
+            conn.prepared_statements.add(name)
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(parameters))})", parameters)
+
+    except psycopg2.Error:
+        # start from a clean session on the next call, whatever this one has prepared; a closed connection is
+        # discarded by the pool, and a failing cleanup must not replace the error of the statement
+        conn.prepared_statements.clear()
+        if not conn.closed:
+            try:
+                conn.rollback()
+                cur.execute("DEALLOCATE ALL")
+                conn.commit()
+            except psycopg2.Error:
+                pass
+        raise
+
+
+class RetrievalFilter(NamedTuple):
+    sources: Optional[List[str]] = None
+    chapters: Optional[List[int]] = None
+    sections: Optional[List[int]] = None
+    articles: Optional[List[int]] = None
+
+
+def get_index_name(table_name: str, suffix: str) -> str:
+    return f"{table_name.split('.')[-1]}_{suffix}"
+
+
 # TODO: extend SqlEngine class
-def get_similar_gdpr_documents(embedding_array: np.array) -> List[EmbeddedDocument]:
+def create_collection(table_name: str, dimensions: int = EMBEDDINGS_DIMENSIONS) -> None:
     pool = get_pool()
 
-    with get_conn(pool) as conn:
-        register_vector(conn)
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT contents FROM llm_legal_chatbot.gdpr_embeddings ORDER BY embedding <=> %s LIMIT 3",
-            (embedding_array,)
-        )
-        similar_documents = cur.fetchall()
-        cur.close()
-        conn.commit()
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            create_collection_table(cur, table_name, dimensions)
+            ensure_collection_schema(cur, table_name)
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+
+def create_collection_table(cur, table_name: str, dimensions: int = EMBEDDINGS_DIMENSIONS) -> None:
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    if '.' in table_name:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {table_name.split('.')[0]}")
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        id BIGSERIAL PRIMARY KEY
+        , chapter INTEGER
+        , section INTEGER
+        , article INTEGER NOT NULL
+        , url TEXT
+        , contents TEXT
+        , tokens INTEGER
+        , chunk INTEGER
+        , embedding vector({dimensions})
+        , embedding_model TEXT
+    )
+    """)
+
+
+# TODO: extend SqlEngine class
+def ensure_collection_schema(cur, table_name: str) -> None:
+    # collections are tagged by embedding model, rows of another model are never returned by similarity search
+    cur.execute(f"""ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS embedding_model TEXT""")
+    cur.execute(f"""ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS chapter INTEGER""")
+    cur.execute(f"""ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS section INTEGER""")
+    cur.execute(f"""ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS chunk INTEGER""")
+    # rows written before the column existed were embedded with the openai model, untagged they match no search
+    cur.execute(
+        f"""UPDATE {table_name} SET embedding_model = %(embedding_model)s WHERE embedding_model IS NULL""",
+        {'embedding_model': EMBEDDINGS_MODEL}
+    )
+    create_collection_indexes(cur, table_name)
+
+
+def get_vector_dimensions(cur, table_name: str) -> Optional[int]:
+    # declared size of the embedding column (pgvector keeps it as the type modifier), None if unsized or missing
+    cur.execute(
+        """
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = to_regclass(%(table)s) AND attname = 'embedding' AND NOT attisdropped
+        """,
+        {'table': table_name}
+    )
+    row = cur.fetchone()
+    return row[0] if row is not None and row[0] > 0 else None
+
+
+def check_dimensions(documents: List[EmbeddedDocument], table_name: str, dimensions: Optional[int]) -> None:
+    for document in documents:
+        if dimensions is not None and document.embedding is not None and len(document.embedding) != dimensions:
+            raise ValueError(
+                f'{document.embedding_model} embeddings have {len(document.embedding)} dimensions, '
+                f'{table_name} stores vector({dimensions}): set EMBEDDINGS_DIMENSIONS or re-create the collection'
+            )
+
+
+def create_collection_indexes(cur, table_name: str) -> None:
+    # scoped searches filter on these before ranking by distance
+    cur.execute(
+        f"""CREATE INDEX IF NOT EXISTS {get_index_name(table_name, 'metadata_idx')} """
+        f"""ON {table_name} (embedding_model, chapter, section, article)"""
+    )
+    # expression must match the one used by get_lexical_documents for the planner to pick the GIN index
+    cur.execute(
+        f"""CREATE INDEX IF NOT EXISTS {get_index_name(table_name, 'contents_fts_idx')} """
+        f"""ON {table_name} USING GIN (to_tsvector('{FULL_TEXT_LANGUAGE}', contents))"""
+    )
+    # second level of the hierarchical search, chunks of the selected articles only
+    cur.execute(
+        f"""CREATE INDEX IF NOT EXISTS {get_index_name(table_name, 'article_idx')} """
+        f"""ON {table_name} (embedding_model, article)"""
+    )
+
+
+def get_centroids_table(table_name: str) -> str:
+    return f'{table_name}_articles'
+
+
+def build_article_centroids(cur, table_name: str, centroids_table: Optional[str] = None) -> None:
+    # first level of the hierarchical search: one mean embedding per article, cosine distance ignores its norm
+    centroids_table = centroids_table or get_centroids_table(table_name)
+    cur.execute(f"""DROP TABLE IF EXISTS {centroids_table}""")
+    cur.execute(f"""
+    CREATE TABLE {centroids_table} AS
+    SELECT
+        embedding_model
+        , MIN(chapter) AS chapter
+        , MIN(section) AS section
+        , article
+        , count(*) AS chunks
+        , AVG(embedding) AS embedding
+    FROM
+        {table_name}
+    GROUP BY
+        embedding_model
+        , article
+    """)
+    cur.execute(
+        f"""CREATE INDEX IF NOT EXISTS {get_index_name(centroids_table, 'metadata_idx')} """
+        f"""ON {centroids_table} (embedding_model, chapter, section, article)"""
+    )
+
+
+def insert_source_centroids(cur, table_name: str, source: str, chunks_table: Optional[str] = None) -> None:
+    # centroids of one source of a partitioned collection, from its partition or the whole collection
+    centroids_table = get_centroids_table(table_name)
+    cur.execute(
+        f"""
+        INSERT INTO {centroids_table} (source, embedding_model, chapter, section, article, chunks, embedding)
+        SELECT %(source)s, embedding_model, MIN(chapter), MIN(section), article, count(*), AVG(embedding)
+        FROM {chunks_table or table_name}
+        WHERE source = %(source)s
+        GROUP BY embedding_model, article
+        """,
+        {'source': source}
+    )
+
+
+# TODO: extend SqlEngine class
+def has_article_centroids(table_name: str, source: Optional[str] = None) -> bool:
+    # collections written before the hierarchical search have none, a partitioned one may lack some sources
+    centroids_table = get_centroids_table(table_name)
+
+    pool = get_pool()
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("""SELECT to_regclass(%(table)s) IS NOT NULL""", {'table': centroids_table})
+            found = cur.fetchone()[0]
+            if found:
+                where = 'WHERE source = %(source)s ' if source is not None else ''
+                cur.execute(f"""SELECT 1 FROM {centroids_table} {where}LIMIT 1""", {'source': source})
+                found = cur.fetchone() is not None
+            cur.close()
+    finally:
+        put_conn(pool, conn)
+
+    return found
+
+
+def get_partition_name(table_name: str, source: str) -> str:
+    return f'{table_name}_{source}'
+
+
+def create_partitioned_centroids_table(cur, table_name: str, dimensions: int = EMBEDDINGS_DIMENSIONS) -> None:
+    centroids_table = get_centroids_table(table_name)
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {centroids_table} (
+        source TEXT NOT NULL
+        , embedding_model TEXT
+        , chapter INTEGER
+        , section INTEGER
+        , article INTEGER NOT NULL
+        , chunks INTEGER
+        , embedding vector({dimensions})
+    )
+    """)
+    cur.execute(
+        f"""CREATE INDEX IF NOT EXISTS {get_index_name(centroids_table, 'metadata_idx')} """
+        f"""ON {centroids_table} (source, embedding_model, chapter, section, article)"""
+    )
 
-    put_conn(pool, conn)
 
-    return similar_documents
+# TODO: extend SqlEngine class
+def create_partitioned_collection(table_name: str, dimensions: int = EMBEDDINGS_DIMENSIONS) -> None:
+    pool = get_pool()
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            if '.' in table_name:
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {table_name.split('.')[0]}")
+            # one list partition per data source, the partition key has to be part of the primary key
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                id BIGSERIAL
+                , source TEXT NOT NULL
+                , chapter INTEGER
+                , section INTEGER
+                , article INTEGER NOT NULL
+                , url TEXT
+                , contents TEXT
+                , tokens INTEGER
+                , chunk INTEGER
+                , embedding vector({dimensions})
+                , embedding_model TEXT
+                , PRIMARY KEY (source, id)
+            ) PARTITION BY LIST (source)
+            """)
+            # created on the parent, every attached partition must carry a matching index
+            create_collection_indexes(cur, table_name)
+            create_partitioned_centroids_table(cur, table_name, dimensions)
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+
+def set_filtered_scan(cur, filters: Optional[RetrievalFilter]) -> None:
+    # for the current transaction only: without it a chapter holding a tenth of the rows gets about 4 of the
+    # 40 rows of the default hnsw scan, not the limit asked for
+    if not get_filter_conditions(filters):
+        return
+
+    cur.execute("""SET LOCAL hnsw.ef_search = %(ef_search)s""", {'ef_search': HNSW_FILTERED_EF_SEARCH})
+    if HNSW_ITERATIVE_SCAN != 'off':
+        cur.execute("""SET LOCAL hnsw.iterative_scan = %(scan)s""", {'scan': HNSW_ITERATIVE_SCAN})
 
 
 # TODO: extend SqlEngine class
-def get_similar_ai_act_documents(embedding_array: np.array) -> List[EmbeddedDocument]:
+def fetch_documents(
+        query: dict,
+        source: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None
+) -> List[EmbeddedDocument]:
+    # filters are passed by the vector searches only, they set the filtered hnsw scan
     pool = get_pool()
 
-    with get_conn(pool) as conn:
-        register_vector(conn)
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT contents FROM llm_legal_chatbot.ai_act_embeddings ORDER BY embedding <=> %s LIMIT 3",
-            (embedding_array,)
+    parameters = dict(query)
+    sql = parameters.pop('sql')
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            register_vector(conn)
+            cur = conn.cursor()
+            set_filtered_scan(cur, filters)
+            with tracer.span('db.execute', method='query', source=source) as span:
+                cur.execute(sql, parameters)
+                rows = cur.fetchall()
+                span.set_attribute('rows', len(rows))
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+    return build_documents(rows, source)
+
+
+def build_documents(rows: List[tuple], source: Optional[str] = None) -> List[EmbeddedDocument]:
+    # rows of a partitioned collection carry their own source as a trailing column
+    return [
+        EmbeddedDocument(
+            chapter=chapter,
+            section=section,
+            article=article,
+            url=url,
+            contents=contents,
+            tokens=tokens,
+            chunk=chunk,
+            embedding_model=embedding_model,
+            source=row_source[0] if row_source else source,
+        ) for chapter, section, article, url, contents, tokens, chunk, embedding_model, *row_source in rows
+    ]
+
+
+def get_filter_conditions(filters: Optional[RetrievalFilter]) -> List[Tuple[str, list]]:
+    # sources are not a condition: a collection is one source, a partitioned one is searched per source
+    conditions = []
+    if filters is not None:
+        if filters.chapters:
+            conditions.append(('chapter = ANY({})', list(filters.chapters)))
+        if filters.sections:
+            conditions.append(('section = ANY({})', list(filters.sections)))
+        if filters.articles:
+            conditions.append(('article = ANY({})', list(filters.articles)))
+
+    return conditions
+
+
+def select_documents(
+        table_name: str,
+        embedding_model: str,
+        filters: Optional[RetrievalFilter] = None,
+        partitioned: bool = False,
+        extra_columns: str = ''
+) -> QueryBuilder:
+    columns = 'chapter, section, article, url, contents, tokens, chunk, embedding_model'
+    if partitioned:
+        columns += ', source'
+
+    query = (
+        QueryBuilder(f"SELECT {columns}{extra_columns} FROM {table_name}")
+        .where('embedding_model = {}', embedding_model)
+    )
+
+    if partitioned:
+        query = query.where(PER_SOURCE_CONDITION)
+    for condition, value in get_filter_conditions(filters):
+        query = query.where(condition, value)
+
+    return query
+
+
+# a partitioned collection runs each search once per source, see per_source_query
+PER_SOURCE_CONDITION = 'source = per_source.source'
+
+
+def per_source_query(query: dict, filters: Optional[RetrievalFilter]) -> dict:
+    # the ordered, limited search once per source: every LATERAL subquery is pruned to the partition of its
+    # source and keeps that partition's index scan and its own limit, same as one search per collection
+    parameters = dict(query)
+    sql = parameters.pop('sql')
+    return dict(
+        parameters,
+        sql=(
+            f"SELECT searches.* FROM unnest(%(sources)s::text[]) AS per_source(source) "
+            f"CROSS JOIN LATERAL ({sql}) AS searches"
+        ),
+        sources=list(filters.sources if filters is not None and filters.sources else []),
+    )
+
+
+def get_similar_documents(
+        table_name: str,
+        embedding_array: np.array,
+        embedding_model: str,
+        limit: int = 3,
+        source: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None,
+        partitioned: bool = False
+) -> List[EmbeddedDocument]:
+    query = (
+        select_documents(table_name, embedding_model, filters, partitioned)
+        .order_by('embedding <=> %(embedding)s::vector')
+        .limit(limit)
+        .build()
+    )
+    if partitioned:
+        query = per_source_query(query, filters)
+
+    return fetch_documents(dict(query, embedding=encode_vector(embedding_array)), source, filters)
+
+
+def get_hierarchical_documents(
+        table_name: str,
+        embedding_array: np.array,
+        embedding_model: str,
+        limit: int = 3,
+        source: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None,
+        partitioned: bool = False,
+        articles: int = HIERARCHICAL_ARTICLES,
+        chunks_per_article: int = HIERARCHICAL_CHUNKS_PER_ARTICLE
+) -> List[EmbeddedDocument]:
+    # the closest article centroids first, then only the chunks of those articles are ranked
+    key = 'source, article' if partitioned else 'article'
+    filter_conditions = get_filter_conditions(filters)
+    centroid_conditions = ' AND '.join(
+        ['embedding_model = {}'] + ([PER_SOURCE_CONDITION] if partitioned else [])
+        + [condition for condition, _ in filter_conditions]
+    )
+
+    distance = 'embedding <=> %(embedding)s::vector'
+    query = (
+        select_documents(
+            table_name, embedding_model, filters, partitioned,
+            f', {distance} AS distance, row_number() OVER (PARTITION BY {key} ORDER BY {distance}) AS article_rank'
+        )
+        .where(
+            f'({key}) IN (SELECT {key} FROM {get_centroids_table(table_name)} '
+            f'WHERE {centroid_conditions} ORDER BY {distance} LIMIT {{}})',
+            embedding_model, *[value for _, value in filter_conditions], articles
         )
-        similar_documents = cur.fetchall()
-        cur.close()
-        conn.commit()
+        .build()
+    )
+
+    columns = 'chapter, section, article, url, contents, tokens, chunk, embedding_model' + (', source' if partitioned else '')
+    sql = f"""
+    SELECT {columns} FROM ({query.pop('sql')}) AS ranked
+    WHERE article_rank <= %(chunks_per_article)s
+    ORDER BY distance
+    LIMIT %(limit)s
+    """
+
+    query = dict(query, sql=sql)
+    if partitioned:
+        query = per_source_query(query, filters)
+
+    return fetch_documents(
+        dict(query, embedding=encode_vector(embedding_array), chunks_per_article=chunks_per_article, limit=limit),
+        source,
+        filters
+    )
 
-    put_conn(pool, conn)
 
-    return similar_documents
+def get_ts_query(text: str) -> str:
+    # any word of the question may match and ts_rank_cd ranks chunks with more of them first, the AND of
+    # websearch_to_tsquery would need every word of a natural-language question ("say", "require", ...) in one chunk;
+    # the lexemes are already stemmed, 'simple' only quotes them back into a query
+    return (
+        f"to_tsquery('simple', (SELECT string_agg(quote_literal(lexeme), ' | ') "
+        f"FROM unnest(to_tsvector('{FULL_TEXT_LANGUAGE}', {text}))))"
+    )
+
+
+def get_lexical_documents(
+        table_name: str,
+        text: str,
+        embedding_model: str,
+        limit: int = 3,
+        source: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None,
+        partitioned: bool = False
+) -> List[EmbeddedDocument]:
+    ts_vector = f"to_tsvector('{FULL_TEXT_LANGUAGE}', contents)"
+    ts_query = get_ts_query('%(text)s')
+
+    query = (
+        select_documents(table_name, embedding_model, filters, partitioned)
+        .where(f'{ts_vector} @@ {ts_query}')
+        .order_by(f'ts_rank_cd({ts_vector}, {ts_query}) DESC')
+        .limit(limit)
+        .build()
+    )
+    if partitioned:
+        query = per_source_query(query, filters)
+
+    return fetch_documents(dict(query, text=text), source)
+
+
+def get_article_documents(
+        table_name: str,
+        articles: List[int],
+        embedding_model: str,
+        limit: int = 3,
+        source: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None,
+        partitioned: bool = False
+) -> List[EmbeddedDocument]:
+    query = (
+        select_documents(table_name, embedding_model, filters, partitioned)
+        .where('article = ANY({})', articles)
+        .order_by('article', 'chunk')
+        .limit(limit)
+        .build()
+    )
+    if partitioned:
+        query = per_source_query(query, filters)
+
+    return fetch_documents(query, source)
+
+
+class CollectionSearch(NamedTuple):
+    table_name: str
+    source: str
+    # runs the article fast path on this collection when the question names articles
+    article_fast_path: bool = False
+    # ranks article centroids first, only for collections that have them
+    hierarchical: bool = False
+
+
+SEARCH_COLUMNS = 'chapter, section, article, url, contents, tokens, chunk, embedding_model'
+
+
+def build_collections_search(
+        collections: List[CollectionSearch],
+        filters: Optional[RetrievalFilter] = None,
+        articles: Optional[List[int]] = None,
+        batch: bool = False
+) -> Tuple[str, List[str], List[str]]:
+    # one statement for the vector, lexical and article searches of every collection, parameters are shared:
+    # $1 query embedding, $2 query text, $3 embedding model, $4 candidates, $5 article limit, then filters
+    # a batch passes arrays in $1 and $2 and runs the same searches once per question (LATERAL over unnest)
+    if batch:
+        parameter_types = ['vector[]', 'text[]', 'text', 'integer', 'integer']
+        parameter_names = ['embeddings', 'texts', 'embedding_model', 'candidates', 'article_limit']
+        embedding, text = 'question.embedding', 'question.text'
+    else:
+        parameter_types = ['vector', 'text', 'text', 'integer', 'integer']
+        parameter_names = ['embedding', 'text', 'embedding_model', 'candidates', 'article_limit']
+        embedding, text = '$1', '$2'
+
+    conditions = ['embedding_model = $3']
+    for name, column in (('chapters', 'chapter'), ('sections', 'section'), ('articles', 'article')):
+        if filters is not None and getattr(filters, name):
+            parameter_types.append('integer[]')
+            parameter_names.append(name)
+            conditions.append(f'{column} = ANY(${len(parameter_types)})')
+
+    if any(collection.hierarchical for collection in collections):
+        parameter_types += ['integer', 'integer']
+        parameter_names += ['hierarchical_articles', 'chunks_per_article']
+    hierarchical_index = len(parameter_types) - 1
+
+    if articles and batch:
+        # per question, as array literals: the referenced articles and the collections taking the fast path
+        parameter_types += ['text[]', 'text[]']
+        parameter_names += ['fast_path_articles', 'fast_path_collections']
+    elif articles:
+        parameter_types.append('integer[]')
+        parameter_names.append('fast_path_articles')
+
+    ts_vector = f"to_tsvector('{FULL_TEXT_LANGUAGE}', contents)"
+    ts_query = get_ts_query(text)
+
+    def branch(index: int, table_name: str, kind: str, condition: Optional[str], order: str, limit: str) -> str:
+        where = ' AND '.join(conditions + ([condition] if condition else []))
+        return (
+            f"(SELECT {index} AS collection, '{kind}' AS kind, {SEARCH_COLUMNS}, "
+            f"row_number() OVER (ORDER BY {order}) AS rank FROM {table_name} "
+            f"WHERE {where} ORDER BY {order} LIMIT {limit})"
+        )
+
+    # UNION ALL does not keep the order of its branches, every branch projects its rank and the rows are sorted
+    # by (collection, kind, rank) after the fetch
+    branches = []
+    for index, collection in enumerate(collections):
+        if collection.hierarchical:
+            # closest article centroids first, then at most chunks_per_article chunks of each of those articles
+            where = ' AND '.join(conditions)
+            branches.append(
+                f"(SELECT {index} AS collection, 'vector' AS kind, {SEARCH_COLUMNS}, "
+                f"row_number() OVER (ORDER BY distance) AS rank FROM ("
+                f"SELECT {SEARCH_COLUMNS}, embedding <=> {embedding} AS distance, "
+                f"row_number() OVER (PARTITION BY article ORDER BY embedding <=> {embedding}) AS article_rank "
+                f"FROM {collection.table_name} WHERE {where} AND article IN ("
+                f"SELECT article FROM {get_centroids_table(collection.table_name)} WHERE {where} "
+                f"ORDER BY embedding <=> {embedding} LIMIT ${hierarchical_index})"
+                f") AS ranked WHERE article_rank <= ${hierarchical_index + 1} ORDER BY distance LIMIT $4)"
+            )
+        else:
+            branches.append(branch(index, collection.table_name, 'vector', None, f'embedding <=> {embedding}', '$4'))
+        branches.append(branch(
+            index, collection.table_name, 'lexical', f'{ts_vector} @@ {ts_query}',
+            f'ts_rank_cd({ts_vector}, {ts_query}) DESC', '$4'
+        ))
+        if articles and batch:
+            branches.append(branch(
+                index, collection.table_name, 'article',
+                f'{index} = ANY(question.fast_path_collections::integer[]) '
+                f'AND article = ANY(question.fast_path_articles::integer[])',
+                'article, chunk', '$5'
+            ))
+        elif articles and collection.article_fast_path:
+            branches.append(branch(
+                index, collection.table_name, 'article', f'article = ANY(${len(parameter_types)})', 'article, chunk', '$5'
+            ))
+
+    if not batch:
+        return ' UNION ALL '.join(branches), parameter_types, parameter_names
+
+    # the branches run once per question, rows carry the question's ordinal next to the rank
+    unnested = '$1, $2' + (f', ${len(parameter_types) - 1}, ${len(parameter_types)}' if articles else '')
+    columns = 'embedding, text' + (', fast_path_articles, fast_path_collections' if articles else '')
+    sql = (
+        f"SELECT question.ordinal, searches.* FROM unnest({unnested}) WITH ORDINALITY AS question({columns}, ordinal) "
+        f"CROSS JOIN LATERAL ({' UNION ALL '.join(branches)}) AS searches"
+    )
+
+    return sql, parameter_types, parameter_names
 
 
 # TODO: extend SqlEngine class
-def insert_embeddings(table_name: str, documents: List[EmbeddedDocument]) -> None:
+def search_collections(
+        collections: List[CollectionSearch],
+        embedding_array: np.array,
+        text: str,
+        embedding_model: str,
+        candidates: int,
+        article_limit: int,
+        articles: Optional[List[int]] = None,
+        filters: Optional[RetrievalFilter] = None
+) -> Dict[Tuple[str, str], List[EmbeddedDocument]]:
+    # every search of every collection in a single prepared statement and a single round-trip,
+    # results are keyed by (source, 'vector' | 'lexical' | 'article')
+    sql, parameter_types, parameter_names = build_collections_search(collections, filters, articles)
+
+    values = {
+        'embedding': encode_vector(embedding_array),
+        'text': text,
+        'embedding_model': embedding_model,
+        'candidates': candidates,
+        'article_limit': article_limit,
+        'fast_path_articles': list(articles or []),
+        'hierarchical_articles': HIERARCHICAL_ARTICLES,
+        'chunks_per_article': HIERARCHICAL_CHUNKS_PER_ARTICLE,
+    }
+    if filters is not None:
+        values.update({name: list(value) for name, value in filters._asdict().items() if value})
+
     pool = get_pool()
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            set_filtered_scan(cur, filters)
+            with tracer.span('db.execute', method='prepared', collections=len(collections)) as span:
+                execute_prepared(conn, cur, sql, parameter_types, [values[name] for name in parameter_names])
+                rows = cur.fetchall()
+                span.set_attribute('rows', len(rows))
+            cur.close()
+    finally:
+        put_conn(pool, conn)
+
+    return group_search_rows(collections, rows)
+
+
+def group_search_rows(
+        collections: List[CollectionSearch],
+        rows: List[tuple]
+) -> Dict[Tuple[str, str], List[EmbeddedDocument]]:
+    # rows are (collection, kind, SEARCH_COLUMNS..., rank) in any order, each list comes out in rank order
+    results: Dict[Tuple[str, str], List[EmbeddedDocument]] = {
+        (collection.source, kind): [] for collection in collections for kind in ('vector', 'lexical', 'article')
+    }
+    for index, kind, *row in sorted(rows, key=lambda item: (item[0], item[1], item[-1])):
+        source = collections[index].source
+        results[(source, kind)] += build_documents([tuple(row[:-1])], source)
+
+    return results
+
+
+def encode_array(values: Sequence[str]) -> str:
+    # postgres array literal of already encoded values (vectors, integer arrays), sent as a single parameter
+    return '{' + ','.join(f'"{value}"' for value in values) + '}'
 
-    delete_query = f"""DELETE FROM {table_name}"""
-    insert_query = f"""INSERT INTO {table_name} (article, url, contents, tokens, embedding) VALUES %s"""
 
-    documents_tuples = [
-        (document.article, document.url, document.contents, document.tokens, np.array(document.embedding))
-        for document in documents
-    ]
+# TODO: extend SqlEngine class
+def search_collections_batch(
+        collections: List[CollectionSearch],
+        embedding_arrays: List[np.array],
+        texts: List[str],
+        embedding_model: str,
+        candidates: int,
+        article_limit: int,
+        articles: Optional[List[List[int]]] = None,
+        article_sources: Optional[List[List[str]]] = None,
+        filters: Optional[RetrievalFilter] = None
+) -> List[Dict[Tuple[str, str], List[EmbeddedDocument]]]:
+    # search_collections for many questions in one statement, articles and article_sources are per question
+    # (an empty article_sources entry means every collection), results are in question order
+    articles = articles or [[] for _ in texts]
+    article_sources = article_sources or [[] for _ in texts]
+    has_articles = any(articles)
+    sql, parameter_types, parameter_names = build_collections_search(
+        collections, filters, [1] if has_articles else None, batch=True
+    )
 
-    with get_conn(pool) as conn:
-        register_vector(conn)
-        cur = conn.cursor()
+    values = {
+        'embeddings': encode_array([encode_vector(embedding_array) for embedding_array in embedding_arrays]),
+        'texts': list(texts),
+        'embedding_model': embedding_model,
+        'candidates': candidates,
+        'article_limit': article_limit,
+        'fast_path_articles': [
+            '{' + ','.join(str(article) for article in question_articles) + '}' for question_articles in articles
+        ],
+        'fast_path_collections': [
+            '{' + ','.join(
+                str(index) for index, collection in enumerate(collections)
+                if not sources or collection.source in sources
+            ) + '}'
+            for sources in article_sources
+        ],
+        'hierarchical_articles': HIERARCHICAL_ARTICLES,
+        'chunks_per_article': HIERARCHICAL_CHUNKS_PER_ARTICLE,
+    }
+    if filters is not None:
+        values.update({name: list(value) for name, value in filters._asdict().items() if value})
 
-        cur.execute(delete_query)
+    pool = get_pool()
+    conn = get_conn(pool)
+    try:
+        with conn:
+            cur = conn.cursor()
+            set_filtered_scan(cur, filters)
+            with tracer.span(
+                    'db.execute', method='prepared', collections=len(collections), questions=len(texts)
+            ) as span:
+                execute_prepared(conn, cur, sql, parameter_types, [values[name] for name in parameter_names])
+                rows = cur.fetchall()
+                span.set_attribute('rows', len(rows))
+            cur.close()
+    finally:
+        put_conn(pool, conn)
+
+    question_rows: List[List[tuple]] = [[] for _ in texts]
+    for ordinal, *row in rows:
+        question_rows[ordinal - 1].append(tuple(row))
+
+    return [group_search_rows(collections, item) for item in question_rows]
+
+
+def write_embeddings(cur, table_name: str, documents: Iterable[EmbeddedDocument], source: Optional[str] = None) -> None:
+    columns = 'chapter, section, article, url, contents, tokens, chunk, embedding, embedding_model'
+    if source is not None:
+        columns += ', source'
+
+    insert_query = f"""
+    INSERT INTO {table_name} ({columns})
+    VALUES %s
+    """
+
+    # fails on the first slice rather than as a cast error halfway through the load
+    dimensions = get_vector_dimensions(cur, table_name)
+
+    # documents may be a lazy stream (e.g. batch api results), write it in bounded slices
+    for documents_batch in batch_by(documents, EMBEDDINGS_INSERT_BATCH_SIZE):
+        check_dimensions(documents_batch, table_name, dimensions)
+        documents_tuples = [
+            (
+                document.chapter,
+                document.section,
+                document.article,
+                document.url,
+                document.contents,
+                document.tokens,
+                document.chunk,
+                np.array(document.embedding),
+                document.embedding_model,
+            ) + ((source,) if source is not None else ())
+            for document in documents_batch
+        ]
         execute_values(cur, insert_query, documents_tuples)
 
-        cur.close()
-        conn.commit()
 
-    put_conn(pool, conn)
+# TODO: extend SqlEngine class
+def insert_embeddings(table_name: str, documents: Iterable[EmbeddedDocument]) -> None:
+    pool = get_pool()
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            register_vector(conn)
+            cur = conn.cursor()
+
+            ensure_collection_schema(cur, table_name)
+            cur.execute(f"""DELETE FROM {table_name}""")
+            write_embeddings(cur, table_name, documents)
+
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
+
+
+# TODO: extend SqlEngine class
+def replace_partition(table_name: str, source: str, documents: Iterable[EmbeddedDocument]) -> None:
+    pool = get_pool()
+
+    partition_name = get_partition_name(table_name, source)
+    previous_name = f'{partition_name}_previous'
+    # unique per run so the staging indexes never collide with the names held by the live partition
+    staging_name = f'{partition_name}_{uuid.uuid4().hex[:8]}'
+
+    conn = get_conn(pool)
+    try:
+        with conn:
+            register_vector(conn)
+            cur = conn.cursor()
+
+            try:
+                # load and index a detached copy first, live queries keep reading the current partition meanwhile
+                cur.execute(f"""CREATE TABLE {staging_name} (LIKE {table_name} INCLUDING DEFAULTS)""")
+                write_embeddings(cur, staging_name, documents, source)
+                cur.execute(f"""ALTER TABLE {staging_name} ADD PRIMARY KEY (source, id)""")
+                # lets ATTACH skip the validation scan of the new rows
+                cur.execute(
+                    f"""ALTER TABLE {staging_name} ADD CONSTRAINT {get_index_name(staging_name, 'source_check')} """
+                    f"""CHECK (source = %(source)s)""",
+                    {'source': source}
+                )
+                create_collection_indexes(cur, staging_name)
+                conn.commit()
+
+            except Exception:
+                conn.rollback()
+                cur.execute(f"""DROP TABLE IF EXISTS {staging_name}""")
+                conn.commit()
+                raise
+
+            # swap in one short transaction: readers see either the old or the new partition
+            cur.execute(f"""DROP TABLE IF EXISTS {previous_name}""")
+            cur.execute("""SELECT to_regclass(%(partition)s) IS NOT NULL""", {'partition': partition_name})
+            if cur.fetchone()[0]:
+                cur.execute(f"""ALTER TABLE {table_name} DETACH PARTITION {partition_name}""")
+                cur.execute(f"""ALTER TABLE {partition_name} RENAME TO {previous_name.split('.')[-1]}""")
+            cur.execute(f"""ALTER TABLE {staging_name} RENAME TO {partition_name.split('.')[-1]}""")
+            cur.execute(
+                f"""ALTER TABLE {table_name} ATTACH PARTITION {partition_name} FOR VALUES IN (%(source)s)""",
+                {'source': source}
+            )
+            # centroids of the source are replaced in the same transaction as its chunks
+            cur.execute(
+                f"""DELETE FROM {get_centroids_table(table_name)} WHERE source = %(source)s""", {'source': source}
+            )
+            insert_source_centroids(cur, table_name, source, partition_name)
+            conn.commit()
+
+            cur.execute(f"""DROP TABLE IF EXISTS {previous_name}""")
+            cur.close()
+            conn.commit()
+    finally:
+        put_conn(pool, conn)
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from openai import OpenAI
+
+from src.document import EmbeddedDocument
+from src.rag_pipeline import batch_embeddings
+from src.rag_pipeline.batch_embeddings import get_embeddings_via_batch
+from src.rag_pipeline.run_report import RunReport
+from src.utils.fake_openai import FakeOpenAIServer, stub_embedding
+
+
+def get_chunks(count: int) -> list:
+    return [
+        EmbeddedDocument(
+            chapter=1, section=1, article=index, url='url', contents=f'article {index} text', tokens=3, chunk=0
+        ) for index in range(count)
+    ]
+
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer(batch_polls_until_complete=2) as fake_server:
+        yield fake_server
+
+
+def get_client(server: FakeOpenAIServer) -> OpenAI:
+    return OpenAI(api_key='fake', base_url=server.base_url, max_retries=0)
+
+
+def count_requests(server: FakeOpenAIServer, request: str) -> int:
+    return sum(1 for item in server.state.requests if item == request)
+
+
+def test_results_are_collected_before_returning(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(batch_embeddings, 'EMBEDDINGS_BATCH_MAX_REQUESTS', 2)
+    state_path = str(tmp_path / 'gdpr.json')
+    chunks = get_chunks(5)
+
+    documents = get_embeddings_via_batch(get_client(server), chunks, poll_interval=0, state_path=state_path)
+
+    # a list, not a generator: nothing is left to poll once a write transaction is opened
+    assert isinstance(documents, list)
+    assert [document.article for document in documents] == [0, 1, 2, 3, 4]
+    assert documents[3].embedding == pytest.approx(stub_embedding('article 3 text'))
+    assert count_requests(server, 'POST /v1/batches') == 3
+    with open(state_path) as file:
+        assert len(json.load(file)['batch_ids']) == 3
+
+
+def test_rerun_collects_the_submitted_batches(server, tmp_path):
+    state_path = str(tmp_path / 'gdpr.json')
+    chunks = get_chunks(3)
+
+    first = get_embeddings_via_batch(get_client(server), chunks, poll_interval=0, state_path=state_path)
+    second = get_embeddings_via_batch(get_client(server), chunks, poll_interval=0, state_path=state_path)
+
+    assert count_requests(server, 'POST /v1/batches') == 1
+    assert [document.contents for document in second] == [document.contents for document in first]
+
+
+def test_changed_chunks_are_submitted_again(server, tmp_path):
+    state_path = str(tmp_path / 'gdpr.json')
+
+    get_embeddings_via_batch(get_client(server), get_chunks(3), poll_interval=0, state_path=state_path)
+    documents = get_embeddings_via_batch(get_client(server), get_chunks(4), poll_interval=0, state_path=state_path)
+
+    assert len(documents) == 4
+    assert count_requests(server, 'POST /v1/batches') == 2
+
+
+def test_failed_batch_clears_the_state(server, monkeypatch, tmp_path):
+    state_path = str(tmp_path / 'gdpr.json')
+
+    def expire(client, batch_id, poll_interval):
+        raise RuntimeError(f'Embeddings batch {batch_id} finished with status expired')
+
+    monkeypatch.setattr(batch_embeddings, 'wait_for_batch', expire)
+    with pytest.raises(RuntimeError):
+        get_embeddings_via_batch(get_client(server), get_chunks(2), poll_interval=0, state_path=state_path)
+
+    # the expired batch is not picked up again, the next run submits a new one
+    assert not (tmp_path / 'gdpr.json').exists()
+    monkeypatch.undo()
+    assert len(get_embeddings_via_batch(get_client(server), get_chunks(2), poll_interval=0, state_path=state_path)) == 2
+    assert count_requests(server, 'POST /v1/batches') == 2
+
+
+def test_report_counts_batches_not_result_lines(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(batch_embeddings, 'EMBEDDINGS_BATCH_MAX_REQUESTS', 2)
+    report = RunReport(pipeline='upload_embeddings', embedding_model='text-embedding-ada-002', batch_api=True)
+
+    get_embeddings_via_batch(get_client(server), get_chunks(5), poll_interval=0, report=report)
+
+    # three batches submitted, three results files downloaded
+    assert report.api_calls == 6
+    assert report.usage_tokens == 5 * 3
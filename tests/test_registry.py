@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from src.rag_pipeline import registry
+from src.rag_pipeline.registry import MAX_DATA_SOURCE_NAME_LENGTH, load_data_sources
+
+
+def write_sources(monkeypatch, tmp_path, names: list) -> None:
+    path = tmp_path / 'sources.json'
+    with open(path, mode='w') as file:
+        json.dump([
+            {
+                'name': name, 'title': name, 'table_name': f'{name}_documents', 'collection_name': f'{name}_embeddings',
+                'content': f'{name}.pdf', 'schema': f'{name}.csv', 'key_word': 'Article', 'start_page': 1,
+                'end_page': 2, 'updated_at': '2024-01-01',
+            }
+            for name in names
+        ], file)
+    monkeypatch.setattr(registry, 'DATA_SOURCES_TABLE', None)
+    monkeypatch.setattr(registry, 'DATA_SOURCES_PATH', str(path))
+
+
+def test_valid_names_are_loaded(monkeypatch, tmp_path):
+    write_sources(monkeypatch, tmp_path, ['gdpr', 'ai_act', 'a' * MAX_DATA_SOURCE_NAME_LENGTH])
+
+    assert [config.name for config in load_data_sources()] == ['gdpr', 'ai_act', 'a' * MAX_DATA_SOURCE_NAME_LENGTH]
+
+
+@pytest.mark.parametrize('name', ['eu-ai-act', 'AI_Act', '1gdpr', 'ai act', 'a' * (MAX_DATA_SOURCE_NAME_LENGTH + 1)])
+def test_names_unusable_as_identifiers_are_rejected(monkeypatch, tmp_path, name):
+    write_sources(monkeypatch, tmp_path, ['gdpr', name])
+
+    with pytest.raises(ValueError, match='Invalid data source names'):
+        load_data_sources()
+
+
+def test_duplicate_names_are_rejected(monkeypatch, tmp_path):
+    write_sources(monkeypatch, tmp_path, ['gdpr', 'gdpr'])
+
+    with pytest.raises(ValueError, match='Duplicate data source names'):
+        load_data_sources()
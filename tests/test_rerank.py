@@ -0,0 +1,61 @@
+import threading
+
+from src.document import EmbeddedDocument
+from src.rag_api_gateway import rerank as rerank_module
+from src.rag_api_gateway.rerank import rerank
+
+
+class BlockingReranker:
+    # scores only once released, stands in for a slow cross-encoder forward pass
+    def __init__(self) -> None:
+        self.release = threading.Event()
+        self.calls = 0
+
+    def score(self, query, texts):
+        self.calls += 1
+        self.release.wait(5)
+        return [float(index) for index in range(len(texts))]
+
+
+def get_documents() -> list:
+    return [
+        EmbeddedDocument(article=1, url='url/1', contents='transfers to third countries', tokens=4),
+        EmbeddedDocument(article=2, url='url/2', contents='consent of the data subject', tokens=5),
+    ]
+
+
+def test_over_budget_falls_back_to_lexical():
+    reranker = BlockingReranker()
+    try:
+        documents = rerank('consent', get_documents(), reranker, top_k=2, time_budget=0.01)
+    finally:
+        reranker.release.set()
+
+    assert [document.article for document in documents] == [2, 1]
+
+
+def test_busy_reranker_is_skipped(monkeypatch):
+    monkeypatch.setattr(rerank_module, '_slots', threading.BoundedSemaphore(1))
+    reranker = BlockingReranker()
+    try:
+        rerank('consent', get_documents(), reranker, top_k=2, time_budget=0.01)
+        # the first call still holds the only slot, the second one does not queue behind it
+        documents = rerank('consent', get_documents(), reranker, top_k=2, time_budget=0.01)
+    finally:
+        reranker.release.set()
+
+    assert reranker.calls == 1
+    assert [document.article for document in documents] == [2, 1]
+
+
+def test_slot_is_returned_once_scoring_finishes(monkeypatch):
+    monkeypatch.setattr(rerank_module, '_slots', threading.BoundedSemaphore(1))
+    reranker = BlockingReranker()
+    reranker.release.set()
+
+    for _ in range(3):
+        documents = rerank('transfers', get_documents(), reranker, top_k=2, time_budget=5)
+
+    assert reranker.calls == 3
+    # scores from the reranker itself, higher index first
+    assert [document.article for document in documents] == [2, 1]
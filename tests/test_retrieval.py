@@ -0,0 +1,27 @@
+from src.rag_api_gateway import retrieval
+
+
+def test_collections_without_centroids_are_searched_flat(monkeypatch):
+    checks = []
+    monkeypatch.setattr(retrieval, 'HIERARCHICAL_RETRIEVAL', True)
+    monkeypatch.setattr(retrieval, 'centroid_checks', {})
+
+    def has_article_centroids(table_name, source=None):
+        checks.append(table_name)
+        return table_name == 'gdpr'
+
+    monkeypatch.setattr(retrieval, 'has_article_centroids', has_article_centroids)
+
+    assert retrieval.use_hierarchical_search('gdpr')
+    assert not retrieval.use_hierarchical_search('ai_act')
+    # cached, not asked again before HIERARCHICAL_RECHECK_SECONDS
+    assert retrieval.use_hierarchical_search('gdpr')
+    assert not retrieval.use_hierarchical_search('ai_act')
+    assert checks == ['gdpr', 'ai_act']
+
+
+def test_hierarchical_search_off(monkeypatch):
+    monkeypatch.setattr(retrieval, 'HIERARCHICAL_RETRIEVAL', False)
+    monkeypatch.setattr(retrieval, 'has_article_centroids', lambda table_name, source=None: True)
+
+    assert not retrieval.use_hierarchical_search('gdpr')
@@ -0,0 +1,97 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+from typing import Optional
+
+from src.rag_api_gateway.batch_answer import BatchAnswer
+from src.rag_api_gateway.server import BadRequest, GatewayApp, parse_filters
+from src.vector_storage import RetrievalFilter
+
+
+def test_parse_filters():
+    assert parse_filters(None) is None
+    filters = parse_filters({'sources': ['gdpr'], 'articles': [5, 6]})
+    assert filters == RetrievalFilter(sources=['gdpr'], articles=[5, 6])
+
+
+@pytest.mark.parametrize('payload', [
+    ['gdpr'],
+    {'topics': ['privacy']},
+    {'articles': 5},
+    {'articles': [[5]]},
+    {'chapters': ['1']},
+    {'sections': [True]},
+    {'sources': [['gdpr']]},
+])
+def test_parse_filters_rejects(payload):
+    # anything else would reach the question key or the query and fail there with a 500
+    with pytest.raises(BadRequest):
+        parse_filters(payload)
+
+
+class SlowBatch:
+    # yields one answer per question, slowly, and records how far it got
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.yielded = 0
+        self.closed = False
+
+    def answer(self, questions, filters=None):
+        try:
+            for index, question in enumerate(questions):
+                time.sleep(self.delay)
+                self.yielded += 1
+                yield BatchAnswer(index, question, f'answer {index}', None, False, {})
+        finally:
+            self.closed = True
+
+
+def post_batch(app: GatewayApp, questions: list, disconnect_after: Optional[float] = None) -> list:
+    body = json.dumps({'questions': questions}).encode('utf-8')
+    sent = []
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        if disconnect_after is None:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(disconnect_after)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/answer/batch'}
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+def test_batch_streams_every_answer():
+    batch = SlowBatch()
+    sent = post_batch(GatewayApp(batch=batch), ['a', 'b', 'c'])
+
+    assert sent[0]['status'] == 200
+    lines = [json.loads(message['body']) for message in sent[1:] if message.get('body')]
+    assert [line['answer'] for line in lines] == ['answer 0', 'answer 1', 'answer 2']
+    assert batch.closed
+
+
+def test_batch_stops_when_the_client_disconnects():
+    batch = SlowBatch(delay=0.02)
+    post_batch(GatewayApp(batch=batch), [f'question {index}' for index in range(200)], disconnect_after=0.1)
+
+    assert batch.closed
+    assert batch.yielded < 200
+
+
+def test_batches_over_the_limit_are_rejected():
+    app = GatewayApp(batch=SlowBatch(), max_batches=1)
+    app.running_batches = 1
+
+    sent = post_batch(app, ['a'])
+
+    assert sent[0]['status'] == 503
@@ -0,0 +1,215 @@
+import numpy as np
+import psycopg2
+import pytest
+
+from src import vector_storage
+from src.rag_pipeline.configs import FULL_TEXT_LANGUAGE
+from src.vector_storage import (
+    CollectionSearch,
+    RetrievalFilter,
+    build_collections_search,
+    execute_prepared,
+    get_ts_query,
+    group_search_rows,
+    search_collections,
+    set_filtered_scan
+)
+
+
+COLLECTIONS = [
+    CollectionSearch('gdpr_embeddings', 'gdpr', article_fast_path=True),
+    CollectionSearch('ai_act_embeddings', 'ai_act', article_fast_path=False),
+]
+# the first collection has article centroids, the second is searched flat
+HIERARCHICAL_COLLECTIONS = [COLLECTIONS[0]._replace(hierarchical=True), COLLECTIONS[1]]
+
+
+def get_row(article: int, chunk: int) -> tuple:
+    return 1, 2, article, f'url/{article}', f'article {article} chunk {chunk}', 10, chunk, 'model'
+
+
+def test_search_parameters():
+    sql, parameter_types, parameter_names = build_collections_search(COLLECTIONS)
+
+    assert parameter_types == ['vector', 'text', 'text', 'integer', 'integer']
+    assert parameter_names == ['embedding', 'text', 'embedding_model', 'candidates', 'article_limit']
+    assert sql.count(' UNION ALL ') == 3
+    assert '$6' not in sql
+
+
+def test_every_branch_projects_its_rank():
+    sql, _, _ = build_collections_search(HIERARCHICAL_COLLECTIONS, articles=[5])
+
+    branches = sql.split(' UNION ALL ')
+    # vector and lexical of both collections, the article fast path of the first one only
+    assert len(branches) == 5
+    for branch in branches:
+        assert 'AS rank' in branch
+    assert 'row_number() OVER (ORDER BY ts_rank_cd(' in branches[1]
+    assert 'row_number() OVER (ORDER BY article, chunk) AS rank' in branches[2]
+    assert 'row_number() OVER (ORDER BY distance) AS rank' in branches[0]
+    assert 'row_number() OVER (ORDER BY embedding <=> $1) AS rank' in branches[3]
+
+
+def test_filters_and_fast_path_parameters():
+    filters = RetrievalFilter(sources=['gdpr'], chapters=[1], sections=None, articles=[5, 6])
+    sql, parameter_types, parameter_names = build_collections_search(COLLECTIONS, filters, articles=[5])
+
+    assert parameter_names[5:] == ['chapters', 'articles', 'fast_path_articles']
+    assert parameter_types[5:] == ['integer[]', 'integer[]', 'integer[]']
+    assert 'chapter = ANY($6)' in sql
+    assert 'article = ANY($7)' in sql
+    assert 'article = ANY($8)' in sql
+
+
+def test_hierarchical_parameters():
+    sql, parameter_types, parameter_names = build_collections_search(HIERARCHICAL_COLLECTIONS)
+
+    assert parameter_names[-2:] == ['hierarchical_articles', 'chunks_per_article']
+    assert 'FROM gdpr_embeddings_articles' in sql
+    assert 'ai_act_embeddings_articles' not in sql
+    assert 'LIMIT $6' in sql
+    assert 'article_rank <= $7' in sql
+
+
+def test_batch_runs_the_searches_per_question():
+    sql, parameter_types, parameter_names = build_collections_search(COLLECTIONS, articles=[1], batch=True)
+
+    assert parameter_types[:2] == ['vector[]', 'text[]']
+    assert parameter_names[-2:] == ['fast_path_articles', 'fast_path_collections']
+    assert sql.startswith('SELECT question.ordinal, searches.* FROM unnest($1, $2, $6, $7) WITH ORDINALITY')
+    assert 'CROSS JOIN LATERAL' in sql
+    assert 'embedding <=> question.embedding' in sql
+    # the fast path is decided per question, so every collection has the article branch
+    assert sql.count("'article' AS kind") == 2
+
+
+def test_ts_query_matches_any_word():
+    ts_query = get_ts_query('$2')
+
+    assert ts_query.startswith("to_tsquery('simple', ")
+    assert "' | '" in ts_query
+    assert f"to_tsvector('{FULL_TEXT_LANGUAGE}', $2)" in ts_query
+
+
+def test_rows_are_grouped_in_rank_order():
+    # branches of a UNION ALL may come back interleaved and out of order
+    rows = [
+        (1, 'lexical', *get_row(3, 0), 2),
+        (0, 'vector', *get_row(2, 0), 2),
+        (1, 'lexical', *get_row(4, 0), 1),
+        (0, 'vector', *get_row(1, 0), 1),
+        (0, 'article', *get_row(7, 1), 2),
+        (0, 'article', *get_row(7, 0), 1),
+    ]
+
+    results = group_search_rows(COLLECTIONS, rows)
+
+    assert [document.article for document in results[('gdpr', 'vector')]] == [1, 2]
+    assert [document.article for document in results[('ai_act', 'lexical')]] == [4, 3]
+    assert [document.chunk for document in results[('gdpr', 'article')]] == [0, 1]
+    assert results[('ai_act', 'vector')] == []
+    assert all(document.source == 'gdpr' for document in results[('gdpr', 'vector')])
+
+
+def test_partitioned_search_runs_per_source(monkeypatch):
+    queries = []
+    monkeypatch.setattr(vector_storage, 'fetch_documents', lambda query, *args: queries.append(query) or [])
+    filters = RetrievalFilter(sources=['gdpr', 'ai_act'], chapters=[2])
+
+    vector_storage.get_lexical_documents('embeddings', 'consent', 'model', 20, None, filters, partitioned=True)
+    vector_storage.get_hierarchical_documents(
+        'embeddings', np.zeros(3), 'model', 20, None, filters, partitioned=True, articles=8
+    )
+
+    for query in queries:
+        assert query['sql'].startswith('SELECT searches.* FROM unnest(%(sources)s::text[]) AS per_source(source)')
+        assert query['sources'] == ['gdpr', 'ai_act']
+        assert 'source = ANY' not in query['sql']
+    # the limits and the article centroids are per source
+    assert 'LIMIT 20' in queries[0]['sql']
+    assert (
+        'FROM embeddings_articles WHERE embedding_model = %(param2)s AND source = per_source.source'
+        in queries[1]['sql']
+    )
+
+
+class RecordingCursor:
+    def __init__(self) -> None:
+        self.statements = []
+
+    def execute(self, sql, parameters=None):
+        self.statements.append((sql, parameters))
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self) -> None:
+        self.cur = RecordingCursor()
+        self.prepared_statements = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def cursor(self):
+        return self.cur
+
+
+def test_filtered_scan_is_only_set_for_filters():
+    cur = RecordingCursor()
+    set_filtered_scan(cur, None)
+    set_filtered_scan(cur, RetrievalFilter(sources=['gdpr']))
+    assert cur.statements == []
+
+    set_filtered_scan(cur, RetrievalFilter(chapters=[2]))
+    assert cur.statements == [
+        ('SET LOCAL hnsw.ef_search = %(ef_search)s', {'ef_search': vector_storage.HNSW_FILTERED_EF_SEARCH}),
+        ('SET LOCAL hnsw.iterative_scan = %(scan)s', {'scan': vector_storage.HNSW_ITERATIVE_SCAN}),
+    ]
+
+
+def test_filtered_search_sets_the_scan_before_the_query(monkeypatch):
+    conn = RecordingConnection()
+    monkeypatch.setattr(vector_storage, 'get_pool', lambda: None)
+    monkeypatch.setattr(vector_storage, 'get_conn', lambda pool: conn)
+    monkeypatch.setattr(vector_storage, 'put_conn', lambda pool, connection: None)
+
+    search_collections(COLLECTIONS, np.zeros(3), 'consent', 'model', 20, 10, filters=RetrievalFilter(chapters=[2]))
+
+    statements = [sql for sql, _ in conn.cur.statements]
+    assert statements[0].startswith('SET LOCAL hnsw.ef_search')
+    assert statements[1].startswith('SET LOCAL hnsw.iterative_scan')
+    assert statements[2].startswith('PREPARE ')
+
+
+class BrokenConnection:
+    # the server went away: the statement failed and so does anything sent after it
+    def __init__(self, closed: int) -> None:
+        self.closed = closed
+        self.prepared_statements = {'q_stale'}
+
+    def rollback(self):
+        raise psycopg2.InterfaceError('connection already closed')
+
+
+class FailingCursor:
+    def execute(self, sql, parameters=None):
+        raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+
+@pytest.mark.parametrize('closed', [0, 2])
+def test_failed_statement_error_survives_the_cleanup(closed):
+    conn = BrokenConnection(closed)
+
+    with pytest.raises(psycopg2.OperationalError):
+        execute_prepared(conn, FailingCursor(), 'SELECT 1', [], [])
+
+    assert conn.prepared_statements == set()